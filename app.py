@@ -1,280 +1,399 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template, request, jsonify, send_from_directory, Response
+from flask import Flask, render_template, request, jsonify, Response, g
 from flask_cors import CORS
 import requests
 import json
 import os
 from pathlib import Path
+import re
 import time
 import uuid
 
+from batch import DEFAULT_CONCURRENCY as BATCH_DEFAULT_CONCURRENCY, BatchRunner, load_checkpoint
+from catalog import CatalogSnapshot, cache_from_env
+from classifier import generate_model_categories
+from compare import CompareStream
+from context import context_from_env
+from conversations import store_from_env
+from credentials import credentials_from_env, reload_on_sighup
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram
+from relay import StreamRelay, publish_stream, replay_events, sse_event
+from response_cache import request_key, response_cache_from_env
+from routing import DirectStream, router_from_env
+from scheduler import QueueFull, scheduler_from_env
+from semantic_cache import semantic_cache_from_env
+from singleflight import Broadcast, SingleFlight
+from static import static_from_env
+from streams import client_socket, registry_from_env
+from tokens import UsageStats, estimate_usage, normalize_usage
+from tracing import activate_trace, current_trace, trace_span, tracer_from_env
+from upstream import client_from_env
+
 app = Flask(__name__)
 CORS(app)
 
-def load_api_key():
-    """Load OpenRouter API key from environment variable or file"""
-    # Try environment variable first (for production)
-    api_key = os.environ.get('OPENROUTER_API_KEY')
-    if api_key:
-        return api_key
+# One pooled keep-alive client shared by every OpenRouter call in this worker; chats hold a scheduler
+# slot, so their 429s go back to the scheduler (scheduler.observe) instead of being slept out in place
+upstream = client_from_env(retry_rate_limits=False)
+
+# Identical concurrent upstream calls (catalog loads, chats, streams) share one request
+flights = SingleFlight()
+
+# Admission control for upstream chat calls: concurrency caps, learned rate limits, fair queue
+scheduler = scheduler_from_env()
+
+# Token counts per model, from upstream usage or local estimates
+usage_stats = UsageStats()
+
+# Packs chat history into each model's context window
+context_builder = context_from_env()
+
+# Server-side chat history, so clients only send the new message each turn
+conversations = store_from_env()
+
+# Completed replies to identical requests, replayed instead of asking upstream again
+response_cache = response_cache_from_env()
+
+# Optional: replies to earlier first messages, matched by similarity instead of exact text
+semantic_cache = semantic_cache_from_env()
+
+# Per-model first-token latency and error rates; optionally hedges slow streams
+router = router_from_env()
+
+# Streams in progress, so a "stop generating" click or a closed tab cancels the upstream call
+streams = registry_from_env()
+
+# index.html, script.js and style.css, fingerprinted and compressed once at startup
+static_bundle = static_from_env(Path(__file__).parent)
+
+# Per-request stage timings for /api/debug/slow, and sampled profiles of slow requests
+tracer = tracer_from_env()
+
+# Prometheus metrics for /api/metrics; model labels are limited to catalog ids (others count as "other")
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                        ('endpoint', 'method', 'status'))
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds',
+                                 'Time to produce a response; for streams, until the stream starts', ('endpoint',))
+CHAT_REQUESTS = Counter('chat_requests_total', 'Chat requests by model, mode and outcome', ('model', 'mode', 'outcome'))
+CHAT_SECONDS = Histogram('chat_duration_seconds', 'Time to a complete upstream reply', ('model', 'mode'))
+CHAT_TTFT_SECONDS = Histogram('chat_time_to_first_token_seconds', 'Time from sending a streamed chat to its first token',
+                              ('model',))
+CHAT_TOKENS_PER_SECOND = Histogram('chat_stream_tokens_per_second', 'Completion tokens per second after the first token',
+                                   ('model',), buckets=(1, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500, 1000))
+ACTIVE_STREAMS = Gauge('chat_active_streams', 'Streaming chat responses in progress')
+CATALOG_FETCH_SECONDS = Histogram('catalog_fetch_seconds', 'Time to download the upstream model catalog')
+CATALOG_ENRICH_SECONDS = Histogram('catalog_enrich_seconds', 'Time to enrich and categorize the downloaded catalog')
+
+# OpenRouter keys, read once; the key file is re-read when it changes or on SIGHUP
+credentials = credentials_from_env()
+reload_on_sighup(credentials)
+
+def upstream_headers(key):
+    """Headers for an OpenRouter chat call with an ApiKey, tagged with the id of the request being served"""
+    trace = current_trace()
+    if trace is None:
+        return key.headers
+    return {**key.headers, "X-Request-ID": trace.request_id}
+
+def enrich_model(model):
+    """Turn one raw OpenRouter model record into the catalog entry the UI and API serve"""
+    pricing = model.get('pricing', {})
+    prompt_price = pricing.get('prompt', '0')
     
-    # Fall back to local file (for development)
-    env_file = Path.home() / "api_keys.env"
-    if not env_file.exists():
-        env_file = Path(__file__).parent.parent.parent / "api_keys.env"
+    is_free = prompt_price == '0' or ':free' in model.get('id', '')
     
-    if not env_file.exists():
-        raise FileNotFoundError(f"API keys file not found at {env_file}")
+    # Extract architecture info
+    architecture = model.get('architecture', {})
     
-    with open(env_file, 'r') as f:
-        for line in f:
-            if line.startswith('openrouter_api_key='):
-                return line.split('=', 1)[1].strip()
+    # Extract provider info
+    top_provider = model.get('top_provider', {})
     
-    raise ValueError("openrouter_api_key not found in api_keys.env")
-
-def generate_model_categories(model):
-    """Generate categories/tags for a model based on its metadata"""
-    categories = []
+    # Parse model ID for provider
+    model_id = model.get('id', '')
+    provider = model_id.split('/')[0] if '/' in model_id else 'unknown'
     
-    # Get model info
-    name = model.get('name', '').lower()
-    description = model.get('description', '').lower()
-    model_id = model.get('id', '').lower()
-    architecture = model.get('architecture', {})
-    capabilities = model.get('capabilities', {})
-    
-    # Modality-based categories
-    input_modalities = architecture.get('input_modalities', [])
-    if 'image' in input_modalities:
-        categories.append('vision')
-    if 'text' in input_modalities and 'image' in input_modalities:
-        categories.append('multimodal')
-    
-    # Capability-based categories
-    supported_params = capabilities.get('supported_parameters', [])
-    if 'tools' in supported_params:
-        categories.append('tools')
-    if 'reasoning' in supported_params:
-        categories.append('reasoning')
-        
-    # Content analysis from name and description
-    content_keywords = {
-        'code': ['code', 'programming', 'developer', 'coding', 'github', 'python', 'javascript'],
-        'math': ['math', 'mathematical', 'calculation', 'solver', 'theorem'],
-        'reasoning': ['reasoning', 'logic', 'analysis', 'think', 'step-by-step'],
-        'creative': ['creative', 'writing', 'story', 'literature', 'poetry', 'novel'],
-        'roleplay': ['roleplay', 'character', 'persona', 'chat', 'assistant'],
-        'uncensored': ['uncensored', 'nsfw', 'unfiltered', 'unconstrained'],
-        'fast': ['fast', 'speed', 'quick', 'nano', 'turbo', 'instant'],
-        'large': ['large', 'big', 'giant', 'huge', 'massive'],
-        'small': ['small', 'mini', 'tiny', 'lite', 'compact']
+    # Format creation date
+    created_timestamp = model.get('created', 0)
+    import datetime
+    try:
+        created_date = datetime.datetime.fromtimestamp(created_timestamp).strftime('%Y-%m-%d') if created_timestamp else 'Unknown'
+    except:
+        created_date = 'Unknown'
+    
+    # Add pricing info
+    price_info = {
+        'is_free': is_free,
+        'prompt_price': prompt_price,
+        'completion_price': pricing.get('completion', '0')
     }
     
-    combined_text = f"{name} {description} {model_id}"
-    
-    for category, keywords in content_keywords.items():
-        if any(keyword in combined_text for keyword in keywords):
-            categories.append(category)
-    
-    # Provider-specific categories
-    provider = model.get('id', '').split('/')[0]
-    provider_specialties = {
-        'anthropic': ['reasoning', 'helpful'],
-        'openai': ['general', 'popular'],
-        'meta-llama': ['open-source'],
-        'google': ['research', 'advanced'],
-        'mistralai': ['efficient'],
-        'deepseek': ['reasoning', 'code'],
-        'qwen': ['multilingual'],
-        'microsoft': ['enterprise'],
-        'cohere': ['search', 'embeddings']
+    # Generate categories/tags
+    categories = generate_model_categories(model)
+    
+    return {
+        'id': model.get('id'),
+        'name': model.get('name', 'Unknown'),
+        'description': model.get('description', ''),
+        'context_length': model.get('context_length', 'Unknown'),
+        'provider': provider,
+        'created_date': created_date,
+        'hugging_face_id': model.get('hugging_face_id', ''),
+        'canonical_slug': model.get('canonical_slug', ''),
+        'pricing': price_info,
+        'categories': categories,
+        'architecture': {
+            'modality': architecture.get('modality', 'Unknown'),
+            'input_modalities': architecture.get('input_modalities', []),
+            'output_modalities': architecture.get('output_modalities', []),
+            'tokenizer': architecture.get('tokenizer', 'Unknown'),
+            'instruct_type': architecture.get('instruct_type', None)
+        },
+        'capabilities': {
+            'max_completion_tokens': top_provider.get('max_completion_tokens', 'Unknown'),
+            'is_moderated': top_provider.get('is_moderated', False),
+            'supported_parameters': model.get('supported_parameters', [])
+        },
+        'safety_info': {
+            'is_moderated': top_provider.get('is_moderated', False),
+            'per_request_limits': model.get('per_request_limits', None)
+        }
     }
+
+def fetch_models():
+    """Fetch the full model catalog from OpenRouter and enrich it with metadata"""
+    key = credentials.get()
+    started = time.perf_counter()
+    
+    response = upstream.get(
+        '/models',
+        headers=key.headers,
+        timeout=10
+    )
+    credentials.observe(key, response.status_code)
     
-    if provider in provider_specialties:
-        categories.extend(provider_specialties[provider])
+    if response.status_code != 200:
+        raise Exception(f"API returned status {response.status_code}")
     
-    # Context length categories
-    context_length = model.get('context_length', 0)
-    if isinstance(context_length, int):
-        if context_length >= 128000:
-            categories.append('long-context')
-        elif context_length >= 32000:
-            categories.append('medium-context')
-        elif context_length <= 8192:
-            categories.append('short-context')
+    data = response.json()
+    models = data.get('data', [])
+    fetched = time.perf_counter()
+    CATALOG_FETCH_SECONDS.observe(fetched - started)
     
-    # Remove duplicates and return
-    return list(set(categories))
+    # Include rich metadata for every model
+    enriched_models = [enrich_model(model) for model in models]
+    
+    CATALOG_ENRICH_SECONDS.observe(time.perf_counter() - fetched)
+    return enriched_models
+
+catalog_cache = cache_from_env(fetch_models, flights, source=upstream.base_url)
+
+# Served when nothing has been loaded or saved yet and upstream is unreachable; enriched like the
+# live catalog so every endpoint and filter sees the same fields
+FALLBACK_MODELS = [enrich_model(model) for model in [
+    {
+        'id': 'meta-llama/llama-3.1-8b-instruct:free',
+        'name': 'Llama 3.1 8B (Free)',
+        'description': 'Meta\'s Llama 3.1 8B model',
+        'context_length': 131072,
+        'pricing': {'prompt': '0', 'completion': '0'}
+    },
+    {
+        'id': 'google/gemma-2-9b-it:free',
+        'name': 'Gemma 2 9B (Free)',
+        'description': 'Google\'s Gemma 2 9B model',
+        'context_length': 8192,
+        'pricing': {'prompt': '0', 'completion': '0'}
+    },
+    {
+        'id': 'mistralai/mistral-7b-instruct:free',
+        'name': 'Mistral 7B (Free)',
+        'description': 'Mistral\'s 7B instruction model',
+        'context_length': 32768,
+        'pricing': {'prompt': '0', 'completion': '0'}
+    },
+    {
+        'id': 'qwen/qwen-2.5-72b-instruct:free',
+        'name': 'Qwen 2.5 72B (Free)',
+        'description': 'Qwen\'s large language model',
+        'context_length': 32768,
+        'pricing': {'prompt': '0', 'completion': '0'}
+    }
+]]
+
+fallback_snapshot = CatalogSnapshot(FALLBACK_MODELS, 0, 0)
+
+def get_catalog_snapshot():
+    """Get the current catalog snapshot, or one over the fallback models"""
+    snapshot = catalog_cache.get()
+    return snapshot if snapshot is not None else fallback_snapshot
+
+def get_model_index():
+    """Get the index over the current catalog snapshot"""
+    return get_catalog_snapshot().index
 
 def get_models(filter_type='all'):
-    """Get list of models from OpenRouter with optional filtering"""
-    try:
-        api_key = load_api_key()
-        
-        response = requests.get(
-            url="https://openrouter.ai/api/v1/models",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            timeout=10
+    """Get list of models from the cached catalog with optional filtering"""
+    return get_model_index().filter(price=filter_type)
+
+def build_chat_messages(message, history=None, model_id=None):
+    """Build the upstream messages list from as much recent history as fits the model's context"""
+    return context_builder.build(message, history, get_model_index().get(model_id))
+
+def build_chat_payload(model_id, messages, stream=False):
+    """Build the OpenRouter chat completion request body"""
+    payload = {
+        "model": model_id,
+        "messages": messages,
+        "max_tokens": context_builder.completion_tokens(get_model_index().get(model_id)),
+        "temperature": 0.7
+    }
+    if stream:
+        payload["stream"] = True
+        # Ask upstream to append a usage chunk with real token counts
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+def get_model_tokenizer(model_id):
+    """The catalog's architecture.tokenizer for a model, if known"""
+    model = get_model_index().get(model_id)
+    if not model:
+        return None
+    return model.get('architecture', {}).get('tokenizer')
+
+def estimate_chat_usage(model_id, message, history, completion):
+    """Local token estimate for a chat turn when upstream reports no usage"""
+    messages = build_chat_messages(message, history, model_id)
+    return estimate_usage(messages, completion, get_model_tokenizer(model_id))
+
+def metric_model(model_id):
+    """Model label for metrics: catalog ids as-is, anything else as "other" to bound the label set"""
+    return model_id if get_model_index().get(model_id) is not None else 'other'
+
+def record_chat(model_id, mode, outcome, duration=None, ttft=None, completion_tokens=None):
+    """Count a finished chat request and its timings in the metrics"""
+    trace = current_trace()
+    if trace is not None:
+        trace.annotate(model=model_id, outcome=outcome)
+    model = metric_model(model_id)
+    CHAT_REQUESTS.labels(model, mode, outcome).inc()
+    if duration is not None:
+        CHAT_SECONDS.labels(model, mode).observe(duration)
+    if ttft is not None:
+        CHAT_TTFT_SECONDS.labels(model).observe(ttft)
+        if completion_tokens and duration is not None and duration > ttft:
+            CHAT_TOKENS_PER_SECOND.labels(model).observe(completion_tokens / (duration - ttft))
+
+def request_client_id():
+    """Who is asking, for fair queueing: the first X-Forwarded-For hop behind a proxy, else the peer"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return forwarded.split(',')[0].strip() or request.remote_addr or 'unknown'
+
+def resolve_history(data):
+    """History for a chat request: the stored conversation if one is named, else the posted history
+
+    Returns (history, error_message); the error means the conversation id is unknown.
+    """
+    conversation_id = data.get('conversation_id')
+    if not conversation_id:
+        return data.get('history', []), None
+    
+    history = conversations.get(conversation_id)
+    if history is None:
+        return None, 'Conversation not found'
+    return history, None
+
+def commit_turn(conversation_id, message, reply):
+    """Record a completed exchange in its server-side conversation, if there is one"""
+    if conversation_id:
+        conversations.append(
+            conversation_id,
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": reply}
         )
-        
-        if response.status_code == 200:
-            data = response.json()
-            models = data.get('data', [])
-            
-            # Filter models based on filter_type and include rich metadata
-            filtered_models = []
-            for model in models:
-                pricing = model.get('pricing', {})
-                prompt_price = pricing.get('prompt', '0')
-                
-                # Apply filtering based on filter_type
-                is_free = prompt_price == '0' or ':free' in model.get('id', '')
-                
-                if filter_type == 'free' and not is_free:
-                    continue
-                elif filter_type == 'paid' and is_free:
-                    continue
-                # filter_type == 'all' includes everything
-                
-                # Extract architecture info
-                architecture = model.get('architecture', {})
-                
-                # Extract provider info
-                top_provider = model.get('top_provider', {})
-                
-                # Parse model ID for provider
-                model_id = model.get('id', '')
-                provider = model_id.split('/')[0] if '/' in model_id else 'unknown'
-                
-                # Format creation date
-                created_timestamp = model.get('created', 0)
-                import datetime
-                try:
-                    created_date = datetime.datetime.fromtimestamp(created_timestamp).strftime('%Y-%m-%d') if created_timestamp else 'Unknown'
-                except:
-                    created_date = 'Unknown'
-                
-                # Add pricing info
-                price_info = {
-                    'is_free': is_free,
-                    'prompt_price': prompt_price,
-                    'completion_price': pricing.get('completion', '0')
-                }
-                
-                # Generate categories/tags
-                categories = generate_model_categories(model)
-                
-                filtered_models.append({
-                    'id': model.get('id'),
-                    'name': model.get('name', 'Unknown'),
-                    'description': model.get('description', ''),
-                    'context_length': model.get('context_length', 'Unknown'),
-                    'provider': provider,
-                    'created_date': created_date,
-                    'hugging_face_id': model.get('hugging_face_id', ''),
-                    'canonical_slug': model.get('canonical_slug', ''),
-                    'pricing': price_info,
-                    'categories': categories,
-                    'architecture': {
-                        'modality': architecture.get('modality', 'Unknown'),
-                        'input_modalities': architecture.get('input_modalities', []),
-                        'output_modalities': architecture.get('output_modalities', []),
-                        'tokenizer': architecture.get('tokenizer', 'Unknown'),
-                        'instruct_type': architecture.get('instruct_type', None)
-                    },
-                    'capabilities': {
-                        'max_completion_tokens': top_provider.get('max_completion_tokens', 'Unknown'),
-                        'is_moderated': top_provider.get('is_moderated', False),
-                        'supported_parameters': model.get('supported_parameters', [])
-                    },
-                    'safety_info': {
-                        'is_moderated': top_provider.get('is_moderated', False),
-                        'per_request_limits': model.get('per_request_limits', None)
-                    }
-                })
-            
-            return filtered_models
-        else:
-            raise Exception(f"API returned status {response.status_code}")
-            
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-        # Return fallback models
-        return [
-            {
-                'id': 'meta-llama/llama-3.1-8b-instruct:free',
-                'name': 'Llama 3.1 8B (Free)',
-                'description': 'Meta\'s Llama 3.1 8B model',
-                'context_length': 131072
-            },
-            {
-                'id': 'google/gemma-2-9b-it:free',
-                'name': 'Gemma 2 9B (Free)',
-                'description': 'Google\'s Gemma 2 9B model',
-                'context_length': 8192
-            },
-            {
-                'id': 'mistralai/mistral-7b-instruct:free',
-                'name': 'Mistral 7B (Free)',
-                'description': 'Mistral\'s 7B instruction model',
-                'context_length': 32768
-            },
-            {
-                'id': 'qwen/qwen-2.5-72b-instruct:free',
-                'name': 'Qwen 2.5 72B (Free)',
-                'description': 'Qwen\'s large language model',
-                'context_length': 32768
-            }
-        ]
 
-def chat_with_model_streaming(model_id, message, history=None):
-    """Send message to OpenRouter model with streaming response"""
+def upstream_error_message(status_code, error_data):
+    """Extract a user-facing message from an upstream error response"""
+    if not isinstance(error_data, dict):
+        error_data = {}
+    return error_data.get('error', {}).get('message', f"HTTP {status_code}")
+
+def cached_reply(cache_key):
+    """A response-cache hit in the shape chat_with_model returns, or None"""
+    entry = response_cache.get(cache_key)
+    if entry is None:
+        return None
+    return {
+        'success': True,
+        'response': entry['content'],
+        'usage': entry['usage'],
+        'cached': True
+    }
+
+def semantic_prompt(message, history, use_cache=True):
+    """The prompt the semantic cache may answer: only a conversation's first message, as history changes the reply"""
+    return message if use_cache and not history else None
+
+def semantic_reply(model_id, prompt):
+    """A semantic-cache hit in the shape chat_with_model returns, or None"""
+    entry = semantic_cache.get(model_id, prompt)
+    if entry is None:
+        return None
+    return {
+        'success': True,
+        'response': entry['content'],
+        'usage': entry['usage'],
+        'cached': True,
+        'similarity': entry['similarity']
+    }
+
+def prepare_chat_stream(model_id, message, history=None, use_cache=True):
+    """Look for an existing reply to a streaming chat before going upstream
+    
+    Returns (shared, messages, cache_key, flight). shared is a cached reply dict or a Broadcast
+    to follow; when it is None the caller leads: it opens the stream with
+    chat_with_model_streaming, publishes to the flight and finishes it.
+    """
+    messages = build_chat_messages(message, history, model_id)
+    digest = request_key(build_chat_payload(model_id, messages)) if use_cache else None
+    cache_key = digest if response_cache.enabled else None
+    cached = cached_reply(cache_key) or semantic_reply(model_id, semantic_prompt(message, history, use_cache))
+    if cached:
+        return cached, messages, cache_key, None
+    
+    flight = None
+    if digest:
+        flight_key = ('stream', digest)
+        broadcast, leader = flights.join(flight_key)
+        if not leader:
+            return broadcast, messages, cache_key, None
+        flight = (flight_key, broadcast)
+    
+    return None, messages, cache_key, flight
+
+def chat_with_model_streaming(model_id, messages):
+    """Send messages to OpenRouter model with streaming response; returns the response or an error dict"""
     try:
-        api_key = load_api_key()
-        
-        # Prepare messages
-        messages = []
-        
-        # Add conversation history
-        if history:
-            for msg in history[-6:]:  # Keep last 6 messages for context
-                messages.append({
-                    "role": msg.get('role', 'user'),
-                    "content": msg.get('content', '')
-                })
-        
-        # Add current message
-        messages.append({
-            "role": "user",
-            "content": message
-        })
+        key = credentials.get()
         
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model_id,
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.7,
-                "stream": True
-            },
-            timeout=30,
-            stream=True
-        )
+        with trace_span('upstream_connect', model=model_id) as span:
+            response = upstream.post(
+                '/chat/completions',
+                # The relay parses the raw byte stream, so ask for it uncompressed
+                headers={**upstream_headers(key), 'Accept-Encoding': 'identity'},
+                json=build_chat_payload(model_id, messages, stream=True),
+                timeout=30,
+                stream=True
+            )
+            span['status'] = response.status_code
+        credentials.observe(key, response.status_code)
+        scheduler.observe(model_id, response.status_code, response.headers)
         
         if response.status_code == 200:
             return response
         else:
             error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            error_message = error_data.get('error', {}).get('message', f"HTTP {response.status_code}")
+            error_message = upstream_error_message(response.status_code, error_data)
+            response.close()
             
             return {
                 'success': False,
@@ -297,42 +416,117 @@ def chat_with_model_streaming(model_id, message, history=None):
             'error': f'Unexpected error: {str(e)}'
         }
 
-def chat_with_model(model_id, message, history=None):
+# How often a queued stream re-reports its position
+QUEUE_UPDATE_INTERVAL = 1.0
+
+def wait_in_queue(ticket, cancelled=None):
+    """Yield "queued" events until a ticket is admitted or cancelled is set; raises TimeoutError after the queue timeout"""
+    deadline = time.time() + scheduler.queue_timeout
+    position = ticket.position()
+    yield sse_event({'type': 'queued', 'position': position})
+    
+    while not ticket.wait(min(QUEUE_UPDATE_INTERVAL, max(deadline - time.time(), 0))):
+        if cancelled is not None and cancelled.is_set():
+            return
+        if time.time() >= deadline:
+            raise TimeoutError('Timed out waiting for model capacity. Please try again.')
+        
+        new_position = ticket.position()
+        if new_position != position:
+            position = new_position
+            yield sse_event({'type': 'queued', 'position': position})
+
+def finish_flight(flight, relay=None, error=None):
+    """Hand a stream's outcome to its followers and retire the flight"""
+    if flight is None:
+        return
+    flight_key, broadcast = flight
+    broadcast.finish(relay, error)
+    flights.leave(flight_key, broadcast)
+
+def chat_with_model(model_id, message, history=None, use_cache=True, client_id=None, routing=None):
     """Send message to OpenRouter model (non-streaming fallback)"""
+    messages = build_chat_messages(message, history, model_id)
+    payload = build_chat_payload(model_id, messages)
+    digest = request_key(payload) if use_cache else None
+    cache_key = digest if response_cache.enabled else None
+    prompt = semantic_prompt(message, history, use_cache)
+    cached = cached_reply(cache_key) or semantic_reply(model_id, prompt)
+    if cached:
+        return cached
+    
+    def complete():
+        result = request_chat_completion(model_id, message, history, payload, cache_key, client_id)
+        if result['success']:
+            semantic_cache.put(model_id, prompt, result['response'], result['usage'])
+        if result['success'] or not router.active(routing):
+            return result
+        return fall_back(model_id, message, history, client_id, result)
+    
+    if digest is None:
+        return complete()
+    # Identical concurrent requests share one upstream call and its result
+    return flights.do(('chat', digest), complete)
+
+def fall_back(model_id, message, history, client_id, failed):
+    """Retry a failed non-streaming chat once on the closest equivalent model"""
+    alternatives = router.alternatives(get_model_index(), model_id)
+    result = failed
+    if alternatives:
+        alternative = alternatives[0]
+        payload = build_chat_payload(alternative, build_chat_messages(message, history, alternative))
+        result = request_chat_completion(alternative, message, history, payload, client_id=client_id)
+        if result['success']:
+            result['model'] = alternative
+            result['requested_model'] = model_id
+    
+    router.decide({
+        'at': time.time(),
+        'model': model_id,
+        'served_by': result.get('model', model_id) if result['success'] else None,
+        'hedged': bool(alternatives),
+        'reason': 'error',
+        'deadline': None,
+        'ttft': None,
+        'error': None if result['success'] else result['error']
+    })
+    return result
+
+def request_chat_completion(model_id, message, history, payload, cache_key=None, client_id=None):
+    """Run one non-streaming upstream completion once the scheduler admits it"""
     try:
-        api_key = load_api_key()
-        
-        # Prepare messages
-        messages = []
-        
-        # Add conversation history
-        if history:
-            for msg in history[-6:]:  # Keep last 6 messages for context
-                messages.append({
-                    "role": msg.get('role', 'user'),
-                    "content": msg.get('content', '')
-                })
-        
-        # Add current message
-        messages.append({
-            "role": "user",
-            "content": message
-        })
+        with trace_span('queue', model=model_id):
+            ticket = scheduler.acquire(model_id, client_id)
+    except (QueueFull, TimeoutError) as e:
+        return {
+            'success': False,
+            'error': str(e)
+        }
+    
+    try:
+        result = post_chat_completion(model_id, message, history, payload, cache_key)
+        router.observe(model_id, error=not result['success'])
+        return result
+    finally:
+        ticket.close()
+
+def post_chat_completion(model_id, message, history, payload, cache_key=None):
+    """Run one non-streaming upstream completion and record its usage"""
+    try:
+        key = credentials.get()
+        started = time.time()
         
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model_id,
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.7
-            },
-            timeout=30
-        )
+        # A non-streamed reply arrives only once the whole completion has been generated
+        with trace_span('upstream_reply', model=model_id) as span:
+            response = upstream.post(
+                '/chat/completions',
+                headers=upstream_headers(key),
+                json=payload,
+                timeout=30
+            )
+            span['status'] = response.status_code
+        credentials.observe(key, response.status_code)
+        scheduler.observe(model_id, response.status_code, response.headers)
         
         if response.status_code == 200:
             result = response.json()
@@ -340,21 +534,25 @@ def chat_with_model(model_id, message, history=None):
             # Extract response
             content = result['choices'][0]['message']['content']
             
-            # Extract usage info
-            usage = result.get('usage', {})
+            # Extract usage info, estimating it locally if upstream left it out
+            usage = result.get('usage')
+            if usage:
+                usage = normalize_usage(usage)
+            else:
+                usage = estimate_chat_usage(model_id, message, history, content)
+            duration = time.time() - started
+            usage_stats.record(model_id, usage, duration)
+            CHAT_SECONDS.labels(metric_model(model_id), 'complete').observe(duration)
+            response_cache.put(cache_key, content, usage)
             
             return {
                 'success': True,
                 'response': content,
-                'usage': {
-                    'prompt_tokens': usage.get('prompt_tokens', 0),
-                    'completion_tokens': usage.get('completion_tokens', 0),
-                    'total_tokens': usage.get('total_tokens', 0)
-                }
+                'usage': usage
             }
         else:
             error_data = response.json() if response.headers.get('content-type', '').startswith('application/json') else {}
-            error_message = error_data.get('error', {}).get('message', f"HTTP {response.status_code}")
+            error_message = upstream_error_message(response.status_code, error_data)
             
             return {
                 'success': False,
@@ -377,110 +575,289 @@ def chat_with_model(model_id, message, history=None):
             'error': f'Unexpected error: {str(e)}'
         }
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.trace = tracer.start(f'{request.method} {endpoint}', request.headers.get('X-Request-ID'))
+
+@app.after_request
+def record_request_metrics(response):
+    """Count every response by route rule (not raw path, so the label set stays bounded)"""
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    HTTP_REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+    started = g.get('request_started')
+    if started is not None:
+        HTTP_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    return response
+
+@app.after_request
+def finish_request_trace(response):
+    """Echo the request id, and end the trace once the response (or the whole stream) is sent"""
+    trace = g.get('trace')
+    if trace is None:
+        return response
+    response.headers['X-Request-ID'] = trace.request_id
+    if response.is_streamed:
+        status = response.status_code
+        response.call_on_close(lambda: tracer.finish(trace, status))
+    else:
+        tracer.finish(trace, response.status_code)
+    return response
+
+@REGISTRY.collector
+def collect_component_metrics():
+    """Scrape-time view of counters the caches, scheduler and pools already keep"""
+    cache = response_cache.stats()
+    yield ('response_cache_lookups_total', 'counter', 'Reply cache lookups by result', [
+        ({'result': result}, cache[result]) for result in ('hits', 'disk_hits', 'misses', 'bypassed')
+    ])
+    yield ('response_cache_hit_ratio', 'gauge', 'Share of reply cache lookups served from the cache',
+           [({}, cache['hit_rate'] or 0)])
+    yield ('response_cache_bytes', 'gauge', 'Memory held by the reply cache', [({}, cache['bytes'])])
+    
+    semantic = semantic_cache.stats()
+    yield ('semantic_cache_lookups_total', 'counter', 'Semantic cache lookups by result', [
+        ({'result': result}, semantic[result]) for result in ('hits', 'misses')
+    ])
+    yield ('semantic_cache_entries', 'gauge', 'Replies held by the semantic cache', [({}, semantic['entries'])])
+    yield ('semantic_cache_lookup_p95_seconds', 'gauge', '95th percentile semantic cache lookup time (recent lookups)',
+           [({}, (semantic['lookup_p95_ms'] or 0) / 1000)])
+    
+    context = context_builder.stats()
+    lookups = context['hits'] + context['misses']
+    yield ('context_token_cache_hit_ratio', 'gauge', 'Share of message token counts served from the cache',
+           [({}, context['hits'] / lookups if lookups else 0)])
+    
+    catalog = catalog_cache.stats()
+    yield ('catalog_models', 'gauge', 'Models in the cached catalog', [({}, catalog['model_count'])])
+    yield ('catalog_age_seconds', 'gauge', 'Age of the cached catalog', [({}, catalog['age_seconds'] or 0)])
+    
+    coalescing = flights.stats()
+    yield ('coalesced_requests_total', 'counter', 'Requests that joined an identical in-flight upstream call', [
+        ({'kind': kind}, stats['coalesced']) for kind, stats in coalescing.items()
+    ])
+    
+    queue = scheduler.stats()
+    yield ('scheduler_queue_depth', 'gauge', 'Chat requests waiting for upstream capacity', [({}, queue['queue_depth'])])
+    yield ('scheduler_in_flight', 'gauge', 'Admitted upstream chat calls', [({}, queue['in_flight'])])
+    yield ('scheduler_rejected_total', 'counter', 'Chat requests rejected with a full queue', [({}, queue['rejected'])])
+    
+    pool = upstream.stats()
+    yield ('upstream_in_flight', 'gauge', 'Upstream requests holding a pooled connection', [({}, pool['in_flight'])])
+    yield ('upstream_retries_total', 'counter', 'Upstream retries on connect errors and 429/5xx', [({}, pool['retries'])])
+    yield ('upstream_errors_total', 'counter', 'Upstream requests that failed without a response', [({}, pool['errors'])])
+    
+    active = streams.stats()
+    yield ('chat_streams_ended_early_total', 'counter', 'Streams cancelled by the client or cut off by a disconnect', [
+        ({'reason': 'cancelled'}, active['cancelled']), ({'reason': 'disconnected'}, active['disconnected'])
+    ])
+    
+    routing = router.stats()
+    yield ('routing_decisions_total', 'counter', 'Routed chat requests by what happened', [
+        ({'decision': decision}, routing[decision]) for decision in ('routed', 'hedged', 'hedge_wins', 'fallbacks', 'no_alternative')
+    ])
+
+def send_static(name):
+    """Serve a file of the static bundle from memory, or 404 for anything outside it"""
+    served = static_bundle.respond(name, request.headers.get('If-None-Match'), request.accept_encodings)
+    if served is None:
+        return jsonify({
+            'success': False,
+            'error': 'Not found'
+        }), 404
+    
+    status, headers, body = served
+    return Response(body, status=status, headers=headers)
+
 @app.route('/')
 def index():
     """Serve the main chat interface"""
-    return send_from_directory('.', 'index.html')
+    return send_static('index.html')
 
 @app.route('/<path:filename>')
 def serve_static(filename):
-    """Serve static files (CSS, JS)"""
-    return send_from_directory('.', filename)
+    """Serve the chat UI's static files (CSS, JS)"""
+    return send_static(filename)
+
+# Top-level fields the model dropdown needs (sorted, as parsed from fields=); see script.js
+DROPDOWN_FIELDS = ('categories', 'id', 'name', 'pricing')
+
+CATEGORY_DISPLAY_NAMES = {
+    'vision': '👁️ Vision',
+    'multimodal': '🔄 Multimodal',
+    'tools': '🛠️ Tools',
+    'reasoning': '🧠 Reasoning',
+    'code': '💻 Code',
+    'math': '🔢 Math',
+    'creative': '🎨 Creative',
+    'roleplay': '🎭 Roleplay',
+    'uncensored': '🔓 Uncensored',
+    'fast': '⚡ Fast',
+    'large': '📏 Large',
+    'small': '📦 Small',
+    'long-context': '📜 Long Context',
+    'medium-context': '📄 Medium Context',
+    'short-context': '📝 Short Context',
+    'open-source': '🌍 Open Source',
+    'general': '🌐 General',
+    'popular': '⭐ Popular',
+    'research': '🔬 Research',
+    'advanced': '🚀 Advanced',
+    'efficient': '⚙️ Efficient',
+    'multilingual': '🌎 Multilingual',
+    'enterprise': '🏢 Enterprise',
+    'helpful': '🤝 Helpful',
+    'search': '🔍 Search',
+    'embeddings': '🔗 Embeddings'
+}
+
+def build_models_payload(index, price_filter, category_filters, provider_filters, fields):
+    """Build the /api/models response body for one filter/projection combination"""
+    models = index.filter(
+        price=price_filter,
+        categories=category_filters,
+        providers=provider_filters
+    )
+    
+    if fields:
+        models = [{field: model[field] for field in fields if field in model} for model in models]
+    
+    return {
+        'success': True,
+        'models': models,
+        'count': len(models),
+        'price_filter': price_filter,
+        'category_filter': ','.join(category_filters) or 'all',
+        'provider_filter': ','.join(provider_filters) or 'all'
+    }
+
+def build_categories_payload(index):
+    """Build the /api/categories response body"""
+    category_list = []
+    for category in index.categories:
+        category_list.append({
+            'value': category,
+            'label': CATEGORY_DISPLAY_NAMES.get(category, category.title())
+        })
+    
+    return {
+        'success': True,
+        'categories': category_list
+    }
+
+def send_encoded(encoded):
+    """Send a pre-encoded JSON response, honoring If-None-Match and Accept-Encoding"""
+    if encoded.matches(request.headers.get('If-None-Match')):
+        _, _, etag = encoded.negotiate(request.accept_encodings)
+        response = Response(status=304)
+    else:
+        body, content_encoding, etag = encoded.negotiate(request.accept_encodings)
+        response = Response(body, mimetype='application/json')
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+    
+    response.headers['ETag'] = etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Let browsers keep the catalog but revalidate it on every load
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@catalog_cache.on_refresh
+def warm_catalog_responses(snapshot):
+    """Pre-encode the responses every page load asks for"""
+    snapshot.encoded_response(('categories',), lambda: build_categories_payload(snapshot.index), precompress=True)
+    for fields in ((), DROPDOWN_FIELDS):
+        key = ('models', 'all', (), (), fields)
+        snapshot.encoded_response(key, lambda: build_models_payload(snapshot.index, 'all', [], [], fields), precompress=True)
 
 @app.route('/api/models', methods=['GET'])
 def get_models_endpoint():
-    """API endpoint to get available models with optional filtering"""
+    """API endpoint to get available models with optional filtering and field projection"""
     try:
-        price_filter = request.args.get('price', 'all')  # 'all', 'free', or 'paid'
-        category_filter = request.args.get('category', 'all')  # category name or 'all'
+        snapshot = get_catalog_snapshot()
+        index = snapshot.index
         
-        models = get_models('all')  # Get all models first
+        price_filter = request.args.get('price', 'all')  # 'all', 'free', or 'paid'
+        # Repeated category/provider params match any of the given values
+        category_filters = sorted({c for c in request.args.getlist('category') if c != 'all'})
+        provider_filters = sorted({p for p in request.args.getlist('provider') if p != 'all'})
+        # Comma-separated top-level fields to return, e.g. fields=id,name,pricing; unknown ones select nothing
+        fields = tuple(sorted({f for f in request.args.get('fields', '').split(',') if f in index.fields}))
         
-        # Apply price filtering
-        if price_filter == 'free':
-            models = [m for m in models if m['pricing']['is_free']]
-        elif price_filter == 'paid':
-            models = [m for m in models if not m['pricing']['is_free']]
+        # Only values the catalog knows reach the response cache, so clients cannot grow its key space
+        if price_filter not in ('all', 'free', 'paid'):
+            error = f'Unknown price filter: {price_filter}'
+        else:
+            unknown = [c for c in category_filters if c not in index.by_category]
+            unknown += [p for p in provider_filters if p not in index.by_provider]
+            error = f"Unknown category or provider: {', '.join(unknown)}" if unknown else None
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
         
-        # Apply category filtering
-        if category_filter != 'all':
-            models = [m for m in models if category_filter in m.get('categories', [])]
+        key = ('models', price_filter, tuple(category_filters), tuple(provider_filters), fields)
+        encoded = snapshot.encoded_response(
+            key,
+            lambda: build_models_payload(index, price_filter, category_filters, provider_filters, fields)
+        )
         
-        return jsonify({
-            'success': True,
-            'models': models,
-            'count': len(models),
-            'price_filter': price_filter,
-            'category_filter': category_filter
-        })
+        return send_encoded(encoded)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/models/<path:model_id>', methods=['GET'])
+def get_model_endpoint(model_id):
+    """API endpoint to get the full details of one model"""
+    model = get_model_index().get(model_id)
+    
+    if model is None:
+        return jsonify({
+            'success': False,
+            'error': f'Model {model_id} not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'model': model
+    })
+
 @app.route('/api/categories', methods=['GET'])
 def get_categories():
     """API endpoint to get all available categories"""
     try:
-        models = get_models('all')
-        all_categories = set()
-        
-        for model in models:
-            all_categories.update(model.get('categories', []))
-        
-        # Sort categories and create display names
-        category_list = []
-        category_display_names = {
-            'vision': '👁️ Vision',
-            'multimodal': '🔄 Multimodal',
-            'tools': '🛠️ Tools',
-            'reasoning': '🧠 Reasoning',
-            'code': '💻 Code',
-            'math': '🔢 Math',
-            'creative': '🎨 Creative',
-            'roleplay': '🎭 Roleplay',
-            'uncensored': '🔓 Uncensored',
-            'fast': '⚡ Fast',
-            'large': '📏 Large',
-            'small': '📦 Small',
-            'long-context': '📜 Long Context',
-            'medium-context': '📄 Medium Context',
-            'short-context': '📝 Short Context',
-            'open-source': '🌍 Open Source',
-            'general': '🌐 General',
-            'popular': '⭐ Popular',
-            'research': '🔬 Research',
-            'advanced': '🚀 Advanced',
-            'efficient': '⚙️ Efficient',
-            'multilingual': '🌎 Multilingual',
-            'enterprise': '🏢 Enterprise',
-            'helpful': '🤝 Helpful',
-            'search': '🔍 Search',
-            'embeddings': '🔗 Embeddings'
-        }
+        snapshot = get_catalog_snapshot()
+        encoded = snapshot.encoded_response(('categories',), lambda: build_categories_payload(snapshot.index))
         
-        for category in sorted(all_categories):
-            category_list.append({
-                'value': category,
-                'label': category_display_names.get(category, category.title())
-            })
-        
-        return jsonify({
-            'success': True,
-            'categories': category_list
-        })
+        return send_encoded(encoded)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive',
+    # Stop reverse proxies (nginx, Railway's edge) from buffering the event stream
+    'X-Accel-Buffering': 'no',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
+
+CANCELLED_EVENT = sse_event({'type': 'cancelled'})
+
 @app.route('/api/chat/stream', methods=['POST'])
 def chat_stream():
     """API endpoint for streaming chat messages"""
     try:
-        data = request.get_json()
+        with trace_span('parse_request'):
+            data = request.get_json()
         
         if not data:
             return jsonify({
@@ -490,66 +867,183 @@ def chat_stream():
         
         model_id = data.get('model')
         message = data.get('message')
-        history = data.get('history', [])
+        conversation_id = data.get('conversation_id')
+        # Clients that already assembled the reply from chunks can skip it in the done event
+        include_content = data.get('include_content', True)
+        # "cache": false forces a fresh reply from upstream
+        use_cache = data.get('cache', True) is not False
+        # "routing": true/false overrides CHAT_ROUTING for this request
+        routing = data.get('routing')
         
-        if not model_id or not message:
+        if not model_id or not message or not isinstance(message, str):
             return jsonify({
                 'success': False,
                 'error': 'Model and message are required'
             }), 400
         
+        history, error = resolve_history(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 404
+        
+        client_id = request_client_id()
+        sock = client_socket(request.environ)
+        trace = g.trace
+        
         def generate():
+            # The generator runs after the request context is gone
+            activate_trace(trace)
+            active = streams.open(model_id, client_id, sock)
+            ticket = None
+            flight = None
+            stream = None
+            relay = None
+            stream_error = None
+            started = time.time()
+            ACTIVE_STREAMS.inc()
             try:
-                response = chat_with_model_streaming(model_id, message, history)
+                # The id a "stop generating" button posts to /api/chat/stream/<id>/cancel
+                yield sse_event({'type': 'stream', 'id': active.id})
+                
+                with trace.span('prepare'):
+                    shared, messages, cache_key, flight = prepare_chat_stream(model_id, message, history, use_cache)
+                
+                if isinstance(shared, Broadcast):
+                    # An identical stream is already in flight: replay it so far, then follow it live
+                    active.on_cancel(shared.interrupt)
+                    yield from shared.follow(cancelled=active.cancelled)
+                    if active.cancelled.is_set():
+                        yield CANCELLED_EVENT
+                        return
+                    if shared.result is None:
+                        record_chat(model_id, 'stream', 'error')
+                        yield sse_event({'error': shared.error or 'Upstream stream ended unexpectedly'})
+                        return
+                    
+                    record_chat(model_id, 'stream', 'coalesced')
+                    yield shared.result.done_event(include_content, extra={'request_id': trace.request_id})
+                    commit_turn(conversation_id, message, shared.result.content)
+                    return
                 
-                if isinstance(response, dict) and not response.get('success', True):
-                    yield f"data: {json.dumps({'error': response['error']})}\n\n"
+                if shared is not None:
+                    record_chat(model_id, 'stream', 'cached')
+                    extra = {'request_id': trace.request_id}
+                    if 'similarity' in shared:
+                        extra['similarity'] = shared['similarity']
+                    yield replay_events(shared['response'], shared['usage'], include_content, extra=extra)
+                    commit_turn(conversation_id, message, shared['response'])
                     return
                 
-                accumulated_content = ""
-                total_tokens = 0
+                # Wait for an upstream slot, telling the client where it is in the queue
+                ticket = scheduler.enter(model_id, client_id)
+                if not ticket.admitted:
+                    with trace.span('queue', model=model_id):
+                        yield from wait_in_queue(ticket, active.cancelled)
+                    if active.cancelled.is_set():
+                        yield CANCELLED_EVENT
+                        return
+                
+                started = time.time()
+                opened = time.monotonic()
+                
+                def open_stream(candidate):
+                    # Hedged requests open on router threads, which start without the trace
+                    activate_trace(trace)
+                    candidate_messages = messages if candidate == model_id else build_chat_messages(message, history, candidate)
+                    return chat_with_model_streaming(candidate, candidate_messages)
+                
+                def make_relay(candidate):
+                    return StreamRelay(
+                        include_content=include_content,
+                        estimate=lambda completion: estimate_chat_usage(candidate, message, history, completion)
+                    )
+                
+                if router.active(routing):
+                    # Race the model against an equivalent one if its first token is late or it fails
+                    stream = router.stream(model_id, get_model_index(), open_stream, make_relay,
+                                           lambda candidate: scheduler.try_enter(candidate, client_id), ticket)
+                else:
+                    response = open_stream(model_id)
+                    if isinstance(response, dict):
+                        router.observe(model_id, error=True)
+                        stream_error = response['error']
+                        yield sse_event({'error': response['error']})
+                        return
+                    stream = DirectStream(router, model_id, response, make_relay(model_id), opened)
+                
+                def stop_upstream():
+                    # Clients following this stream still need it; publish_stream reads on for them
+                    if flight is None or not flight[1].followers:
+                        stream.cancel()
+                
+                active.on_cancel(stop_upstream)
+                try:
+                    # Keep reading to the end of the body so the connection goes back to the pool;
+                    # each upstream read becomes at most one downstream write
+                    yield from publish_stream(stream.events(), flight[1] if flight else None, active.cancelled)
+                except Exception:
+                    # Cancelling aborts the upstream response, which fails the read in progress
+                    if not active.cancelled.is_set():
+                        raise
+                
+                if stream.ttft is not None:
+                    # ttft counts from just before the upstream request was sent
+                    trace.add('first_token', opened, opened + stream.ttft, model=stream.model_id)
+                    trace.add('relay', opened + stream.ttft,
+                              chunks=stream.relay.chunks if stream.relay is not None else 0)
                 
-                for line in response.iter_lines():
-                    if line:
-                        line_str = line.decode('utf-8')
-                        
-                        if line_str.startswith('data: '):
-                            data_str = line_str[6:]
-                            
-                            if data_str.strip() == '[DONE]':
-                                # Send final message with complete content and usage
-                                yield f"data: {json.dumps({'type': 'done', 'content': accumulated_content, 'usage': {'total_tokens': total_tokens}})}\n\n"
-                                break
-                            
-                            try:
-                                chunk_data = json.loads(data_str)
-                                
-                                if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                                    delta = chunk_data['choices'][0].get('delta', {})
-                                    
-                                    if 'content' in delta:
-                                        content_chunk = delta['content']
-                                        accumulated_content += content_chunk
-                                        total_tokens += 1  # Rough approximation
-                                        
-                                        # Send the chunk
-                                        yield f"data: {json.dumps({'type': 'chunk', 'content': content_chunk})}\n\n"
-                                
-                            except json.JSONDecodeError:
-                                continue
+                if active.cancelled.is_set():
+                    yield CANCELLED_EVENT
+                elif stream.relay.done:
+                    yield stream.relay.done_event(extra={'request_id': trace.request_id})
                 
+            except GeneratorExit:
+                # The client went away before the disconnect watcher noticed
+                active.cancel('disconnected')
+                raise
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                stream_error = str(e)
+                yield sse_event({'error': str(e)})
+            finally:
+                ACTIVE_STREAMS.dec()
+                streams.close(active)
+                cancelled = active.cancelled.is_set()
+                
+                if stream is not None:
+                    # Return the pooled upstream connections even if the client went away
+                    stream.close()
+                    relay = stream.relay
+                    if relay is not None and (relay.done or cancelled):
+                        usage = relay.usage()
+                        duration = time.time() - started
+                        # Tokens generated before a cancel are billed all the same
+                        usage_stats.record(stream.model_id, usage, duration)
+                        # A stand-in model's reply is not what this request's cache key asked for
+                        if relay.done and stream.model_id == model_id:
+                            response_cache.put(cache_key, relay.content, usage)
+                            semantic_cache.put(model_id, semantic_prompt(message, history, use_cache), relay.content, usage)
+                        if not cancelled:
+                            record_chat(stream.model_id, 'stream', 'ok', duration, stream.ttft, usage.get('completion_tokens'))
+                            commit_turn(conversation_id, message, relay.content)
+                        elif relay.content:
+                            # The client keeps a stopped reply as far as it got, so the conversation does too
+                            commit_turn(conversation_id, message, relay.content)
+                
+                if cancelled:
+                    record_chat(model_id, 'stream', 'cancelled')
+                    stream_error = stream_error or 'Stream cancelled'
+                elif stream_error is not None:
+                    record_chat(model_id, 'stream', 'error')
+                if ticket is not None:
+                    ticket.close()
+                finish_flight(flight, relay if relay is not None and relay.done else None, stream_error)
         
         return Response(
             generate(),
-            mimetype='text/plain',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            }
+            mimetype='text/event-stream',
+            headers=STREAM_HEADERS
         )
         
     except Exception as e:
@@ -558,11 +1052,128 @@ def chat_stream():
             'error': str(e)
         }), 500
 
+@app.route('/api/chat/stream/<stream_id>/cancel', methods=['POST'])
+def cancel_chat_stream(stream_id):
+    """Stop a stream in progress and its upstream call; the stream ends with a "cancelled" event"""
+    if not streams.cancel(stream_id):
+        return jsonify({
+            'success': False,
+            'error': 'Stream not found or already finished'
+        }), 404
+    
+    return jsonify({
+        'success': True
+    })
+
+# Most models one /api/chat/compare request may stream at once
+COMPARE_MAX_MODELS = int(os.environ.get('COMPARE_MAX_MODELS', 6))
+
+@app.route('/api/chat/compare', methods=['POST'])
+def chat_compare():
+    """Stream one prompt from several models at once, multiplexed into one SSE response"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({
+            'success': False,
+            'error': 'No data provided'
+        }), 400
+    
+    model_ids = data.get('models')
+    message = data.get('message')
+    include_content = data.get('include_content', True)
+    use_cache = data.get('cache', True) is not False
+    
+    if not message or not isinstance(message, str) or not isinstance(model_ids, list) or not model_ids or not all(isinstance(m, str) for m in model_ids):
+        return jsonify({
+            'success': False,
+            'error': 'A message and a list of models are required'
+        }), 400
+    
+    model_ids = list(dict.fromkeys(model_ids))
+    if len(model_ids) > COMPARE_MAX_MODELS:
+        return jsonify({
+            'success': False,
+            'error': f'At most {COMPARE_MAX_MODELS} models can be compared at once'
+        }), 400
+    
+    history, error = resolve_history(data)
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error
+        }), 404
+    
+    client_id = request_client_id()
+    sock = client_socket(request.environ)
+    messages = {model_id: build_chat_messages(message, history, model_id) for model_id in model_ids}
+    cache_keys = {model_id: response_cache.key(build_chat_payload(model_id, messages[model_id]), use_cache)
+                  for model_id in model_ids}
+    
+    def make_relay(model_id):
+        return StreamRelay(
+            include_content=include_content,
+            estimate=lambda completion: estimate_chat_usage(model_id, message, history, completion),
+            model=model_id
+        )
+    
+    def finished(model_id, relay, stats):
+        usage = relay.usage()
+        usage_stats.record(model_id, usage, stats['duration'])
+        record_chat(model_id, 'compare', 'ok', stats['duration'], stats['ttft'], usage.get('completion_tokens'))
+        response_cache.put(cache_keys[model_id], relay.content, usage)
+    
+    def generate():
+        # Each model waits for its own scheduler slot, so per-model concurrency caps still apply
+        compare = CompareStream(
+            [],
+            lambda model_id: chat_with_model_streaming(model_id, messages[model_id]),
+            make_relay,
+            lambda model_id: scheduler.acquire(model_id, client_id),
+            on_done=finished
+        )
+        active = streams.open(','.join(model_ids), client_id, sock)
+        ACTIVE_STREAMS.inc()
+        try:
+            yield sse_event({'type': 'stream', 'id': active.id})
+            for model_id in model_ids:
+                cached = cached_reply(cache_keys[model_id])
+                if cached is None:
+                    compare.model_ids.append(model_id)
+                    continue
+                record_chat(model_id, 'compare', 'cached')
+                compare.stats[model_id] = {'status': 'done', 'cached': True}
+                yield replay_events(cached['response'], cached['usage'], include_content, model=model_id)
+            
+            active.on_cancel(compare.cancel)
+            yield from compare.events()
+            if active.cancelled.is_set():
+                yield CANCELLED_EVENT
+        except GeneratorExit:
+            active.cancel('disconnected')
+            raise
+        finally:
+            compare.close()
+            ACTIVE_STREAMS.dec()
+            streams.close(active)
+            for model_id, stats in compare.stats.items():
+                if stats['status'] == 'error':
+                    record_chat(model_id, 'compare', 'error')
+                elif stats['status'] != 'done':
+                    # Still queued or streaming when the client cancelled or went away
+                    record_chat(model_id, 'compare', 'cancelled')
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers=STREAM_HEADERS
+    )
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """API endpoint for chat messages (non-streaming fallback)"""
     try:
-        data = request.get_json()
+        with trace_span('parse_request'):
+            data = request.get_json()
         
         if not data:
             return jsonify({
@@ -572,18 +1183,27 @@ def chat():
         
         model_id = data.get('model')
         message = data.get('message')
-        history = data.get('history', [])
         
-        if not model_id or not message:
+        if not model_id or not message or not isinstance(message, str):
             return jsonify({
                 'success': False,
                 'error': 'Model and message are required'
             }), 400
         
-        # Chat with the model
-        result = chat_with_model(model_id, message, history)
+        history, error = resolve_history(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 404
         
+        # Chat with the model; "cache": false forces a fresh reply from upstream
+        result = chat_with_model(model_id, message, history, data.get('cache', True) is not False, request_client_id(),
+                                 data.get('routing'))
+        
+        record_chat(model_id, 'complete', 'cached' if result.get('cached') else 'ok' if result['success'] else 'error')
         if result['success']:
+            commit_turn(data.get('conversation_id'), message, result['response'])
             return jsonify(result)
         else:
             return jsonify(result), 400
@@ -594,22 +1214,189 @@ def chat():
             'error': str(e)
         }), 500
 
+# Cap on a batch request's concurrency, and where resumable batches (?batch_id=) keep their results
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+BATCH_DIR = os.environ.get('BATCH_DIR') or None
+BATCH_ID_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+@app.route('/api/batch', methods=['POST'])
+def batch_endpoint():
+    """Run a JSONL body of chat records and stream the results back as JSONL in completion order"""
+    concurrency = min(max(request.args.get('concurrency', BATCH_DEFAULT_CONCURRENCY, type=int), 1), BATCH_MAX_CONCURRENCY)
+    batch_id = request.args.get('batch_id')
+    
+    checkpoint = None
+    done = set()
+    if batch_id:
+        if not BATCH_DIR:
+            return jsonify({
+                'success': False,
+                'error': 'Resumable batches are not enabled on this server'
+            }), 400
+        if not BATCH_ID_RE.fullmatch(batch_id):
+            return jsonify({
+                'success': False,
+                'error': 'batch_id may only contain letters, digits, "-" and "_"'
+            }), 400
+        
+        os.makedirs(BATCH_DIR, exist_ok=True)
+        checkpoint = os.path.join(BATCH_DIR, f'{batch_id}.jsonl')
+        if os.path.exists(checkpoint):
+            with open(checkpoint, 'r', encoding='utf-8') as f:
+                done = load_checkpoint(f)
+    
+    lines = request.get_data(as_text=True).splitlines()
+    runner = BatchRunner(
+        chat_with_model,
+        concurrency,
+        request.args.getlist('model'),
+        use_cache=request.args.get('cache', '1') != '0',
+        # Its own lane in the fair queue, so a batch cannot crowd out the same client's interactive chats
+        client_id=f'batch:{request_client_id()}'
+    )
+    
+    sock = client_socket(request.environ)
+    
+    def generate():
+        # Registered like a stream so a client that goes away stops the batch while chats are still running
+        active = streams.open('batch', runner.client_id, sock)
+        active.on_cancel(runner.cancel)
+        output = open(checkpoint, 'a', encoding='utf-8') if checkpoint else None
+        try:
+            for result in runner.run(lines, done):
+                line = json.dumps(result, ensure_ascii=False) + '\n'
+                if output is not None:
+                    output.write(line)
+                    output.flush()
+                yield line
+            if not active.cancelled.is_set():
+                yield json.dumps({'summary': runner.summary()}) + '\n'
+        except GeneratorExit:
+            active.cancel('disconnected')
+            raise
+        finally:
+            streams.close(active)
+            if output is not None:
+                output.close()
+    
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/conversations', methods=['POST'])
+def create_conversation():
+    """Start a server-side conversation, optionally seeded with earlier messages"""
+    data = request.get_json(silent=True) or {}
+    messages = data.get('messages', [])
+    
+    if not isinstance(messages, list):
+        return jsonify({
+            'success': False,
+            'error': 'messages must be a list of {role, content} objects'
+        }), 400
+    
+    try:
+        conversation_id = conversations.create(messages)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    return jsonify({
+        'success': True,
+        'conversation_id': conversation_id
+    }), 201
+
+@app.route('/api/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    """Return a conversation's stored messages"""
+    messages = conversations.get(conversation_id)
+    if messages is None:
+        return jsonify({
+            'success': False,
+            'error': 'Conversation not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'conversation_id': conversation_id,
+        'messages': messages
+    })
+
+@app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Forget a conversation"""
+    if not conversations.delete(conversation_id):
+        return jsonify({
+            'success': False,
+            'error': 'Conversation not found'
+        }), 404
+    
+    return jsonify({'success': True})
+
+@app.route('/api/usage', methods=['GET'])
+def usage_endpoint():
+    """Token usage and generation throughput per model for this worker"""
+    return jsonify({
+        'success': True,
+        **usage_stats.snapshot()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/routing', methods=['GET'])
+def routing_endpoint():
+    """Per-model first-token latency and error rates, and recent routing decisions"""
+    return jsonify({
+        'success': True,
+        **router.stats(decisions=True)
+    })
+
+@app.route('/api/debug/slow', methods=['GET'])
+def slow_requests_endpoint():
+    """The slowest recent requests in this worker with their stage timings (?limit=, ?name=POST /api/chat)"""
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 200)
+    return jsonify({
+        'success': True,
+        'traces': tracer.slowest(limit, request.args.get('name')),
+        'tracing': tracer.stats()
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': time.time()
+        'timestamp': time.time(),
+        'catalog': catalog_cache.stats(),
+        'upstream': upstream.stats(),
+        'context': context_builder.stats(),
+        'conversations': conversations.stats(),
+        'response_cache': response_cache.stats(),
+        'semantic_cache': semantic_cache.stats(),
+        'coalescing': flights.stats(),
+        'scheduler': scheduler.stats(),
+        'routing': router.stats(),
+        'streams': streams.stats(),
+        'static': static_bundle.stats(),
+        'tracing': tracer.stats(),
+        'credentials': credentials.stats()
     })
 
 if __name__ == '__main__':
+    # Local development server; production runs under gunicorn (see gunicorn.conf.py)
     port = int(os.environ.get('PORT', 5000))
-    debug = os.environ.get('FLASK_ENV') != 'production'
+    debug = os.environ.get('FLASK_DEBUG') == '1'
     
-    if debug:
-        print("🚀 Starting OpenRouter Chat UI...")
-        print(f"📱 Open your browser and go to: http://localhost:{port}")
-        print("🤖 Enjoy chatting with free AI models!")
-        print("🛑 Press Ctrl+C to stop the server")
+    print("🚀 Starting OpenRouter Chat UI...")
+    print(f"📱 Open your browser and go to: http://localhost:{port}")
+    print("🤖 Enjoy chatting with free AI models!")
+    print("🛑 Press Ctrl+C to stop the server")
     
     app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""asyncio serving mode: chat endpoints run on one event loop per process
+
+Chat and streaming chat use an async upstream client, so an in-flight stream costs a
+coroutine instead of an OS thread. Every other route is served by the Flask app in app.py
+through a small WSGI bridge on the default thread pool; responses Flask streams (compare,
+batch) are relayed chunk by chunk from a pool of their own.
+
+Run with: python async_app.py
+"""
+import asyncio
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from aiohttp import web
+
+from app import (
+    ACTIVE_STREAMS, CANCELLED_EVENT, CHAT_SECONDS, HTTP_REQUEST_SECONDS, HTTP_REQUESTS, QUEUE_UPDATE_INTERVAL,
+    STREAM_HEADERS,
+    app as flask_app, build_chat_messages, build_chat_payload, cached_reply, commit_turn, credentials,
+    estimate_chat_usage, metric_model, record_chat, resolve_history, response_cache, scheduler, semantic_cache,
+    semantic_prompt, semantic_reply, static_bundle, streams, tracer, upstream_error_message, upstream_headers,
+    usage_stats
+)
+from relay import StreamRelay, replay_events, sse_event
+from scheduler import QueueFull
+from static import accepted_encodings
+from tokens import normalize_usage
+from tracing import current_trace, trace_span
+from upstream import async_client_from_env
+
+# Headers aiohttp computes itself for buffered responses
+HOP_BY_HOP_HEADERS = {'content-length', 'transfer-encoding', 'connection'}
+
+# Threads pulling chunks from streamed Flask responses; each in-flight bridged stream holds one
+# while it waits for its next chunk, so they never starve the default pool's buffered routes
+WSGI_STREAM_THREADS = int(os.environ.get('WSGI_STREAM_THREADS', 64))
+
+client_key = web.AppKey('upstream', object)
+wsgi_stream_executor = ThreadPoolExecutor(max_workers=WSGI_STREAM_THREADS, thread_name_prefix='wsgi-stream')
+
+
+def request_client_id(request):
+    """Who is asking, for fair queueing: the first X-Forwarded-For hop behind a proxy, else the peer"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return forwarded.split(',')[0].strip() or request.remote or 'unknown'
+
+
+async def wait_for_admission(model_id, client_id, on_queued=None):
+    """Get an admitted scheduler ticket without blocking the event loop
+
+    on_queued(position) is awaited while the request waits. Raises QueueFull or TimeoutError.
+    """
+    ticket = scheduler.enter(model_id, client_id)
+    if ticket.admitted:
+        return ticket
+
+    loop = asyncio.get_running_loop()
+    admitted = loop.create_future()
+
+    def wake():
+        # Runs on whichever thread freed the capacity
+        try:
+            loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(True))
+        except RuntimeError:  # The loop has closed
+            pass
+
+    # A finishing request admits the ticket and wakes us at once; only a rate limit running out
+    # (ready_in) or a position report needs a timed re-check
+    ticket.notify(wake)
+    deadline = time.monotonic() + scheduler.queue_timeout
+    next_update = time.monotonic()
+    position = None
+    try:
+        while not ticket.poll():
+            now = time.monotonic()
+            if now >= deadline:
+                raise TimeoutError('Timed out waiting for model capacity. Please try again.')
+            if on_queued is not None and now >= next_update:
+                next_update = now + QUEUE_UPDATE_INTERVAL
+                new_position = ticket.position()
+                if new_position != position:
+                    position = new_position
+                    await on_queued(position)
+
+            wake_at = min(deadline, next_update) if on_queued is not None else deadline
+            ready_in = ticket.ready_in()
+            if ready_in is not None:
+                wake_at = min(wake_at, now + ready_in)
+            try:
+                await asyncio.wait_for(asyncio.shield(admitted), max(wake_at - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                pass
+    except BaseException:
+        # Timed out, or the client went away while waiting
+        ticket.close()
+        raise
+    return ticket
+
+
+async def read_chat_request(request):
+    """Parse and validate a chat request body; returns (data, error_response)"""
+    try:
+        with trace_span('parse_request'):
+            data = await request.json()
+    except Exception:
+        data = None
+
+    if not data:
+        return None, web.json_response({
+            'success': False,
+            'error': 'No data provided'
+        }, status=400, headers={'Access-Control-Allow-Origin': '*'})
+
+    if not data.get('model') or not data.get('message') or not isinstance(data['message'], str):
+        return None, web.json_response({
+            'success': False,
+            'error': 'Model and message are required'
+        }, status=400, headers={'Access-Control-Allow-Origin': '*'})
+
+    # From here on data['history'] is whatever the model should see
+    history, error = resolve_history(data)
+    if error:
+        return None, web.json_response({
+            'success': False,
+            'error': error
+        }, status=404, headers={'Access-Control-Allow-Origin': '*'})
+    data['history'] = history
+    data['semantic_prompt'] = semantic_prompt(data['message'], history, data.get('cache', True) is not False)
+
+    return data, None
+
+
+async def open_chat(client, data, stream, client_id, on_queued=None):
+    """Start an upstream chat completion; returns (response, error_message)
+
+    The response is a cached reply dict on a response-cache hit. Otherwise it is the upstream
+    response, with a cache_key attribute for storing the finished reply and the scheduler
+    ticket it holds; hand it back with release_chat().
+    """
+    try:
+        messages = build_chat_messages(data['message'], data.get('history', []), data['model'])
+        use_cache = data.get('cache', True) is not False
+        cache_key = response_cache.key(build_chat_payload(data['model'], messages), use_cache)
+        cached = cached_reply(cache_key) or semantic_reply(data['model'], data['semantic_prompt'])
+        if cached:
+            return cached, None
+
+        with trace_span('queue', model=data['model']):
+            ticket = await wait_for_admission(data['model'], client_id, on_queued)
+    except (QueueFull, TimeoutError) as e:
+        return None, str(e)
+
+    response = None
+    try:
+        key = credentials.get()
+        opened = time.monotonic()
+        with trace_span('upstream_connect' if stream else 'upstream_reply', model=data['model']) as span:
+            response = await client.request(
+                'POST',
+                '/chat/completions',
+                headers=upstream_headers(key),
+                json=build_chat_payload(data['model'], messages, stream=stream),
+                timeout=30
+            )
+            span['status'] = response.status
+    except asyncio.TimeoutError:
+        return None, 'Request timed out. Please try again.'
+    except web.HTTPException:
+        raise
+    except OSError as e:
+        return None, f'Network error: {str(e)}'
+    except Exception as e:
+        return None, f'Unexpected error: {str(e)}'
+    finally:
+        if response is None:
+            ticket.close()
+
+    credentials.observe(key, response.status)
+    scheduler.observe(data['model'], response.status, response.headers)
+    if response.status == 200:
+        response.cache_key = cache_key
+        response.ticket = ticket
+        response.opened = opened
+        return response, None
+
+    try:
+        error_data = await response.json() if response.content_type == 'application/json' else {}
+    except Exception:
+        error_data = {}
+    client.release(response)
+    ticket.close()
+    return None, upstream_error_message(response.status, error_data)
+
+
+def release_chat(client, response):
+    """Return an upstream response's connection to the pool and its slot to the scheduler"""
+    client.release(response)
+    response.ticket.close()
+
+
+async def watch_disconnect(request, active):
+    """Cancel a stream once its client's connection closes, even while nothing is being written"""
+    while True:
+        await asyncio.sleep(streams.poll_interval)
+        transport = request.transport
+        if transport is None or transport.is_closing():
+            active.cancel('disconnected')
+            return
+
+
+async def chat_stream(request):
+    """Async streaming chat endpoint, same wire format as the Flask one"""
+    data, error_response = await read_chat_request(request)
+    if error_response is not None:
+        return error_response
+
+    model_id, message, history = data['model'], data['message'], data.get('history', [])
+    stream = web.StreamResponse(headers={**STREAM_HEADERS, 'X-Request-ID': current_trace().request_id})
+    stream.content_type = 'text/event-stream'
+    await stream.prepare(request)
+
+    active = streams.open(model_id, request_client_id(request))
+    relaying = watcher = None
+    ACTIVE_STREAMS.inc()
+    try:
+        # The id a "stop generating" button posts to /api/chat/stream/<id>/cancel
+        await stream.write(sse_event({'type': 'stream', 'id': active.id}).encode('utf-8'))
+
+        loop = asyncio.get_running_loop()
+        relaying = asyncio.ensure_future(relay_chat_stream(request, stream, data, model_id, message, history))
+        # The cancel endpoint runs on a WSGI bridge thread, so the task is cancelled through the loop
+        active.on_cancel(lambda: loop.call_soon_threadsafe(relaying.cancel))
+        if streams.watch:
+            watcher = asyncio.ensure_future(watch_disconnect(request, active))
+        await relaying
+    except asyncio.CancelledError:
+        if not active.cancelled.is_set():
+            raise
+        record_chat(model_id, 'stream', 'cancelled')
+        if active.reason != 'disconnected':
+            await stream.write(CANCELLED_EVENT.encode('utf-8'))
+    except ConnectionResetError:
+        # The browser went away before the watcher noticed
+        active.cancel('disconnected')
+        record_chat(model_id, 'stream', 'cancelled')
+        raise
+    finally:
+        ACTIVE_STREAMS.dec()
+        for task in (relaying, watcher):
+            if task is not None:
+                task.cancel()
+        streams.close(active)
+    return stream
+
+
+async def relay_chat_stream(request, stream, data, model_id, message, history):
+    """Write one streaming chat's events to a prepared response"""
+    client = request.app[client_key]
+    trace = current_trace()
+    started = time.time()
+
+    async def on_queued(position):
+        await stream.write(sse_event({'type': 'queued', 'position': position}).encode('utf-8'))
+
+    upstream_response, error = await open_chat(client, data, True, request_client_id(request), on_queued)
+    if error is not None:
+        record_chat(model_id, 'stream', 'error')
+        await stream.write(sse_event({'error': error}).encode('utf-8'))
+        return
+
+    if isinstance(upstream_response, dict):
+        record_chat(model_id, 'stream', 'cached')
+        content = upstream_response['response']
+        extra = {'request_id': trace.request_id}
+        if 'similarity' in upstream_response:
+            extra['similarity'] = upstream_response['similarity']
+        await stream.write(replay_events(content, upstream_response['usage'], data.get('include_content', True), extra=extra))
+        commit_turn(data.get('conversation_id'), message, content)
+        return
+
+    ttft = None
+    first_token_at = None
+    relay = StreamRelay(
+        include_content=data.get('include_content', True),
+        estimate=lambda completion: estimate_chat_usage(model_id, message, history, completion)
+    )
+    try:
+        # Each upstream read becomes at most one downstream write
+        async for block in upstream_response.content.iter_any():
+            events = relay.feed_bytes(block)
+            if events:
+                if ttft is None:
+                    ttft = time.time() - started
+                    first_token_at = time.monotonic()
+                    trace.add('first_token', upstream_response.opened, first_token_at, model=model_id)
+                await stream.write(events)
+
+        events = relay.finish()
+        if events:
+            await stream.write(events)
+        if first_token_at is not None:
+            trace.add('relay', first_token_at, chunks=relay.chunks)
+
+        if relay.done:
+            await stream.write(relay.done_event(extra={'request_id': trace.request_id}))
+            usage = relay.usage()
+            duration = time.time() - started
+            usage_stats.record(model_id, usage, duration)
+            record_chat(model_id, 'stream', 'ok', duration, ttft, usage.get('completion_tokens'))
+            response_cache.put(upstream_response.cache_key, relay.content, usage)
+            semantic_cache.put(model_id, data['semantic_prompt'], relay.content, usage)
+            commit_turn(data.get('conversation_id'), message, relay.content)
+    except asyncio.TimeoutError:
+        record_chat(model_id, 'stream', 'error')
+        await stream.write(sse_event({'error': 'Request timed out. Please try again.'}).encode('utf-8'))
+    except (ConnectionResetError, asyncio.CancelledError):
+        # The browser went away or the stream was cancelled; drop the upstream connection instead of reading on
+        upstream_response.close()
+        if relay.chunks:
+            # Tokens generated so far are billed all the same, and the client keeps the partial reply
+            usage_stats.record(model_id, relay.usage(), time.time() - started)
+            commit_turn(data.get('conversation_id'), message, relay.content)
+        raise
+    except Exception as e:
+        record_chat(model_id, 'stream', 'error')
+        await stream.write(sse_event({'error': str(e)}).encode('utf-8'))
+    finally:
+        release_chat(client, upstream_response)
+
+
+async def chat(request):
+    """Async non-streaming chat endpoint"""
+    data, error_response = await read_chat_request(request)
+    if error_response is not None:
+        return error_response
+
+    client = request.app[client_key]
+    cors = {'Access-Control-Allow-Origin': '*'}
+    started = time.time()
+
+    upstream_response, error = await open_chat(client, data, False, request_client_id(request))
+    if error is not None:
+        record_chat(data['model'], 'complete', 'error')
+        return web.json_response({'success': False, 'error': error}, status=400, headers=cors)
+
+    if isinstance(upstream_response, dict):
+        record_chat(data['model'], 'complete', 'cached')
+        commit_turn(data.get('conversation_id'), data['message'], upstream_response['response'])
+        return web.json_response(upstream_response, headers=cors)
+
+    try:
+        result = await upstream_response.json()
+        content = result['choices'][0]['message']['content']
+        usage = result.get('usage')
+    except Exception as e:
+        record_chat(data['model'], 'complete', 'error')
+        return web.json_response({'success': False, 'error': f'Unexpected error: {str(e)}'}, status=400, headers=cors)
+    finally:
+        release_chat(client, upstream_response)
+
+    if usage:
+        usage = normalize_usage(usage)
+    else:
+        usage = estimate_chat_usage(data['model'], data['message'], data.get('history', []), content)
+    duration = time.time() - started
+    usage_stats.record(data['model'], usage, duration)
+    record_chat(data['model'], 'complete', 'ok')
+    CHAT_SECONDS.labels(metric_model(data['model']), 'complete').observe(duration)
+    response_cache.put(upstream_response.cache_key, content, usage)
+    semantic_cache.put(data['model'], data['semantic_prompt'], content, usage)
+    commit_turn(data.get('conversation_id'), data['message'], content)
+
+    return web.json_response({
+        'success': True,
+        'response': content,
+        'usage': usage
+    }, headers=cors)
+
+
+def call_wsgi(environ):
+    """Run the Flask app for one request: (status, headers, body)
+
+    A response with a Content-Length is collected into bytes; any other (a generator Flask
+    streams) comes back as the WSGI iterable, for stream_wsgi_body to relay and close.
+    """
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = int(status.split(' ', 1)[0])
+        captured['headers'] = headers
+
+    result = flask_app.wsgi_app(environ, start_response)
+    if not any(name.lower() == 'content-length' for name, _ in captured['headers']):
+        return captured['status'], captured['headers'], result
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured['status'], captured['headers'], body
+
+
+async def stream_wsgi_body(response, body):
+    """Write a streamed WSGI body to a prepared response as each chunk is produced"""
+    chunks = iter(body)
+    pending = None
+    try:
+        while True:
+            pending = wsgi_stream_executor.submit(next, chunks, None)
+            chunk = await asyncio.wrap_future(pending)
+            if chunk is None:
+                break
+            if chunk:
+                await response.write(chunk)
+        await response.write_eof()
+    except ConnectionResetError:
+        # The client went away; closing the body below stops the app's work on its behalf
+        pass
+    finally:
+        # Closing the iterable runs the app's cleanup (GeneratorExit cancels a stream whose client
+        # went away), and must wait for a next() that is still running on its thread
+        if hasattr(body, 'close'):
+            if pending is not None and not pending.done():
+                pending.add_done_callback(lambda _: body.close())
+            else:
+                await asyncio.wrap_future(wsgi_stream_executor.submit(body.close))
+
+
+async def wsgi_fallback(request):
+    """Serve every non-chat route from the Flask app on the default thread pool"""
+    body = await request.read()
+    raw_path, _, query = request.raw_path.partition('?')
+    host, _, port = (request.host or 'localhost').partition(':')
+
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote(raw_path, encoding='latin-1'),
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or '80',
+        'SERVER_PROTOCOL': f'HTTP/{request.version.major}.{request.version.minor}',
+        'REMOTE_ADDR': request.remote or '',
+        # Lets a streamed response watch its client for a disconnect (see streams.client_socket)
+        'aiohttp.socket': request.transport.get_extra_info('socket') if request.transport else None,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in request.headers.items():
+        key = 'HTTP_' + name.upper().replace('-', '_')
+        if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+
+    loop = asyncio.get_running_loop()
+    status, headers, response_body = await loop.run_in_executor(None, call_wsgi, environ)
+
+    streamed = not isinstance(response_body, bytes)
+    response = web.StreamResponse(status=status) if streamed else web.Response(status=status, body=response_body)
+    for name, value in headers:
+        if name.lower() not in HOP_BY_HOP_HEADERS:
+            response.headers.add(name, value)
+    if streamed:
+        await response.prepare(request)
+        await stream_wsgi_body(response, response_body)
+    return response
+
+
+async def serve_static(request):
+    """Serve the static bundle straight from the event loop, without a trip through Flask"""
+    name = request.match_info.get('name') or 'index.html'
+    served = static_bundle.respond(name, request.headers.get('If-None-Match'),
+                                   accepted_encodings(request.headers.get('Accept-Encoding')))
+    if served is None:
+        return web.json_response({
+            'success': False,
+            'error': 'Not found'
+        }, status=404)
+
+    status, headers, body = served
+    return web.Response(status=status, body=body if status == 200 else None, headers=headers)
+
+
+@web.middleware
+async def record_request_metrics(request, handler):
+    """Request counts and latency for the native chat routes; Flask records the routes it serves"""
+    if request.match_info.handler is wsgi_fallback:
+        return await handler(request)
+
+    started = time.perf_counter()
+    endpoint = request.match_info.route.resource.canonical
+    # Every request shares the loop thread, so native routes are traced but never profiled
+    trace = tracer.start(f'{request.method} {endpoint}', request.headers.get('X-Request-ID'), profile_thread=False)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        if not response.prepared:
+            response.headers['X-Request-ID'] = trace.request_id
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_REQUESTS.labels(endpoint, request.method, status).inc()
+        HTTP_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        tracer.finish(trace, status)
+
+
+async def close_upstream(app):
+    await app[client_key].close()
+
+
+def create_app():
+    """Build the aiohttp application"""
+    app = web.Application(client_max_size=4 * 1024 * 1024, middlewares=[record_request_metrics])
+    client = app[client_key] = async_client_from_env(retry_rate_limits=False)
+    if 'SCHEDULER_GLOBAL_CONCURRENCY' not in os.environ:
+        # The default cap is sized for the threaded mode's connection pool; here the async pool is the limit
+        scheduler.global_concurrency = client.pool_size
+    app.on_cleanup.append(close_upstream)
+
+    app.router.add_post('/api/chat/stream', chat_stream)
+    app.router.add_post('/api/chat', chat)
+    # CORS preflights go through Flask
+    app.router.add_route('OPTIONS', '/api/chat/stream', wsgi_fallback)
+    app.router.add_route('OPTIONS', '/api/chat', wsgi_fallback)
+    # The UI's static files are served from memory on the loop
+    app.router.add_get('/', serve_static)
+    app.router.add_get('/{name:[^/]+}', serve_static)
+    # Conversation CRUD and everything else go through Flask
+    app.router.add_route('*', '/{tail:.*}', wsgi_fallback)
+    return app
+
+
+async def app_factory():
+    """Application factory for gunicorn's aiohttp worker (see gunicorn.conf.py)"""
+    return create_app()
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5000))
+    print("🚀 Starting OpenRouter Chat UI (async mode)...")
+    print(f"📱 Open your browser and go to: http://localhost:{port}")
+    web.run_app(create_app(), host='0.0.0.0', port=port, print=None)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Run a JSONL file of chat prompts against one or more models
+
+Each input line is {"model": ..., "message": ..., "history": [...]}; "model" may also be a
+list (or "models" given instead) to fan the prompt out across several models. Results are
+written as JSONL in completion order and a throughput summary is printed at the end. The
+output file doubles as the checkpoint: running the same command again skips every
+prompt/model pair that already succeeded there and appends the rest. The same runner backs
+POST /api/batch in app.py.
+
+Usage: python batch.py prompts.jsonl -o results.jsonl [--concurrency 8] [--model MODEL ...]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, ThreadPoolExecutor, wait
+
+DEFAULT_CONCURRENCY = 4
+
+
+def task_key(model_id, message, history):
+    """Stable id of one prompt/model pair, used to recognise finished work on resume"""
+    encoded = json.dumps([model_id, message, history], sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()[:32]
+
+
+def read_records(lines):
+    """Yield (index, record, error) for each non-blank JSONL line"""
+    for index, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield index, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield index, None, 'Each line must be a JSON object'
+            continue
+        yield index, record, None
+
+
+def load_checkpoint(lines):
+    """Keys of the tasks that already succeeded in an earlier run's output"""
+    done = set()
+    for line in lines:
+        try:
+            result = json.loads(line)
+        except ValueError:
+            # A line cut short by a crash; that task simply runs again
+            continue
+        if isinstance(result, dict) and result.get('success') and result.get('key'):
+            done.add(result['key'])
+    return done
+
+
+class BatchRunner:
+    """Runs batch records through a chat function with bounded concurrency
+
+    chat(model_id, message, history, use_cache, client_id) returns a chat_with_model() result.
+    Results come back in completion order; summary() describes the run once it has finished.
+    """
+
+    def __init__(self, chat, concurrency=DEFAULT_CONCURRENCY, default_models=(), use_cache=True, client_id='batch'):
+        self.chat = chat
+        self.concurrency = max(1, concurrency)
+        self.default_models = list(default_models)
+        self.use_cache = use_cache
+        self.client_id = client_id
+
+        self._lock = threading.Lock()
+        # Resolved by cancel(), so run() stops waiting on chats in flight
+        self._stopped = Future()
+        self._started = None
+        self._finished = None
+        self._counters = {'tasks': 0, 'succeeded': 0, 'failed': 0, 'skipped': 0, 'cached': 0,
+                          'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def tasks(self, lines, done=frozenset()):
+        """Yield one task per record and model, or an invalid-record result as a task with an error"""
+        for index, record, error in read_records(lines):
+            if error is not None:
+                yield {'index': index, 'error': error}
+                continue
+
+            models = record.get('models') or record.get('model') or self.default_models
+            if isinstance(models, str):
+                models = [models]
+            message = record.get('message')
+            history = record.get('history') or []
+            if (not models or not all(isinstance(m, str) for m in models) or not isinstance(message, str)
+                    or not message or not isinstance(history, list)):
+                yield {'index': index, 'id': record.get('id'), 'error': 'model, message and (optionally) a history list are required'}
+                continue
+
+            for model_id in models:
+                key = task_key(model_id, message, history)
+                if key in done:
+                    self._count('skipped')
+                    continue
+                yield {'index': index, 'id': record.get('id'), 'model': model_id, 'message': message,
+                       'history': history, 'key': key}
+
+    def run(self, lines, done=frozenset()):
+        """Yield a result dict per task as each one completes"""
+        self._started = time.time()
+        tasks = self.tasks(lines, done)
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch')
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                # Keep only `concurrency` tasks in flight, so huge inputs are read lazily
+                while not exhausted and len(pending) < self.concurrency and not self._stopped.done():
+                    task = next(tasks, None)
+                    if task is None:
+                        exhausted = True
+                    elif 'error' in task:
+                        yield self._result(task, {'success': False, 'error': task['error']}, 0.0)
+                    else:
+                        pending.add(executor.submit(self._run_task, task))
+
+                if not pending or self._stopped.done():
+                    break
+
+                finished, pending = wait(pending | {self._stopped}, return_when=FIRST_COMPLETED)
+                pending.discard(self._stopped)
+                for future in finished:
+                    if future is not self._stopped:
+                        yield future.result()
+        finally:
+            # If the consumer stops early, chats already running finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._finished = time.time()
+
+    def cancel(self):
+        """Stop run() from starting more chats or waiting on those in flight; callable from any thread"""
+        try:
+            self._stopped.set_result(None)
+        except InvalidStateError:
+            # Already cancelled
+            pass
+
+    def _run_task(self, task):
+        started = time.time()
+        try:
+            outcome = self.chat(task['model'], task['message'], task['history'], self.use_cache, self.client_id)
+        except Exception as e:
+            outcome = {'success': False, 'error': f'Unexpected error: {str(e)}'}
+        return self._result(task, outcome, time.time() - started)
+
+    def _result(self, task, outcome, duration):
+        result = {
+            'index': task['index'],
+            'id': task.get('id'),
+            'model': task.get('model'),
+            'key': task.get('key'),
+            'success': outcome['success'],
+            'duration': round(duration, 3)
+        }
+        if outcome['success']:
+            result['response'] = outcome['response']
+            result['usage'] = outcome.get('usage')
+            if outcome.get('cached'):
+                result['cached'] = True
+            if outcome.get('model'):
+                # A routing fallback answered on another model
+                result['served_by'] = outcome['model']
+        else:
+            result['error'] = outcome['error']
+
+        usage = result.get('usage') or {}
+        with self._lock:
+            self._counters['tasks'] += 1
+            self._counters['succeeded' if outcome['success'] else 'failed'] += 1
+            self._counters['cached'] += 1 if outcome.get('cached') else 0
+            self._counters['prompt_tokens'] += usage.get('prompt_tokens') or 0
+            self._counters['completion_tokens'] += usage.get('completion_tokens') or 0
+        return result
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def summary(self):
+        """Counts and throughput of the run"""
+        with self._lock:
+            summary = dict(self._counters)
+        elapsed = ((self._finished or time.time()) - self._started) if self._started else 0.0
+        summary.update({
+            'concurrency': self.concurrency,
+            'elapsed': round(elapsed, 3),
+            'tasks_per_second': round(summary['tasks'] / elapsed, 2) if elapsed else None,
+            'completion_tokens_per_second': round(summary['completion_tokens'] / elapsed, 1) if elapsed else None
+        })
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='JSONL of {model, message, history} records ("-" for stdin)')
+    parser.add_argument('-o', '--output', help='JSONL results file, also the checkpoint for resuming (default stdout)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='chats in flight at once')
+    parser.add_argument('--model', action='append', default=[], help='model for records without one (repeatable)')
+    parser.add_argument('--no-cache', action='store_true', help='always ask upstream, ignoring the reply cache')
+    args = parser.parse_args()
+
+    # Imported here so `--help` works without loading the catalog and upstream client
+    from app import chat_with_model
+
+    done = set()
+    if args.output and os.path.exists(args.output):
+        with open(args.output, 'r', encoding='utf-8') as f:
+            done = load_checkpoint(f)
+        if done:
+            print(f"↩️  Resuming: {len(done)} finished tasks in {args.output} will be skipped", file=sys.stderr)
+
+    runner = BatchRunner(chat_with_model, args.concurrency, args.model, use_cache=not args.no_cache)
+    source = sys.stdin if args.input == '-' else open(args.input, 'r', encoding='utf-8')
+    output = open(args.output, 'a', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for result in runner.run(source, done):
+            output.write(json.dumps(result, ensure_ascii=False) + '\n')
+            # Flush per result so an interrupted run loses at most the tasks in flight
+            output.flush()
+    except KeyboardInterrupt:
+        print("🛑 Interrupted; run the same command again to resume", file=sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    summary = runner.summary()
+    print(f"📊 {summary['tasks']} tasks ({summary['succeeded']} ok, {summary['failed']} failed, "
+          f"{summary['skipped']} skipped, {summary['cached']} cached) in {summary['elapsed']}s: "
+          f"{summary['tasks_per_second']} tasks/s, {summary['completion_tokens_per_second']} completion tokens/s",
+          file=sys.stderr)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Compare the legacy per-keyword classifier with the memoized one (same scan, cached per model)
+
+Usage: python benchmarks/bench_classifier.py [--models 1000] [--rounds 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import classifier
+from benchmarks.synthetic import synthetic_catalog
+
+
+def legacy_generate_model_categories(model):
+    """The original substring-loop implementation, kept here as the reference"""
+    categories = []
+    name = model.get('name', '').lower()
+    description = model.get('description', '').lower()
+    model_id = model.get('id', '').lower()
+    architecture = model.get('architecture', {})
+    capabilities = model.get('capabilities', {})
+
+    input_modalities = architecture.get('input_modalities', [])
+    if 'image' in input_modalities:
+        categories.append('vision')
+    if 'text' in input_modalities and 'image' in input_modalities:
+        categories.append('multimodal')
+
+    supported_params = capabilities.get('supported_parameters', [])
+    if 'tools' in supported_params:
+        categories.append('tools')
+    if 'reasoning' in supported_params:
+        categories.append('reasoning')
+
+    combined_text = f"{name} {description} {model_id}"
+    for category, keywords in classifier.CONTENT_KEYWORDS.items():
+        if any(keyword in combined_text for keyword in keywords):
+            categories.append(category)
+
+    provider = model.get('id', '').split('/')[0]
+    if provider in classifier.PROVIDER_SPECIALTIES:
+        categories.extend(classifier.PROVIDER_SPECIALTIES[provider])
+
+    context_length = model.get('context_length', 0)
+    if isinstance(context_length, int):
+        if context_length >= 128000:
+            categories.append('long-context')
+        elif context_length >= 32000:
+            categories.append('medium-context')
+        elif context_length <= 8192:
+            categories.append('short-context')
+
+    return list(set(categories))
+
+
+def best_of(rounds, fn, setup=None):
+    """Best wall time of fn over several rounds, in seconds"""
+    best = float('inf')
+    for _ in range(rounds):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--models', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    models = synthetic_catalog(args.models)
+
+    mismatches = [m['id'] for m in models
+                  if set(legacy_generate_model_categories(m)) != set(classifier.generate_model_categories(m))]
+    if mismatches:
+        print(f"❌ {len(mismatches)} models classified differently, e.g. {mismatches[:3]}")
+        sys.exit(1)
+
+    legacy = best_of(args.rounds, lambda: [legacy_generate_model_categories(m) for m in models])
+    unmemoized = best_of(args.rounds, lambda: [classifier.classify_model(m) for m in models])
+    cold = best_of(args.rounds, lambda: [classifier.generate_model_categories(m) for m in models],
+                   setup=classifier._memo.clear)
+    warm = best_of(args.rounds, lambda: [classifier.generate_model_categories(m) for m in models])
+
+    print(f"Classifier benchmark: {args.models} synthetic models, best of {args.rounds}")
+    print(f"  outputs identical:        yes")
+    print(f"  legacy substring loops:   {legacy * 1000:8.2f} ms")
+    print(f"  classify, no memo:        {unmemoized * 1000:8.2f} ms")
+    print(f"  classify + memo (cold):   {cold * 1000:8.2f} ms")
+    print(f"  classify + memo (warm):   {warm * 1000:8.2f} ms  ({legacy / warm:.1f}x faster than legacy)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""Load test /api/models, /api/categories, /api/chat and /api/chat/stream against a fake OpenRouter
+
+Starts the fake upstream and one app server as subprocesses, then drives each scenario with
+--concurrency closed-loop clients for --duration seconds. Reports latency percentiles, time to
+first token for streams, throughput, errors and the server's RSS, and saves everything as JSON
+so runs can be compared (--baseline prints the change against an earlier results file).
+
+Usage: python benchmarks/bench_load.py [--server async] [--concurrency 32] [--duration 10]
+       [--scenarios models,chat] [--latency 0.2 --token-rate 50 --error-rate 0.01]
+       [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_streams import ROOT, SERVERS, free_port, proc_status, wait_for_port
+
+# Figures compared against --baseline, and whether lower is better
+COMPARED = {
+    'latency_p50_ms': True, 'latency_p95_ms': True, 'latency_p99_ms': True,
+    'ttft_p50_ms': True, 'ttft_p95_ms': True, 'requests_per_second': False, 'peak_rss_mb': True
+}
+
+
+async def get_models(session, base, args, i):
+    async with session.get(f'{base}/api/models') as response:
+        await response.read()
+        return {'ok': response.status == 200, 'error': None if response.status == 200 else f'HTTP {response.status}'}
+
+
+async def get_categories(session, base, args, i):
+    async with session.get(f'{base}/api/categories') as response:
+        await response.read()
+        return {'ok': response.status == 200, 'error': None if response.status == 200 else f'HTTP {response.status}'}
+
+
+async def post_chat(session, base, args, i):
+    # A fresh message every time, so the reply cache and coalescing do not answer for upstream
+    async with session.post(f'{base}/api/chat', json={'model': args.model, 'message': f'load test {i}'}) as response:
+        data = await response.json(content_type=None)
+    if not data.get('success'):
+        return {'ok': False, 'error': data.get('error') or f'HTTP {response.status}'}
+    return {'ok': True, 'tokens': (data.get('usage') or {}).get('completion_tokens') or 0}
+
+
+async def post_chat_stream(session, base, args, i):
+    start = time.perf_counter()
+    ttft = None
+    body = {'model': args.model, 'message': f'load test {i}', 'include_content': False}
+    async with session.post(f'{base}/api/chat/stream', json=body) as response:
+        if response.status != 200:
+            return {'ok': False, 'error': f'HTTP {response.status}'}
+        async for line in response.content:
+            if not line.startswith(b'data: '):
+                continue
+            if ttft is None and b'"type": "chunk"' in line:
+                ttft = time.perf_counter() - start
+            elif b'"type": "done"' in line:
+                usage = json.loads(line[6:]).get('usage') or {}
+                return {'ok': True, 'ttft': ttft, 'tokens': usage.get('completion_tokens') or 0}
+            elif b'"error"' in line:
+                return {'ok': False, 'error': json.loads(line[6:]).get('error')}
+    return {'ok': False, 'error': 'Stream ended without a done event'}
+
+
+SCENARIOS = {
+    'models': get_models,
+    'categories': get_categories,
+    'chat': post_chat,
+    'stream': post_chat_stream
+}
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of a sorted list, in milliseconds"""
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+
+async def run_scenario(base, name, args, pid, counter):
+    """Drive one scenario for args.duration seconds; returns its summary"""
+    call = SCENARIOS[name]
+    samples = []
+    peak = {'threads': 0, 'rss': 0.0}
+
+    async def sample():
+        while True:
+            threads, rss = proc_status(pid)
+            peak['threads'] = max(peak['threads'], threads)
+            peak['rss'] = max(peak['rss'], rss)
+            await asyncio.sleep(0.1)
+
+    async def client(session, deadline):
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            started = time.perf_counter()
+            try:
+                result = await call(session, base, args, i)
+            except Exception as e:
+                result = {'ok': False, 'error': type(e).__name__}
+            result['latency'] = time.perf_counter() - started
+            samples.append(result)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        # One untimed request first, so a cold catalog load is not part of the figures
+        await call(session, base, args, next(counter))
+
+        sampler = asyncio.create_task(sample())
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(client(session, deadline) for _ in range(args.concurrency)))
+        wall = time.perf_counter() - started
+        sampler.cancel()
+
+    ok = [s for s in samples if s['ok']]
+    latencies = sorted(s['latency'] for s in ok)
+    ttfts = sorted(s['ttft'] for s in ok if s.get('ttft') is not None)
+    tokens = sum(s.get('tokens') or 0 for s in ok)
+    errors = Counter(str(s['error'])[:80] for s in samples if not s['ok'])
+    _, end_rss = proc_status(pid)
+
+    return {
+        'requests': len(samples),
+        'ok': len(ok),
+        'errors': len(samples) - len(ok),
+        'error_kinds': dict(errors.most_common(5)),
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(len(ok) / wall, 2) if wall else None,
+        'tokens_per_second': round(tokens / wall, 1) if wall and tokens else None,
+        'latency_p50_ms': percentile(latencies, 0.50),
+        'latency_p95_ms': percentile(latencies, 0.95),
+        'latency_p99_ms': percentile(latencies, 0.99),
+        'latency_max_ms': percentile(latencies, 1.0),
+        'ttft_p50_ms': percentile(ttfts, 0.50),
+        'ttft_p95_ms': percentile(ttfts, 0.95),
+        'ttft_p99_ms': percentile(ttfts, 0.99),
+        'peak_rss_mb': round(peak['rss'], 1),
+        'end_rss_mb': round(end_rss, 1),
+        'peak_threads': peak['threads']
+    }
+
+
+def report(name, result):
+    line = (f"{name:>10}: {result['ok']:6d} ok {result['errors']:5d} err  {result['requests_per_second'] or 0:8.1f} req/s  "
+            f"p50 {result['latency_p50_ms'] or 0:8.1f}ms  p95 {result['latency_p95_ms'] or 0:8.1f}ms  "
+            f"p99 {result['latency_p99_ms'] or 0:8.1f}ms")
+    if result['ttft_p50_ms'] is not None:
+        line += f"  ttft p50 {result['ttft_p50_ms']:7.1f}ms p95 {result['ttft_p95_ms']:7.1f}ms"
+    if result['tokens_per_second']:
+        line += f"  {result['tokens_per_second']:8.1f} tok/s"
+    line += f"  RSS {result['peak_rss_mb']:6.1f} MB"
+    print(line)
+    for error, count in result['error_kinds'].items():
+        print(f"{'':>12}{count:6d} x {error}")
+
+
+def compare(results, baseline):
+    """Print each compared figure's change from a previous results file"""
+    print(f"\nChange from {baseline['timestamp']} ({baseline.get('git_commit') or 'unknown commit'}):")
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for key, lower_is_better in COMPARED.items():
+            old, new = before.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            delta = (new - old) / old * 100
+            better = (delta < 0) == lower_is_better
+            changes.append(f"{key} {old:g} -> {new:g} ({delta:+.1f}%{'' if abs(delta) < 5 else ' better' if better else ' worse'})")
+        print(f"{name:>10}: " + '; '.join(changes))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=sorted(SERVERS), default='flask-threaded')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=32, help='clients issuing requests back to back')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario')
+    parser.add_argument('--model', default='bench/model', help='model id sent with chat requests')
+    parser.add_argument('--models', type=int, default=300, help='size of the fake catalog')
+    parser.add_argument('--tokens', type=int, default=50, help='tokens per reply')
+    parser.add_argument('--token-rate', type=float, default=200, help='upstream tokens per second')
+    parser.add_argument('--latency', type=float, default=0.05, help='upstream seconds before a reply starts')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of upstream chats failing with 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of upstream chats getting a 429')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    upstream_port = free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, 'benchmarks/fake_openrouter.py', '--port', str(upstream_port),
+         '--models', str(args.models), '--tokens', str(args.tokens), '--token-rate', str(args.token_rate),
+         '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+         '--rate-limit-rate', str(args.rate_limit_rate)],
+        cwd=ROOT, stdout=subprocess.DEVNULL
+    )
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        OPENROUTER_BASE_URL=f'http://127.0.0.1:{upstream_port}/api/v1',
+        OPENROUTER_API_KEY='fake',
+        FLASK_ENV='production',
+        MODEL_CACHE_BACKGROUND_REFRESH='0',
+        # Admission control should not be what limits the run
+        SCHEDULER_GLOBAL_CONCURRENCY=str(max(args.concurrency, 32)),
+        SCHEDULER_MODEL_CONCURRENCY=str(max(args.concurrency, 8))
+    )
+    server = subprocess.Popen(SERVERS[args.server], cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'scenarios': {}
+    }
+    try:
+        wait_for_port(upstream_port)
+        wait_for_port(port)
+        print(f"{args.server}: {args.concurrency} clients x {args.duration:g}s per scenario; upstream "
+              f"{args.latency * 1000:.0f}ms + {args.tokens} tokens at {args.token_rate:g}/s, "
+              f"{args.error_rate:.0%} errors, {args.rate_limit_rate:.0%} 429s")
+        counter = itertools.count()
+        for name in names:
+            result = asyncio.run(run_scenario(f'http://127.0.0.1:{port}', name, args, server.pid, counter))
+            results['scenarios'][name] = result
+            report(name, result)
+    finally:
+        server.terminate()
+        upstream.terminate()
+        server.wait(timeout=10)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Stream a synthetic 50k-token OpenRouter response through the legacy and current SSE relays
+
+Usage: python benchmarks/bench_relay.py [--tokens 50000] [--rounds 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from relay import StreamRelay
+
+WORDS = ['the', 'model', 'relay', 'stream', 'token', 'naïve', 'café', '"quoted"', 'back\\slash', 'tab\t', 'line\n',
+         'emoji 🧬', '中文', '<tag>', 'x' * 12, ' ', ',', '.']
+
+
+def synthetic_upstream(tokens, seed=0):
+    """OpenRouter-shaped SSE body split into network-sized reads"""
+    rng = random.Random(seed)
+    events = [b': OPENROUTER PROCESSING\n\n']
+    for i in range(tokens):
+        chunk = {
+            'id': 'gen-123', 'provider': 'Fake', 'model': 'fake/model', 'object': 'chat.completion.chunk',
+            'created': 1700000000,
+            'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': rng.choice(WORDS)},
+                         'finish_reason': None, 'native_finish_reason': None, 'logprobs': None}]
+        }
+        events.append(b'data: ' + json.dumps(chunk, separators=(',', ':')).encode('utf-8') + b'\n\n')
+    events.append(b'data: [DONE]\n\n')
+    body = b''.join(events)
+
+    # Reads of 1 to ~8 events, cut at arbitrary byte offsets like a real socket
+    reads, pos = [], 0
+    while pos < len(body):
+        size = rng.randint(100, 2400)
+        reads.append(body[pos:pos + size])
+        pos += size
+    return reads
+
+
+def legacy_relay(reads):
+    """The original generate() loop: per-line decode, json.loads, json.dumps and += accumulation"""
+    out = []
+    pending = b''
+    accumulated_content = ""
+    total_tokens = 0
+    for block in reads:
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                line_str = line.decode('utf-8')
+                if line_str.startswith('data: '):
+                    data_str = line_str[6:]
+                    if data_str.strip() == '[DONE]':
+                        out.append(f"data: {json.dumps({'type': 'done', 'content': accumulated_content, 'usage': {'total_tokens': total_tokens}})}\n\n")
+                        continue
+                    try:
+                        chunk_data = json.loads(data_str)
+                        if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
+                            delta = chunk_data['choices'][0].get('delta', {})
+                            if 'content' in delta:
+                                content_chunk = delta['content']
+                                accumulated_content += content_chunk
+                                total_tokens += 1
+                                out.append(f"data: {json.dumps({'type': 'chunk', 'content': content_chunk})}\n\n")
+                    except json.JSONDecodeError:
+                        continue
+    return ''.join(out).encode('utf-8')
+
+
+def current_relay(reads, include_content=True):
+    relay = StreamRelay(include_content=include_content)
+    out = [relay.feed_bytes(block) for block in reads]
+    out.append(relay.finish())
+    if relay.done:
+        out.append(relay.done_event())
+    return b''.join(out)
+
+
+def decode_events(body):
+    """Events without usage, which the legacy relay only approximated"""
+    events = [json.loads(line[6:]) for line in body.split(b'\n') if line.startswith(b'data: ')]
+    for event in events:
+        event.pop('usage', None)
+    return events
+
+
+def best_of(rounds, fn):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    reads = synthetic_upstream(args.tokens)
+    upstream_mb = sum(map(len, reads)) / 1e6
+
+    if decode_events(legacy_relay(reads)) != decode_events(current_relay(reads)):
+        print("❌ Relays produced different events")
+        sys.exit(1)
+
+    legacy = best_of(args.rounds, lambda: legacy_relay(reads))
+    current = best_of(args.rounds, lambda: current_relay(reads))
+    no_content = best_of(args.rounds, lambda: current_relay(reads, include_content=False))
+
+    print(f"Relay benchmark: {args.tokens} tokens, {upstream_mb:.1f} MB upstream in {len(reads)} reads, best of {args.rounds}")
+    print(f"  events identical:          yes")
+    print(f"  legacy relay:              {legacy * 1000:8.1f} ms  ({args.tokens / legacy / 1000:6.0f}k tokens/s)")
+    print(f"  current relay:             {current * 1000:8.1f} ms  ({args.tokens / current / 1000:6.0f}k tokens/s, {legacy / current:.1f}x)")
+    print(f"  current, no done content:  {no_content * 1000:8.1f} ms  ({args.tokens / no_content / 1000:6.0f}k tokens/s, {legacy / no_content:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
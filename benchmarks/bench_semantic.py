@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Check which prompt pairs the semantic cache treats as the same question, and time its lookups
+
+Usage: python benchmarks/bench_semantic.py [--entries 5000] [--lookups 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import semantic_cache
+from semantic_cache import SemanticCache
+
+MODEL = 'bench/model:free'
+
+# Rewordings of one question; the second must be answered with the first's reply
+PARAPHRASES = [
+    ("What's the capital of France?", 'what is the capital of france'),
+    ('How do I reverse a list in Python?', 'How to reverse a list in python'),
+    ('Please explain recursion in simple terms', 'explain recursion simply'),
+    ('When did World War 2 end?', 'when did world war 2 end'),
+    ("Why doesn't my Python code run?", 'Why does my python code not run?'),
+]
+
+# Alike in wording but asking something else; the second must never get the first's reply
+NEAR_MISSES = [
+    ('When did World War 2 end?', 'Where did World War 2 end?'),
+    ('When did World War 2 end?', 'Why did World War 2 end?'),
+    ('When did World War 2 end?', 'How did World War 2 end?'),
+    ('How do I reverse a list in Python?', 'Why do I reverse a list in Python?'),
+    ('Who wrote Hamlet?', 'When was Hamlet written?'),
+    ('Is Python interpreted?', 'Is Python not interpreted?'),
+    ('Does the sun rise in the east?', "Doesn't the sun rise in the east?"),
+    ('Should I use tabs?', 'Should I never use tabs?'),
+    ("What's the capital of France?", "What's the capital of Spain?"),
+    ('How do I reverse a list in Python?', 'How do I reverse a string in Python?'),
+]
+
+TOPICS = ['python', 'rust', 'history', 'cooking', 'physics', 'music', 'finance', 'chess', 'biology', 'travel']
+WORDS = ['list', 'sort', 'tree', 'war', 'bread', 'energy', 'chord', 'stock', 'opening', 'cell', 'visa', 'loop',
+         'empire', 'oven', 'orbit', 'scale', 'bond', 'endgame', 'gene', 'flight', 'string', 'queue', 'treaty']
+STARTS = ['How do I', 'What is', 'Why does', 'When should I', 'Explain', 'Where can I find']
+
+
+def check_pairs(threshold):
+    """Pairs the cache gets wrong: (kind, stored, asked, similarity)"""
+    failures = []
+    for kind, pairs, should_hit in (('paraphrase', PARAPHRASES, True), ('near miss', NEAR_MISSES, False)):
+        for stored, asked in pairs:
+            cache = SemanticCache(threshold=threshold)
+            cache.put(MODEL, stored, 'reply', None)
+            hit = cache.get(MODEL, asked)
+            if bool(hit) != should_hit:
+                failures.append((kind, stored, asked, hit['similarity'] if hit else None))
+    return failures
+
+
+def check_replace_then_evict():
+    """A reworded prompt replacing its group's only entry must stay findable and evictable; returns an error or None"""
+    cache = SemanticCache(max_entries=2)
+    try:
+        cache.put(MODEL, 'What is Python?', 'first', None)
+        cache.put(MODEL, 'what is python', 'second', None)
+        hit = cache.get(MODEL, 'What is Python?')
+        if not hit or hit['content'] != 'second':
+            return f'replaced entry not found (got {hit})'
+        for prompt in ('What is Rust?', 'What is Go?', 'What is Haskell?'):
+            cache.put(MODEL, prompt, 'reply', None)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    if cache.stats()['entries'] != 2:
+        return f"{cache.stats()['entries']} entries kept, expected 2"
+    return None
+
+
+def synthetic_prompt(rng):
+    return f"{rng.choice(STARTS)} {' '.join(rng.sample(WORDS, 3))} in {rng.choice(TOPICS)}?"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--threshold', type=float, default=semantic_cache.DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    failures = check_pairs(args.threshold)
+    if failures:
+        for kind, stored, asked, similarity in failures:
+            outcome = f'hit at {similarity}' if similarity is not None else 'missed'
+            print(f"❌ {kind}: {asked!r} after {stored!r} {outcome}")
+        sys.exit(1)
+
+    error = check_replace_then_evict()
+    if error:
+        print(f"❌ replace then evict: {error}")
+        sys.exit(1)
+
+    rng = random.Random(0)
+    cache = SemanticCache(threshold=args.threshold, max_entries=args.entries)
+    for _ in range(args.entries):
+        cache.put(MODEL, synthetic_prompt(rng), 'reply', None)
+    prompts = [synthetic_prompt(rng) for _ in range(args.lookups)]
+
+    start = time.perf_counter()
+    for prompt in prompts:
+        cache.get(MODEL, prompt)
+    elapsed = time.perf_counter() - start
+
+    stats = cache.stats()
+    print(f"Semantic cache benchmark: {stats['entries']} entries, {args.lookups} lookups, {stats['backend']} backend")
+    print(f"  paraphrases matched:      {len(PARAPHRASES)}/{len(PARAPHRASES)}")
+    print(f"  near misses kept apart:   {len(NEAR_MISSES)}/{len(NEAR_MISSES)}")
+    print(f"  replace then evict:       ok")
+    print(f"  lookup mean:              {elapsed / args.lookups * 1000:8.3f} ms")
+    print(f"  lookup p95:               {stats['lookup_p95_ms']:8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Concurrent /api/chat/stream capacity: threaded Flask server vs the async serving mode
+
+Starts a fake OpenRouter and each server as subprocesses, opens --streams concurrent
+streaming chats against each, and reports completions, time-to-first-chunk, wall time,
+the server's peak thread count and RSS, and how many chats reached upstream (one per
+stream, or the servers are not doing the same work).
+
+Usage: python benchmarks/bench_streams.py [--streams 500] [--tokens 40] [--token-delay 0.05]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    # What app.run / start.py do today: Werkzeug's threaded server, one thread per request
+    'flask-threaded': [sys.executable, '-c', 'import os; from app import app; app.run(host="127.0.0.1", port=int(os.environ["PORT"]), threaded=True)'],
+    'async': [sys.executable, 'async_app.py']
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def upstream_chats(port):
+    """Chat completions the fake upstream has served so far"""
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stats', timeout=5) as response:
+        return json.load(response).get('chat_requests', 0)
+
+
+def proc_status(pid):
+    """(threads, rss_mb) of a process from /proc"""
+    threads = rss = 0
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+                elif line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return threads, rss
+
+
+async def one_stream(session, url, i, results):
+    start = time.perf_counter()
+    first = None
+    chunks = 0
+    # A message of its own, so the reply cache and coalescing of identical streams do not answer for upstream
+    body = {'model': 'bench/model:free', 'message': f'hello {i}', 'cache': False}
+    try:
+        async with session.post(url, json=body) as response:
+            async for line in response.content:
+                if line.startswith(b'data: '):
+                    # Streams open with an id event; time the first token
+                    if first is None and b'"chunk"' in line:
+                        first = time.perf_counter() - start
+                    if b'"done"' in line:
+                        results['ok'] += 1
+                        results['ttft'].append(first)
+                        return
+                    if b'"error"' in line:
+                        break
+                    chunks += 1
+    except Exception:
+        pass
+    results['failed'] += 1
+
+
+async def drive(port, streams, pid):
+    results = {'ok': 0, 'failed': 0, 'ttft': []}
+    peak = {'threads': 0, 'rss': 0.0}
+
+    async def sample():
+        while True:
+            threads, rss = proc_status(pid)
+            peak['threads'] = max(peak['threads'], threads)
+            peak['rss'] = max(peak['rss'], rss)
+            await asyncio.sleep(0.05)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        sampler = asyncio.create_task(sample())
+        start = time.perf_counter()
+        await asyncio.gather(*(one_stream(session, f'http://127.0.0.1:{port}/api/chat/stream', i, results) for i in range(streams)))
+        wall = time.perf_counter() - start
+        sampler.cancel()
+
+    return results, peak, wall
+
+
+def run_server(name, command, env, args, upstream_port):
+    port = free_port()
+    server_env = dict(env, PORT=str(port))
+    proc = subprocess.Popen(command, cwd=ROOT, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        chats_before = upstream_chats(upstream_port)
+        results, peak, wall = asyncio.run(drive(port, args.streams, proc.pid))
+        chats = upstream_chats(upstream_port) - chats_before
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+    ttft = sorted(results['ttft'])
+    p = lambda q: ttft[min(len(ttft) - 1, int(q * len(ttft)))] * 1000 if ttft else float('nan')
+    print(f"{name:>15}: {results['ok']:5d} ok  {results['failed']:4d} failed  wall {wall:6.2f}s  "
+          f"ttft p50 {p(0.5):7.1f}ms p95 {p(0.95):7.1f}ms  "
+          f"peak threads {peak['threads']:5d}  peak RSS {peak['rss']:6.1f} MB  upstream chats {chats:5d}")
+    if chats < results['ok']:
+        print(f"{'':>15}  ⚠️  {results['ok'] - chats} streams were answered without an upstream chat (cache or coalescing)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=500, help='concurrent streaming chats')
+    parser.add_argument('--tokens', type=int, default=40, help='tokens per reply')
+    parser.add_argument('--token-delay', type=float, default=0.05, help='upstream seconds per token')
+    parser.add_argument('--servers', default=','.join(SERVERS))
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, 'benchmarks/fake_openrouter.py', '--port', str(upstream_port),
+         '--tokens', str(args.tokens), '--token-delay', str(args.token_delay)],
+        cwd=ROOT, stdout=subprocess.DEVNULL
+    )
+    env = dict(
+        os.environ,
+        OPENROUTER_BASE_URL=f'http://127.0.0.1:{upstream_port}/api/v1',
+        OPENROUTER_API_KEY='fake',
+        FLASK_ENV='production',
+        MODEL_CACHE_BACKGROUND_REFRESH='0',
+        # Measure serving capacity, not admission control or the :free rate limit
+        SCHEDULER_GLOBAL_CONCURRENCY=str(args.streams),
+        SCHEDULER_MODEL_CONCURRENCY=str(args.streams),
+        SCHEDULER_FREE_RPM='0'
+    )
+
+    try:
+        wait_for_port(upstream_port)
+        print(f"{args.streams} concurrent streams, {args.tokens} tokens at {args.token_delay * 1000:.0f}ms/token")
+        for name in args.servers.split(','):
+            run_server(name, SERVERS[name], env, args, upstream_port)
+    finally:
+        upstream.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""Local fake of the OpenRouter API for benchmarks and manual testing
+
+Serves a synthetic /api/v1/models catalog and /api/v1/chat/completions in JSON and SSE modes,
+with configurable latency, token rate and injected errors and 429s.
+
+Usage: python benchmarks/fake_openrouter.py [--port 8765] [--models 300] [--latency 0.2]
+       [--token-rate 50] [--error-rate 0.01] [--rate-limit-rate 0.02]
+Then run the app with OPENROUTER_BASE_URL=http://127.0.0.1:8765/api/v1 OPENROUTER_API_KEY=fake
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import synthetic_catalog
+
+
+class FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    """Serves /api/v1/models and /api/v1/chat/completions over keep-alive HTTP/1.1"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_GET(self):
+        if self.path.startswith('/api/v1/models'):
+            self.send_json(200, self.server.models_body)
+        elif self.path == '/_stats':
+            self.send_json(200, json.dumps(self.server.stats).encode('utf-8'))
+        else:
+            self.send_json(404, b'{"error":{"message":"Not found"}}')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path != '/api/v1/chat/completions':
+            self.send_json(404, b'{"error":{"message":"Not found"}}')
+            return
+
+        self.server.count('chat_requests')
+        status = self.server.take_failure()
+        if status:
+            self.server.count(f'injected_{status}')
+            self.send_json(status, json.dumps(
+                {'error': {'message': f'Injected failure {status}'}}
+            ).encode('utf-8'), {'Retry-After': str(self.server.retry_after)} if status == 429 else None)
+            return
+
+        tokens = self.server.reply_tokens(body)
+        usage = self.server.usage(body, tokens)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if body.get('stream'):
+            include_usage = (body.get('stream_options') or {}).get('include_usage')
+            self.send_stream(body.get('model'), tokens, usage if include_usage else None)
+        else:
+            # A JSON reply arrives only once the whole completion has been generated
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay * len(tokens))
+            self.send_json(200, json.dumps({
+                'id': 'gen-fake',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}],
+                'usage': usage
+            }).encode('utf-8'))
+
+    def send_json(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, model, tokens, usage=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            delay = self.server.slow_models.get(model)
+            if delay:
+                time.sleep(delay)
+            for token in tokens:
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+                chunk = {'id': 'gen-fake', 'model': model, 'choices': [{'index': 0, 'delta': {'content': token}}]}
+                self.write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            if usage is not None:
+                chunk = {'id': 'gen-fake', 'model': model, 'choices': [], 'usage': usage}
+                self.write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            self.write_chunk(b'data: [DONE]\n\n')
+            self.write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            self.server.count('cancelled_streams')
+            self.close_connection = True
+
+    def write_chunk(self, data):
+        self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeOpenRouterServer(ThreadingHTTPServer):
+    """Threaded fake upstream with a synthetic catalog and failure injection"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, models=300, reply_tokens=50, token_delay=0.0, report_usage=True,
+                 fail_first=0, fail_status=503, slow_models=None, latency=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, seed=0, retry_after=1):
+        super().__init__(address, FakeOpenRouterHandler)
+        self.models_body = json.dumps({'data': synthetic_catalog(models)}).encode('utf-8')
+        self.tokens = reply_tokens
+        self.token_delay = token_delay
+        self.report_usage = report_usage
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        # Seconds before any chat reply starts, on top of token generation
+        self.latency = latency
+        # Chance of each chat request failing with fail_status, or with a 429
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # Retry-After seconds sent with every injected 429
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        # model id -> seconds to wait before a streamed reply's first token
+        self.slow_models = slow_models or {}
+        self.stats = {'connections': 0, 'chat_requests': 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def take_failure(self):
+        """Status to reject this chat request with, or None
+
+        The first fail_first requests fail; after that each one fails at random with
+        error_rate (fail_status) or rate_limit_rate (429).
+        """
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return self.fail_status
+            roll = self._rng.random()
+            if roll < self.rate_limit_rate:
+                return 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                return self.fail_status
+            return None
+
+    def reply_tokens(self, body):
+        """Synthetic reply, one word-piece per streamed token"""
+        count = min(int(body.get('max_tokens') or self.tokens), self.tokens)
+        return [f'tok{i} ' for i in range(count)]
+
+    def usage(self, body, tokens):
+        """Usage block like OpenRouter's, or None when usage reporting is switched off"""
+        if not self.report_usage:
+            return None
+        prompt_tokens = sum(len(str(m.get('content', '')).split()) + 4 for m in body.get('messages', []))
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/api/v1'
+
+
+def start_fake_server(port=0, **options):
+    """Start a fake server on a background thread and return it"""
+    server = FakeOpenRouterServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, name='fake-openrouter', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--models', type=int, default=300, help='size of the synthetic catalog')
+    parser.add_argument('--tokens', type=int, default=50, help='tokens per chat reply')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds between streamed tokens')
+    parser.add_argument('--token-rate', type=float, help='tokens per second (overrides --token-delay)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before every chat reply starts')
+    parser.add_argument('--no-usage', action='store_true', help='never report token usage')
+    parser.add_argument('--fail-first', type=int, default=0, help='reject this many chat requests first')
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='chance of a chat request failing with --fail-status')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='chance of a chat request getting a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with injected 429s')
+    parser.add_argument('--seed', type=int, default=0, help='seed for injected failures')
+    parser.add_argument('--slow-model', action='append', default=[], metavar='MODEL=SECONDS',
+                        help='delay a model\'s first streamed token (repeatable)')
+    args = parser.parse_args()
+
+    server = FakeOpenRouterServer(
+        ('127.0.0.1', args.port),
+        models=args.models,
+        reply_tokens=args.tokens,
+        token_delay=1 / args.token_rate if args.token_rate else args.token_delay,
+        report_usage=not args.no_usage,
+        fail_first=args.fail_first,
+        fail_status=args.fail_status,
+        slow_models={model: float(delay) for model, delay in (item.rsplit('=', 1) for item in args.slow_model)},
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+        retry_after=args.retry_after
+    )
+    print(f"🧪 Fake OpenRouter listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import random
+
+PROVIDERS = ['meta-llama', 'google', 'mistralai', 'deepseek', 'qwen', 'anthropic', 'openai', 'microsoft', 'cohere', 'nousresearch']
+
+FILLER = (
+    'the model is a state of the art language system trained on a large corpus of web data with '
+    'strong performance across benchmarks and tasks including general knowledge and instruction following'
+).split()
+
+FEATURES = [
+    'code', 'programming', 'developer', 'coding', 'github', 'python', 'javascript', 'math', 'mathematical',
+    'calculation', 'solver', 'theorem', 'reasoning', 'logic', 'analysis', 'think', 'step-by-step', 'creative',
+    'writing', 'story', 'literature', 'poetry', 'novel', 'roleplay', 'character', 'persona', 'chat', 'assistant',
+    'uncensored', 'nsfw', 'unfiltered', 'fast', 'speed', 'quick', 'nano', 'turbo', 'instant', 'large', 'big',
+    'giant', 'huge', 'massive', 'small', 'mini', 'tiny', 'lite', 'compact', 'multilingual', 'vision', 'agentic'
+]
+
+CONTEXT_LENGTHS = [4096, 8192, 16384, 32768, 65536, 131072, 200000, 1000000]
+
+
+def synthetic_model(i, rng):
+    """One model in the raw OpenRouter /api/v1/models format"""
+    provider = rng.choice(PROVIDERS)
+    size = rng.choice(['1b', '3b', '8b', '14b', '32b', '70b', '405b'])
+    free = rng.random() < 0.3
+    model_id = f'{provider}/model-{i}-{size}' + (':free' if free else '')
+    words = [rng.choice(FEATURES) if rng.random() < 0.08 else rng.choice(FILLER) for _ in range(rng.randint(20, 120))]
+    input_modalities = ['text', 'image'] if rng.random() < 0.25 else ['text']
+    supported = rng.sample(['tools', 'reasoning', 'temperature', 'top_p', 'max_tokens', 'response_format'], 3)
+
+    return {
+        'id': model_id,
+        'canonical_slug': model_id.split(':')[0],
+        'hugging_face_id': f'{provider}/Model-{i}',
+        'name': f'{provider.title()} Model {i} {size.upper()}' + (' (free)' if free else ''),
+        'created': 1700000000 + i * 3600,
+        'description': ' '.join(words).capitalize() + '.',
+        'context_length': rng.choice(CONTEXT_LENGTHS),
+        'architecture': {
+            'modality': '+'.join(input_modalities) + '->text',
+            'input_modalities': input_modalities,
+            'output_modalities': ['text'],
+            'tokenizer': rng.choice(['Llama3', 'GPT', 'Gemini', 'Mistral', 'Qwen', 'Claude', 'Other']),
+            'instruct_type': None
+        },
+        'pricing': {
+            'prompt': '0' if free else f'{rng.uniform(0.0000001, 0.00002):.10f}',
+            'completion': '0' if free else f'{rng.uniform(0.0000002, 0.00006):.10f}'
+        },
+        'top_provider': {
+            'context_length': None,
+            'max_completion_tokens': rng.choice([None, 4096, 8192, 16384]),
+            'is_moderated': rng.random() < 0.2
+        },
+        # Present on some upstream entries; the classifier reads it when it is there
+        'capabilities': {'supported_parameters': supported} if rng.random() < 0.5 else {},
+        'supported_parameters': supported,
+        'per_request_limits': None
+    }
+
+
+def synthetic_catalog(count, seed=0):
+    """A deterministic synthetic catalog of count models"""
+    rng = random.Random(seed)
+    return [synthetic_model(i, rng) for i in range(count)]
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # No flock (Windows): each worker refreshes on its own, the snapshot file still works
+    fcntl = None
+
+from singleflight import SingleFlight
+
+# Distinct filter/projection combinations cached per snapshot; the least recently used go first
+MAX_CACHED_RESPONSES = 256
+
+CATALOG_FLIGHT_KEY = ('models',)
+SNAPSHOT_FLIGHT_KEY = ('models', 'snapshot')
+
+# Layout version of the on-disk snapshot; files in any other format are ignored
+SNAPSHOT_FORMAT = 1
+
+
+class ModelIndex:
+    """Lookup tables over the enriched catalog, built once per refresh"""
+
+    def __init__(self, models):
+        self.models = models
+        self.by_id = {}
+        self.positions = {}
+        self.by_category = {}
+        self.by_provider = {}
+        self.by_price = {'free': set(), 'paid': set()}
+
+        for position, model in enumerate(models):
+            model_id = model.get('id')
+            self.by_id[model_id] = model
+            self.positions[model_id] = position
+
+            is_free = model.get('pricing', {}).get('is_free', ':free' in (model_id or ''))
+            self.by_price['free' if is_free else 'paid'].add(model_id)
+
+            for category in model.get('categories', []):
+                self.by_category.setdefault(category, set()).add(model_id)
+
+            provider = model.get('provider') or (model_id.split('/')[0] if model_id and '/' in model_id else 'unknown')
+            self.by_provider.setdefault(provider, set()).add(model_id)
+
+        self.categories = sorted(self.by_category)
+        self.providers = sorted(self.by_provider)
+        self.fields = frozenset(field for model in models for field in model)
+
+    def get(self, model_id):
+        """Return a model by id, or None"""
+        return self.by_id.get(model_id)
+
+    def select_ids(self, price='all', categories=None, providers=None):
+        """Return the set of ids matching all filters (values within one filter are OR'd)"""
+        candidates = []
+
+        if price in self.by_price:
+            candidates.append(self.by_price[price])
+        if categories:
+            candidates.append(_union(self.by_category, categories))
+        if providers:
+            candidates.append(_union(self.by_provider, providers))
+
+        if not candidates:
+            return None
+
+        # Intersect starting from the smallest set to keep the work proportional to the result
+        candidates.sort(key=len)
+        selected = set(candidates[0])
+        for ids in candidates[1:]:
+            selected &= ids
+        return selected
+
+    def filter(self, price='all', categories=None, providers=None):
+        """Return matching models in catalog order"""
+        selected = self.select_ids(price, categories, providers)
+        if selected is None:
+            return self.models
+
+        positions = self.positions
+        return [self.by_id[model_id] for model_id in sorted(selected, key=positions.__getitem__)]
+
+
+def _union(table, keys):
+    """Union of the id sets stored under keys"""
+    if len(keys) == 1:
+        return table.get(keys[0], set())
+    ids = set()
+    for key in keys:
+        ids |= table.get(key, set())
+    return ids
+
+
+class EncodedBody:
+    """A response body compressed at most once per content-coding, with a strong ETag for each
+
+    With precompress off, each coding is compressed on first request for it, so a client never
+    pays for one it does not accept.
+    """
+
+    def __init__(self, body, etag, precompress=True):
+        self.body = body
+        self._bodies = {None: body}
+        self._compress_lock = threading.Lock()
+
+        # Each content-coding is a distinct representation and needs its own strong ETag
+        self.etags = {
+            None: f'"{etag}"',
+            'gzip': f'"{etag}-gz"',
+            'br': f'"{etag}-br"'
+        }
+
+        if precompress:
+            self.encoded('gzip')
+            self.encoded('br')
+
+    def encoded(self, content_encoding):
+        """The body in content_encoding, compressing it on first use; None for br without Brotli"""
+        body = self._bodies.get(content_encoding)
+        if body is not None or (content_encoding == 'br' and brotli is None):
+            return body
+
+        with self._compress_lock:
+            body = self._bodies.get(content_encoding)
+            if body is None:
+                if content_encoding == 'br':
+                    body = brotli.compress(self.body)
+                else:
+                    body = gzip.compress(self.body, compresslevel=9)
+                self._bodies[content_encoding] = body
+        return body
+
+    @property
+    def gzip_body(self):
+        return self.encoded('gzip')
+
+    @property
+    def br_body(self):
+        return self.encoded('br')
+
+    def negotiate(self, accept_encodings):
+        """Pick the smallest acceptable encoding; returns (body, content_encoding, etag)"""
+        if brotli is not None and accept_encodings['br']:
+            return self.encoded('br'), 'br', self.etags['br']
+        if accept_encodings['gzip']:
+            return self.encoded('gzip'), 'gzip', self.etags['gzip']
+        return self.body, None, self.etags[None]
+
+    def matches(self, if_none_match):
+        """True if any ETag in an If-None-Match header refers to this response"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return not candidates.isdisjoint(self.etags.values())
+
+
+class EncodedResponse(EncodedBody):
+    """A JSON body serialized once and compressed once per content-coding, with its strong ETags"""
+
+    def __init__(self, payload, etag, precompress=True):
+        super().__init__(json.dumps(payload, separators=(',', ':')).encode('utf-8'), etag, precompress)
+
+
+class CatalogSnapshot:
+    """Immutable view of the enriched model catalog at one point in time"""
+
+    def __init__(self, models, version, fetched_at):
+        self.models = models
+        self.version = version
+        self.fetched_at = fetched_at
+        self.index = ModelIndex(models)
+
+        # Content digest, so every worker derives the same ETags for the same catalog
+        self.digest = hashlib.sha1(
+            json.dumps(models, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        ).hexdigest()
+
+        self._responses = OrderedDict()
+        self._responses_lock = threading.Lock()
+
+    def encoded_response(self, key, build_payload, precompress=False):
+        """Return the memoized EncodedResponse for key, building it on first use
+
+        key must already be normalized (known values, sorted, deduplicated) so that equivalent
+        requests share one entry. Entries are compressed lazily per content-coding unless
+        precompress is set, and the least recently used is evicted past MAX_CACHED_RESPONSES.
+        """
+        with self._responses_lock:
+            encoded = self._responses.get(key)
+            if encoded is not None:
+                self._responses.move_to_end(key)
+                return encoded
+
+        key_digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:8]
+        encoded = EncodedResponse(build_payload(), f'{self.digest[:16]}.{key_digest}', precompress)
+
+        with self._responses_lock:
+            encoded = self._responses.setdefault(key, encoded)
+            self._responses.move_to_end(key)
+            while len(self._responses) > MAX_CACHED_RESPONSES:
+                self._responses.popitem(last=False)
+        return encoded
+
+    def age(self):
+        """Seconds since this snapshot was fetched from upstream"""
+        return time.time() - self.fetched_at
+
+
+class CatalogCache:
+    """Process-wide model catalog cache with TTL, background refresh and stale-while-revalidate
+
+    With a snapshot_path, every successful refresh is also saved there (atomically, as versioned
+    JSON), and a process with nothing loaded starts from that file instead of waiting on upstream.
+    Workers sharing the file take turns refreshing under a file lock, and one that finds the file
+    refreshed by another while it waited adopts it rather than fetching again. source names the
+    upstream the catalog came from, so a file saved against a different one is never served.
+    """
+
+    def __init__(self, loader, ttl=300, retry_after=15, background=True, flight=None, snapshot_path=None, source=None):
+        self._loader = loader
+        self._refresh_hooks = []
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.background = background
+        self.snapshot_path = snapshot_path
+        self.source = source
+
+        self._snapshot = None
+        self._version = 0
+        self._last_failure = 0.0
+        self._last_error = None
+
+        self._flight = flight or SingleFlight()
+        self._state_lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+        self._counters = {'snapshot_loads': 0, 'snapshot_writes': 0}
+
+    def get(self):
+        """Return the last good snapshot, loading it on first use; None if nothing was ever loaded"""
+        self._ensure_refresher()
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Cold cache: start from the saved snapshot if there is one, even a stale one, and
+            # warm its responses in the background so the first request is not held up
+            snapshot = self._flight.do(SNAPSHOT_FLIGHT_KEY, lambda: self.load_snapshot(warm_async=True))
+        if snapshot is None:
+            # Nothing saved either: wait for (or perform) the single in-flight load
+            return self.refresh(wait=True)
+
+        if snapshot.age() >= self.ttl:
+            # Serve stale data immediately and revalidate in the background
+            self._refresh_async()
+
+        return snapshot
+
+    def refresh(self, wait=False):
+        """Fetch a fresh catalog from upstream, keeping the old snapshot if the fetch fails"""
+        if not wait and self._flight.in_flight(CATALOG_FLIGHT_KEY):
+            # Someone else is already fetching; readers keep the current snapshot
+            return self._snapshot
+
+        # Concurrent callers share one upstream fetch (stampede protection)
+        return self._flight.do(CATALOG_FLIGHT_KEY, self._fetch)
+
+    def _fetch(self):
+        with self._refresh_lock():
+            # Another worker may have refreshed the shared snapshot while this one waited
+            current = self._snapshot
+            adopted = self.load_snapshot(newer_than=current.fetched_at if current else 0, warm_async=True)
+            if adopted is not None and adopted.age() < self._refresh_interval():
+                return adopted
+
+            # Upstream failed moments ago: keep serving what we have (possibly nothing) rather than
+            # letting every stale read retry it
+            if self._backing_off():
+                return self._snapshot
+
+            try:
+                models = self._loader()
+            except Exception as e:
+                self._last_failure = time.time()
+                self._last_error = str(e)
+                print(f"Error refreshing model catalog: {e}")
+                return self._snapshot
+
+            snapshot = self._install(models, time.time())
+            self._last_error = None
+            self._save_snapshot(snapshot)
+
+        self._run_refresh_hooks(snapshot)
+        return snapshot
+
+    def _backing_off(self):
+        """True within retry_after seconds of a failed upstream fetch"""
+        return time.time() - self._last_failure < self.retry_after
+
+    def _install(self, models, fetched_at):
+        with self._state_lock:
+            self._version += 1
+            self._snapshot = CatalogSnapshot(models, self._version, fetched_at)
+            return self._snapshot
+
+    def load_snapshot(self, newer_than=0, warm_async=False):
+        """Adopt the saved snapshot if it is newer than newer_than; None if there is none to adopt"""
+        if not self.snapshot_path:
+            return None
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error reading catalog snapshot: {e}")
+            return None
+
+        if saved.get('format') != SNAPSHOT_FORMAT or saved.get('source') != self.source:
+            return None
+        if saved.get('fetched_at', 0) <= newer_than or not isinstance(saved.get('models'), list):
+            return None
+
+        snapshot = self._install(saved['models'], saved['fetched_at'])
+        with self._state_lock:
+            self._counters['snapshot_loads'] += 1
+        if warm_async:
+            threading.Thread(target=self._run_refresh_hooks, args=(snapshot,), name='catalog-warm', daemon=True).start()
+        else:
+            self._run_refresh_hooks(snapshot)
+        return snapshot
+
+    def _save_snapshot(self, snapshot):
+        """Write atomically, so a worker reading the file never sees a partial snapshot"""
+        if not self.snapshot_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        saved = {
+            'format': SNAPSHOT_FORMAT,
+            'source': self.source,
+            'fetched_at': snapshot.fetched_at,
+            'models': snapshot.models
+        }
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Error writing catalog snapshot: {e}")
+            return
+        with self._state_lock:
+            self._counters['snapshot_writes'] += 1
+
+    @contextmanager
+    def _refresh_lock(self):
+        """Hold the lock next to the snapshot file, so workers sharing it never fetch at the same time"""
+        if not self.snapshot_path or fcntl is None:
+            yield
+            return
+        try:
+            lock_file = open(f'{self.snapshot_path}.lock', 'a')
+        except OSError as e:
+            print(f"Error opening catalog snapshot lock: {e}")
+            yield
+            return
+        with lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh_interval(self):
+        return max(self.ttl * 0.8, 1)
+
+    def on_refresh(self, hook):
+        """Register hook(snapshot) to run after each successful refresh, e.g. to warm caches"""
+        self._refresh_hooks.append(hook)
+        return hook
+
+    def _run_refresh_hooks(self, snapshot):
+        """Run refresh hooks, never letting one break the refresh itself"""
+        for hook in self._refresh_hooks:
+            try:
+                hook(snapshot)
+            except Exception as e:
+                print(f"Error in catalog refresh hook: {e}")
+
+    def _refresh_async(self):
+        """Kick off a non-blocking refresh unless one is already running or upstream just failed"""
+        if self._flight.in_flight(CATALOG_FLIGHT_KEY) or self._backing_off():
+            return
+        threading.Thread(target=self.refresh, name='catalog-refresh', daemon=True).start()
+
+    def _ensure_refresher(self):
+        """Lazily start the background refresher in the serving process"""
+        if not self.background or self._refresher is not None:
+            return
+
+        with self._state_lock:
+            if self._refresher is not None:
+                return
+            self._refresher = threading.Thread(
+                target=self._refresh_loop, name='catalog-refresher', daemon=True
+            )
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        """Keep the catalog warm by refreshing shortly before it goes stale"""
+        while not self._stop.wait(self._refresh_interval()):
+            self.refresh()
+
+    def stop(self):
+        """Stop the background refresher"""
+        self._stop.set()
+
+    def stats(self):
+        """Return cache state for health reporting"""
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'version': snapshot.version if snapshot else 0,
+            'age_seconds': round(snapshot.age(), 1) if snapshot else None,
+            'model_count': len(snapshot.models) if snapshot else 0,
+            'ttl_seconds': self.ttl,
+            'refreshing': self._flight.in_flight(CATALOG_FLIGHT_KEY),
+            'last_error': self._last_error,
+            'snapshot_file': self.snapshot_path,
+            **self._counters
+        }
+
+
+def cache_from_env(loader, flight=None, source=None):
+    """Build a CatalogCache configured from environment variables (MODEL_CACHE_FILE enables the snapshot file)"""
+    return CatalogCache(
+        loader,
+        ttl=float(os.environ.get('MODEL_CACHE_TTL', 300)),
+        retry_after=float(os.environ.get('MODEL_CACHE_RETRY_AFTER', 15)),
+        background=os.environ.get('MODEL_CACHE_BACKGROUND_REFRESH', '1') != '0',
+        flight=flight,
+        snapshot_path=os.environ.get('MODEL_CACHE_FILE') or None,
+        source=source
+    )
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import hashlib
+import threading
+
+# Content analysis keywords matched against name, description and id
+CONTENT_KEYWORDS = {
+    'code': ['code', 'programming', 'developer', 'coding', 'github', 'python', 'javascript'],
+    'math': ['math', 'mathematical', 'calculation', 'solver', 'theorem'],
+    'reasoning': ['reasoning', 'logic', 'analysis', 'think', 'step-by-step'],
+    'creative': ['creative', 'writing', 'story', 'literature', 'poetry', 'novel'],
+    'roleplay': ['roleplay', 'character', 'persona', 'chat', 'assistant'],
+    'uncensored': ['uncensored', 'nsfw', 'unfiltered', 'unconstrained'],
+    'fast': ['fast', 'speed', 'quick', 'nano', 'turbo', 'instant'],
+    'large': ['large', 'big', 'giant', 'huge', 'massive'],
+    'small': ['small', 'mini', 'tiny', 'lite', 'compact']
+}
+
+# Provider-specific categories
+PROVIDER_SPECIALTIES = {
+    'anthropic': ['reasoning', 'helpful'],
+    'openai': ['general', 'popular'],
+    'meta-llama': ['open-source'],
+    'google': ['research', 'advanced'],
+    'mistralai': ['efficient'],
+    'deepseek': ['reasoning', 'code'],
+    'qwen': ['multilingual'],
+    'microsoft': ['enterprise'],
+    'cohere': ['search', 'embeddings']
+}
+
+# Classified models kept before the memo is reset (a few catalog generations)
+MAX_MEMO_ENTRIES = 8192
+
+
+def content_categories(text):
+    """Return the set of categories with at least one keyword occurring in text
+
+    One substring search per keyword, stopping at a category's first hit. A single compiled
+    alternation was tried and measured about 3x slower on catalog-sized text (it must try every
+    position to keep overlapping keywords such as 'lite' in 'literature'), so the saving comes
+    from the memo in generate_model_categories, which skips unchanged models entirely.
+    """
+    return {category for category, keywords in CONTENT_KEYWORDS.items() if any(keyword in text for keyword in keywords)}
+
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def _fingerprint(model):
+    """Hash of the metadata that categorization depends on"""
+    architecture = model.get('architecture', {})
+    capabilities = model.get('capabilities', {})
+    parts = (
+        model.get('name', ''),
+        model.get('description', ''),
+        repr(architecture.get('input_modalities', [])),
+        repr(capabilities.get('supported_parameters', [])),
+        repr(model.get('context_length', 0))
+    )
+    return hashlib.blake2b('\x00'.join(parts).encode('utf-8'), digest_size=16).digest()
+
+
+def classify_model(model):
+    """Generate categories/tags for a model based on its metadata"""
+    categories = set()
+
+    # Get model info
+    name = model.get('name', '').lower()
+    description = model.get('description', '').lower()
+    model_id = model.get('id', '').lower()
+    architecture = model.get('architecture', {})
+    capabilities = model.get('capabilities', {})
+
+    # Modality-based categories
+    input_modalities = architecture.get('input_modalities', [])
+    if 'image' in input_modalities:
+        categories.add('vision')
+    if 'text' in input_modalities and 'image' in input_modalities:
+        categories.add('multimodal')
+
+    # Capability-based categories
+    supported_params = capabilities.get('supported_parameters', [])
+    if 'tools' in supported_params:
+        categories.add('tools')
+    if 'reasoning' in supported_params:
+        categories.add('reasoning')
+
+    # Content analysis over name, description and id joined into one text
+    categories |= content_categories(f"{name} {description} {model_id}")
+
+    provider = model.get('id', '').split('/')[0]
+    categories.update(PROVIDER_SPECIALTIES.get(provider, []))
+
+    # Context length categories
+    context_length = model.get('context_length', 0)
+    if isinstance(context_length, int):
+        if context_length >= 128000:
+            categories.add('long-context')
+        elif context_length >= 32000:
+            categories.add('medium-context')
+        elif context_length <= 8192:
+            categories.add('short-context')
+
+    # Sorted so every worker serializes (and ETags) the catalog identically
+    return sorted(categories)
+
+
+def generate_model_categories(model):
+    """Categorize a model, reusing the previous result if its metadata is unchanged"""
+    key = (model.get('id', ''), _fingerprint(model))
+
+    categories = _memo.get(key)
+    if categories is None:
+        categories = classify_model(model)
+        with _memo_lock:
+            if len(_memo) >= MAX_MEMO_ENTRIES:
+                _memo.clear()
+            _memo[key] = categories
+
+    return list(categories)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import queue
+import threading
+import time
+
+from relay import iter_response_bytes, sse_event
+from routing import STREAM_IDLE_TIMEOUT, Contender
+
+
+class CompareStream:
+    """Streams one prompt from several models at once, multiplexed into a single event stream
+
+    Each model runs on its own thread: admit(model_id) blocks until the scheduler gives it a
+    slot (raising QueueFull or TimeoutError), open_stream(model_id) returns a streamed upstream
+    response or an error dict, and make_relay(model_id) a model-tagged StreamRelay. Events are
+    yielded as soon as any model produces them, so a slow or failing model never holds up the
+    others. on_done(model_id, relay, stats) is called for every reply that completes.
+    """
+
+    def __init__(self, model_ids, open_stream, make_relay, admit, on_done=None):
+        self.model_ids = list(model_ids)
+        self._open_stream = open_stream
+        self._make_relay = make_relay
+        self._admit = admit
+        self._on_done = on_done
+        self._events = queue.Queue()
+        self._runs = []
+        self.stats = {}
+
+    def _read(self, run):
+        """Reader thread: put (run, kind, payload) on the shared queue"""
+        try:
+            ticket = self._admit(run.model_id)
+            if not run.hold(ticket):
+                return
+            self._events.put((run, 'admitted', None))
+
+            response = self._open_stream(run.model_id)
+            if isinstance(response, dict):
+                self._events.put((run, 'error', response['error']))
+                return
+            if not run.attach(response):
+                return
+            for block in iter_response_bytes(response):
+                if run.cancelled:
+                    return
+                self._events.put((run, 'data', block))
+            self._events.put((run, 'end', None))
+        except Exception as e:
+            self._events.put((run, 'error', str(e)))
+
+    def events(self):
+        """Yield every model's events as they arrive, then a "compare_done" event with all stats"""
+        for model_id in self.model_ids:
+            run = Contender(model_id, self._make_relay(model_id), None)
+            self._runs.append(run)
+            self.stats[model_id] = {'status': 'queued'}
+            threading.Thread(target=self._read, args=(run,), name=f'compare-{model_id}', daemon=True).start()
+
+        remaining = len(self._runs)
+        while remaining:
+            try:
+                run, kind, payload = self._events.get(timeout=STREAM_IDLE_TIMEOUT)
+            except queue.Empty:
+                for run in self._runs:
+                    if self.stats[run.model_id]['status'] in ('queued', 'streaming'):
+                        self._fail(run, 'Upstream stream stalled')
+                        yield sse_event({'type': 'error', 'model': run.model_id, 'error': 'Upstream stream stalled'}).encode('utf-8')
+                break
+
+            if run is None:
+                # cancel() was called
+                for run in self._runs:
+                    if self.stats[run.model_id]['status'] in ('queued', 'streaming'):
+                        self.stats[run.model_id]['status'] = 'cancelled'
+                return
+
+            stats = self.stats[run.model_id]
+            if stats['status'] not in ('queued', 'streaming') or run.cancelled:
+                continue
+
+            if kind == 'admitted':
+                stats['queued'] = round(time.monotonic() - run.started, 3)
+            elif kind == 'data':
+                events = run.relay.feed_bytes(payload)
+                if events:
+                    if run.first_token_at is None:
+                        run.first_token_at = time.monotonic()
+                        stats['status'] = 'streaming'
+                        stats['ttft'] = round(run.first_token_at - run.started, 3)
+                    yield events
+            elif kind == 'end' and run.relay.done:
+                remaining -= 1
+                events = run.relay.finish()
+                if events:
+                    yield events
+                self._finish(run, stats)
+                yield run.relay.done_event(extra={'stats': stats})
+            else:
+                remaining -= 1
+                error = payload or 'Upstream stream ended unexpectedly'
+                self._fail(run, error)
+                yield sse_event({'type': 'error', 'model': run.model_id, 'error': error}).encode('utf-8')
+
+        yield sse_event({'type': 'compare_done', 'models': self.stats}).encode('utf-8')
+
+    def _finish(self, run, stats):
+        finished = time.monotonic()
+        usage = run.relay.usage()
+        stats['status'] = 'done'
+        stats['duration'] = round(finished - run.started, 3)
+        stats['ttft'] = stats.get('ttft', stats['duration'])
+        completion_tokens = usage.get('completion_tokens') or 0
+        generating = finished - (run.first_token_at or finished)
+        stats['completion_tokens'] = completion_tokens
+        stats['tokens_per_second'] = round(completion_tokens / generating, 1) if generating > 0 else None
+        self._close(run)
+        if self._on_done is not None:
+            self._on_done(run.model_id, run.relay, stats)
+
+    def _fail(self, run, error):
+        stats = self.stats[run.model_id]
+        stats['status'] = 'error'
+        stats['error'] = error
+        stats['duration'] = round(time.monotonic() - run.started, 3)
+        self._close(run)
+
+    def _close(self, run):
+        """Give back a finished model's scheduler slot straight away
+
+        A fully read response has already returned its connection to the pool, so cancelling
+        it only closes the ticket; a failed one is dropped.
+        """
+        run.cancel()
+
+    def close(self):
+        """Cancel every model still running"""
+        for run in self._runs:
+            run.cancel()
+
+    def cancel(self):
+        """Abandon the comparison from another thread: cancel every model and end events()"""
+        self.close()
+        self._events.put((None, 'cancelled', None))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from tokens import estimate_message_tokens
+
+# Used when the catalog does not know a model (or the catalog is unavailable)
+DEFAULT_CONTEXT_LENGTH = 4096
+DEFAULT_MAX_COMPLETION_TOKENS = 1000
+
+# Local token counts are estimates; leave this share of the window unused
+CONTEXT_HEADROOM = 0.1
+
+MAX_CACHED_MESSAGES = 16384
+
+
+class ContextBuilder:
+    """Packs as much recent chat history as fits a model's token budget
+
+    The budget is the model's context_length minus the tokens reserved for the reply.
+    Per-message token counts are cached by content hash, so re-packing a conversation on
+    every turn only tokenizes the messages that are new since the last one.
+    """
+
+    def __init__(self, max_completion_tokens=DEFAULT_MAX_COMPLETION_TOKENS, max_context_tokens=None,
+                 cache_size=MAX_CACHED_MESSAGES):
+        self.max_completion_tokens = max_completion_tokens
+        self.max_context_tokens = max_context_tokens
+        self.cache_size = cache_size
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def completion_tokens(self, model=None):
+        """Tokens to request (and reserve) for the reply"""
+        limit = ((model or {}).get('capabilities') or {}).get('max_completion_tokens')
+        if isinstance(limit, int) and limit > 0:
+            return min(limit, self.max_completion_tokens)
+        return self.max_completion_tokens
+
+    def budget(self, model=None):
+        """Prompt tokens available for history plus the new message"""
+        context_length = (model or {}).get('context_length')
+        if not isinstance(context_length, int) or context_length <= 0:
+            context_length = DEFAULT_CONTEXT_LENGTH
+
+        budget = int((context_length - self.completion_tokens(model)) * (1 - CONTEXT_HEADROOM))
+        if self.max_context_tokens:
+            budget = min(budget, self.max_context_tokens)
+        return max(budget, 0)
+
+    def message_tokens(self, message, tokenizer=None):
+        """Estimated prompt tokens for one message, cached by tokenizer and content"""
+        content = message.get('content') or ''
+        if not isinstance(content, str):
+            content = str(content)
+        key = hashlib.blake2b(f'{tokenizer}\x00{content}'.encode('utf-8'), digest_size=16).digest()
+
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self._hits += 1
+                return count
+
+        count = estimate_message_tokens({'content': content}, tokenizer)
+        with self._lock:
+            self._misses += 1
+            self._counts[key] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def build(self, message, history=None, model=None):
+        """Upstream messages: the newest history that fits the budget, then the new message"""
+        tokenizer = ((model or {}).get('architecture') or {}).get('tokenizer')
+        current = {"role": "user", "content": message}
+        remaining = self.budget(model) - self.message_tokens(current, tokenizer)
+
+        # Walk back from the newest message and stop at the first one that no longer fits,
+        # so the context is always a contiguous recent slice of the conversation
+        packed = []
+        for msg in reversed(history or []):
+            entry = {"role": msg.get('role', 'user'), "content": msg.get('content', '')}
+            cost = self.message_tokens(entry, tokenizer)
+            if cost > remaining:
+                break
+            remaining -= cost
+            packed.append(entry)
+
+        packed.reverse()
+        packed.append(current)
+        return packed
+
+    def stats(self):
+        """Return token-count cache counters"""
+        with self._lock:
+            return {
+                'cached_messages': len(self._counts),
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+
+def context_from_env():
+    """Build a ContextBuilder configured from environment variables"""
+    max_context_tokens = int(os.environ.get('CHAT_MAX_CONTEXT_TOKENS', 0)) or None
+    return ContextBuilder(
+        max_completion_tokens=int(os.environ.get('CHAT_MAX_COMPLETION_TOKENS', DEFAULT_MAX_COMPLETION_TOKENS)),
+        max_context_tokens=max_context_tokens
+    )
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Roles a stored message may have (those the chat completions API accepts)
+ROLES = ('system', 'user', 'assistant', 'tool')
+
+# Triggers keeping the SQLite store's one-row totals table in step: (name, event, action)
+TOTALS_TRIGGERS = (
+    ('totals_conversation_insert', 'INSERT ON conversations',
+     'UPDATE totals SET conversations = conversations + 1, bytes = bytes + NEW.bytes'),
+    ('totals_conversation_delete', 'DELETE ON conversations',
+     'UPDATE totals SET conversations = conversations - 1, bytes = bytes - OLD.bytes'),
+    ('totals_conversation_resize', 'UPDATE OF bytes ON conversations',
+     'UPDATE totals SET bytes = bytes + NEW.bytes - OLD.bytes'),
+    ('totals_message_insert', 'INSERT ON messages', 'UPDATE totals SET messages = messages + 1'),
+    ('totals_message_delete', 'DELETE ON messages', 'UPDATE totals SET messages = messages - 1')
+)
+
+
+def new_conversation_id():
+    return uuid.uuid4().hex
+
+
+def clean_message(message):
+    """Keep only the fields sent upstream; raises ValueError for a message that cannot be stored"""
+    if not isinstance(message, dict):
+        raise ValueError('each message must be a {role, content} object')
+    role = message.get('role', 'user')
+    content = message.get('content', '')
+    if role not in ROLES:
+        raise ValueError(f"message role must be one of: {', '.join(ROLES)}")
+    if not isinstance(content, str):
+        raise ValueError('message content must be a string')
+    return {'role': role, 'content': content}
+
+
+def _message_bytes(message):
+    return len(message['content'].encode('utf-8')) + len(message['role']) + 64
+
+
+class MemoryConversationStore:
+    """In-process conversation store, evicting least recently used conversations past max_bytes
+
+    Each worker process has its own store, so it only suits a single process (gunicorn.conf.py
+    switches several workers to the SQLite store); a client whose conversation is unknown sends
+    that turn with its full local history instead (see script.js).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._conversations = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def create(self, messages=None):
+        """Start a conversation, optionally seeded with earlier messages; returns its id"""
+        conversation_id = new_conversation_id()
+        messages = [clean_message(m) for m in messages or []]
+        with self._lock:
+            self._conversations[conversation_id] = []
+            self._sizes[conversation_id] = 0
+            self._add(conversation_id, messages)
+        return conversation_id
+
+    def get(self, conversation_id):
+        """The conversation's messages, or None if it does not exist (or was evicted)"""
+        with self._lock:
+            messages = self._conversations.get(conversation_id)
+            if messages is None:
+                return None
+            self._conversations.move_to_end(conversation_id)
+            return list(messages)
+
+    def append(self, conversation_id, *messages):
+        """Add messages to a conversation; returns False if it does not exist"""
+        messages = [clean_message(m) for m in messages]
+        with self._lock:
+            if conversation_id not in self._conversations:
+                return False
+            self._conversations.move_to_end(conversation_id)
+            self._add(conversation_id, messages)
+            return True
+
+    def delete(self, conversation_id):
+        """Forget a conversation; returns False if it did not exist"""
+        with self._lock:
+            if conversation_id not in self._conversations:
+                return False
+            del self._conversations[conversation_id]
+            self._bytes -= self._sizes.pop(conversation_id)
+            return True
+
+    def _add(self, conversation_id, messages):
+        size = sum(_message_bytes(m) for m in messages)
+        self._conversations[conversation_id].extend(messages)
+        self._sizes[conversation_id] += size
+        self._bytes += size
+
+        # Never evict the conversation being written, even if it alone exceeds the cap
+        while self._bytes > self.max_bytes and len(self._conversations) > 1:
+            oldest, _ = self._conversations.popitem(last=False)
+            self._bytes -= self._sizes.pop(oldest)
+            self._evictions += 1
+
+    def stats(self):
+        """Return store size counters"""
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'conversations': len(self._conversations),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self._evictions
+            }
+
+
+class SQLiteConversationStore:
+    """Persistent conversation store in a SQLite file, shared by every worker process
+
+    Like the memory store it is capped at max_bytes, deleting the least recently updated
+    conversations first. Running totals are kept in a one-row table by triggers, so neither the
+    cap nor stats() has to scan the tables.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        db = self._connect()
+        db.execute('PRAGMA journal_mode=WAL')
+        # Immediate, so workers starting together set the schema up one at a time
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            self._create_schema(db)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def _create_schema(self, db):
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                bytes INTEGER NOT NULL DEFAULT 0
+            )''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            )''')
+        db.execute('CREATE INDEX IF NOT EXISTS messages_by_conversation ON messages (conversation_id, seq)')
+
+        # Files written before the size cap existed have no byte counts yet
+        columns = {row[1] for row in db.execute('PRAGMA table_info(conversations)')}
+        if 'bytes' not in columns:
+            db.execute('ALTER TABLE conversations ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0')
+            db.execute('''
+                UPDATE conversations SET bytes = (
+                    SELECT COALESCE(SUM(LENGTH(CAST(content AS BLOB)) + LENGTH(role) + 64), 0)
+                    FROM messages WHERE conversation_id = conversations.id
+                )''')
+        db.execute('CREATE INDEX IF NOT EXISTS conversations_by_update ON conversations (updated_at)')
+
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS totals (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                conversations INTEGER NOT NULL,
+                messages INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                evictions INTEGER NOT NULL
+            )''')
+        db.execute('''
+            INSERT OR IGNORE INTO totals (id, conversations, messages, bytes, evictions)
+            SELECT 0, (SELECT COUNT(*) FROM conversations), (SELECT COUNT(*) FROM messages),
+                   (SELECT COALESCE(SUM(bytes), 0) FROM conversations), 0
+        ''')
+        # One at a time: executescript() would commit the schema transaction
+        for name, event, action in TOTALS_TRIGGERS:
+            db.execute(f'CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} BEGIN {action}; END')
+
+    def _connect(self):
+        """One connection per thread; sqlite3 connections are not shared across threads"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute('PRAGMA foreign_keys=ON')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def create(self, messages=None):
+        """Start a conversation, optionally seeded with earlier messages; returns its id"""
+        conversation_id = new_conversation_id()
+        now = time.time()
+        messages = [clean_message(m) for m in messages or []]
+        with self._connect() as db:
+            db.execute('INSERT INTO conversations (id, created_at, updated_at, bytes) VALUES (?, ?, ?, ?)',
+                       (conversation_id, now, now, sum(_message_bytes(m) for m in messages)))
+            self._insert(db, conversation_id, messages)
+            self._evict(db, conversation_id)
+        return conversation_id
+
+    def get(self, conversation_id):
+        """The conversation's messages, or None if it does not exist"""
+        db = self._connect()
+        rows = db.execute('SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY seq',
+                          (conversation_id,)).fetchall()
+        if not rows and db.execute('SELECT 1 FROM conversations WHERE id = ?', (conversation_id,)).fetchone() is None:
+            return None
+        return [{'role': role, 'content': content} for role, content in rows]
+
+    def append(self, conversation_id, *messages):
+        """Add messages to a conversation; returns False if it does not exist"""
+        messages = [clean_message(m) for m in messages]
+        with self._connect() as db:
+            updated = db.execute('UPDATE conversations SET updated_at = ?, bytes = bytes + ? WHERE id = ?',
+                                 (time.time(), sum(_message_bytes(m) for m in messages), conversation_id)).rowcount
+            if not updated:
+                return False
+            self._insert(db, conversation_id, messages)
+            self._evict(db, conversation_id)
+        return True
+
+    def delete(self, conversation_id):
+        """Forget a conversation; returns False if it did not exist"""
+        with self._connect() as db:
+            return db.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,)).rowcount > 0
+
+    def _insert(self, db, conversation_id, messages):
+        db.executemany(
+            'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
+            [(conversation_id, m['role'], m['content']) for m in messages]
+        )
+
+    def _evict(self, db, keep):
+        """Delete the least recently updated conversations past max_bytes, never the one named keep"""
+        excess = db.execute('SELECT bytes FROM totals').fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+
+        victims = []
+        for conversation_id, size in db.execute(
+                'SELECT id, bytes FROM conversations WHERE id != ? ORDER BY updated_at', (keep,)):
+            victims.append((conversation_id,))
+            excess -= size
+            if excess <= 0:
+                break
+        db.executemany('DELETE FROM conversations WHERE id = ?', victims)
+        db.execute('UPDATE totals SET evictions = evictions + ?', (len(victims),))
+
+    def stats(self):
+        """Return store size counters"""
+        conversations, messages, size, evictions = self._connect().execute(
+            'SELECT conversations, messages, bytes, evictions FROM totals').fetchone()
+        return {
+            'backend': 'sqlite',
+            'conversations': conversations,
+            'messages': messages,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'evictions': evictions
+        }
+
+
+def store_from_env():
+    """SQLite store if CONVERSATION_DB is set, otherwise an in-memory one; both LRU-capped at CONVERSATION_MAX_BYTES"""
+    path = os.environ.get('CONVERSATION_DB')
+    max_bytes = int(os.environ.get('CONVERSATION_MAX_BYTES', DEFAULT_MAX_BYTES))
+    if path:
+        return SQLiteConversationStore(path, max_bytes=max_bytes)
+    return MemoryConversationStore(max_bytes=max_bytes)
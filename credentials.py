@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+
+# Seconds between checks of the key file for changes
+CHECK_INTERVAL = 1.0
+
+# round_robin cycles through the pool; least_limited prefers the key whose last 429 is oldest
+STRATEGIES = ('round_robin', 'least_limited')
+
+
+def split_keys(value):
+    """Keys in a comma-separated value, in order, without blanks or repeats"""
+    keys = []
+    for key in value.split(','):
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+class ApiKey:
+    """One OpenRouter key with its ready-made auth headers and rate-limit history"""
+
+    def __init__(self, key):
+        self.key = key
+        self.headers = {"Authorization": f"Bearer {key}"}
+        self.requests = 0
+        self.rate_limited = 0
+        self.last_rate_limited = 0.0
+
+    def stats(self):
+        return {
+            'key': f'...{self.key[-4:]}',
+            'requests': self.requests,
+            'rate_limited': self.rate_limited,
+            'last_rate_limited': self.last_rate_limited or None
+        }
+
+
+class CredentialProvider:
+    """OpenRouter API keys, read once and handed out from memory
+
+    Keys come from env_var (comma-separated for a pool) or, without it, from the first of paths
+    that exists, where each openrouter_api_key= line adds one or more keys. A key file is
+    checked for changes at most every check_interval seconds and re-read when its mtime moves;
+    request_reload() (wired to SIGHUP) forces a re-read. A reload that finds no keys keeps the
+    current ones, so a half-edited file never takes the app offline.
+    """
+
+    def __init__(self, env_var='OPENROUTER_API_KEY', paths=(), strategy='round_robin', check_interval=CHECK_INTERVAL):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown API key strategy {strategy!r}; expected one of {', '.join(STRATEGIES)}")
+        self.env_var = env_var
+        self.paths = [Path(path) for path in paths]
+        self.strategy = strategy
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._keys = []
+        self._error = None
+        self._path = None
+        self._mtime = None
+        self._checked = 0.0
+        self._next = 0
+        self._reload_requested = False
+        self._reloads = 0
+        self.reload()
+
+    def get(self):
+        """The ApiKey for the next upstream call; raises FileNotFoundError or ValueError if there is none"""
+        if self._reload_requested or (self._watching() and time.monotonic() - self._checked >= self.check_interval):
+            self._check()
+
+        with self._lock:
+            keys = self._keys
+            if not keys:
+                # A fresh exception each time; re-raising the stored one would grow its traceback per call
+                raise type(self._error)(*self._error.args)
+            if len(keys) == 1:
+                key = keys[0]
+            elif self.strategy == 'least_limited':
+                # Never-limited keys first; among equals, the least used, which rotates them
+                key = min(keys, key=lambda k: (k.last_rate_limited, k.requests))
+            else:
+                key = keys[self._next % len(keys)]
+                self._next += 1
+            key.requests += 1
+        return key
+
+    def observe(self, key, status_code):
+        """Note the status of an upstream reply made with key"""
+        if status_code == 429:
+            with self._lock:
+                key.rate_limited += 1
+                key.last_rate_limited = time.time()
+
+    def request_reload(self):
+        """Re-read the keys before the next call; safe to call from a signal handler"""
+        self._reload_requested = True
+
+    def reload(self):
+        """Re-read the keys from the environment or the key file"""
+        self._reload_requested = False
+        keys, path, mtime, error = self._load()
+        with self._lock:
+            if keys:
+                # Keys still in the pool keep their rate-limit history
+                current = {key.key: key for key in self._keys}
+                self._keys = [current.get(key) or ApiKey(key) for key in keys]
+                self._path = path
+            elif self._keys:
+                if str(error) != str(self._error):
+                    print(f"Error reloading API keys: {error}; keeping the current ones")
+                # Keep watching the old file (if any) for the fix
+                self._path = path or self._path
+            else:
+                self._path = path
+            self._error = error
+            self._mtime = mtime
+            self._checked = time.monotonic()
+            self._reloads += 1
+
+    def _watching(self):
+        # Keys from the environment cannot change under a running process
+        return self._path is not None or not self._keys
+
+    def _check(self):
+        if self._reload_requested or not self._keys:
+            self.reload()
+            return
+        try:
+            changed = os.path.getmtime(self._path) != self._mtime
+        except OSError:
+            changed = True
+        if changed:
+            self.reload()
+        else:
+            self._checked = time.monotonic()
+
+    def _load(self):
+        """(keys, path, mtime, error) from the environment or the first key file that exists"""
+        keys = split_keys(os.environ.get(self.env_var, ''))
+        if keys:
+            return keys, None, None, None
+
+        for path in self.paths:
+            try:
+                mtime = path.stat().st_mtime
+                with open(path, 'r') as f:
+                    lines = f.readlines()
+            except OSError:
+                continue
+            keys = []
+            for line in lines:
+                if line.startswith('openrouter_api_key='):
+                    keys.extend(key for key in split_keys(line.split('=', 1)[1]) if key not in keys)
+            if not keys:
+                return [], path, mtime, ValueError(f"openrouter_api_key not found in {path.name}")
+            return keys, path, mtime, None
+
+        return [], None, None, FileNotFoundError(f"API keys file not found at {self.paths[-1] if self.paths else None}")
+
+    def stats(self):
+        """Where the keys came from and how each one is doing"""
+        with self._lock:
+            return {
+                'source': str(self._path) if self._path else ('env' if self._keys else None),
+                'strategy': self.strategy,
+                'reloads': self._reloads,
+                'error': str(self._error) if self._error else None,
+                'keys': [key.stats() for key in self._keys]
+            }
+
+
+def reload_on_sighup(provider):
+    """Reload provider's keys on SIGHUP, where this process can take the signal; False if it cannot"""
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return False
+    # Never take the signal over from a server that handles it itself
+    if signal.getsignal(signal.SIGHUP) is not signal.SIG_DFL:
+        return False
+    signal.signal(signal.SIGHUP, lambda signum, frame: provider.request_reload())
+    return True
+
+
+def credentials_from_env():
+    """Build a CredentialProvider from OPENROUTER_API_KEY or the local api_keys.env file"""
+    return CredentialProvider(
+        paths=(Path.home() / "api_keys.env", Path(__file__).parent.parent.parent / "api_keys.env"),
+        strategy=os.environ.get('API_KEY_STRATEGY', 'round_robin'),
+        check_interval=float(os.environ.get('API_KEY_CHECK_INTERVAL', CHECK_INTERVAL))
+    )
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Production entry point: gunicorn -c gunicorn.conf.py
+
+Environment:
+  PORT              port to bind (default 5000)
+  WEB_CONCURRENCY   worker processes (default: number of CPU cores)
+  SERVER_MODE       'threads' (Flask on gthread workers, default) or 'async' (async_app on aiohttp workers)
+  WORKER_THREADS    threads per worker in 'threads' mode, i.e. concurrent requests/streams per process (default 32)
+  WORKER_CONNECTIONS  max simultaneous clients per worker in 'async' mode (default 1000)
+  MODEL_CACHE_FILE  catalog snapshot shared by the workers (default: openrouter-catalog.json in the temp dir)
+  CONVERSATION_DB   conversation store shared by the workers (default with more than one worker:
+                    openrouter-conversations.db in the temp dir, capped at CONVERSATION_MAX_BYTES)
+
+Send SIGHUP to the master process for a graceful reload: new workers start and warm up
+while old ones finish their in-flight streams.
+"""
+import multiprocessing
+import os
+import tempfile
+
+server_mode = os.environ.get('SERVER_MODE', 'threads')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Workers read it back to split the upstream rate limits between them (see scheduler_from_env)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+if server_mode == 'async':
+    wsgi_app = 'async_app:app_factory'
+    worker_class = 'aiohttp.GunicornWebWorker'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+else:
+    wsgi_app = 'app:app'
+    # gthread keeps one thread per in-flight request, so a stream never blocks the worker's other requests
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WORKER_THREADS', 32))
+
+# Streams can legitimately last as long as the upstream timeout; allow in-flight ones to finish on reload
+timeout = 120
+graceful_timeout = 35
+keepalive = 5
+
+# Each worker owns its catalog cache, connection pool and background threads, so do not preload
+preload_app = False
+
+# Workers share one saved catalog: the first to refresh writes it and the rest load it from disk
+os.environ.setdefault('MODEL_CACHE_FILE', os.path.join(tempfile.gettempdir(), 'openrouter-catalog.json'))
+
+# A follow-up message can land on any worker, so with several they keep conversations in one SQLite file
+if workers > 1:
+    os.environ.setdefault('CONVERSATION_DB', os.path.join(tempfile.gettempdir(), 'openrouter-conversations.db'))
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Warm this worker's model catalog before it starts accepting traffic
+
+    A saved snapshot is adopted straight away (a stale one is refreshed in the background);
+    only without one does the worker wait on upstream, and then only one worker fetches.
+    """
+    from app import catalog_cache
+
+    snapshot = catalog_cache.get()
+    if snapshot is not None:
+        worker.log.info("Worker %s warmed model catalog (%d models)", worker.pid, len(snapshot.models))
+    else:
+        worker.log.warning("Worker %s could not warm the model catalog; serving fallback models", worker.pid)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import json
+import re
+
+from tokens import normalize_usage
+
+# Upstream reads are up to this many bytes; read1 returns whatever has arrived, so this adds no latency
+READ_BUFFER_SIZE = 64 * 1024
+
+# The JSON string body of a delta's content, escapes and all
+CONTENT_RE = re.compile(rb'"content"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+CHUNK_PREFIX = b'data: {"type": "chunk", "content": "'
+CHUNK_SUFFIX = b'"}\n\n'
+
+
+def chunk_prefix(model=None):
+    """Start of a chunk event, tagged with the model it came from when several share a stream"""
+    if model is None:
+        return CHUNK_PREFIX
+    return b'data: {"type": "chunk", "model": ' + json.dumps(model).encode('utf-8') + b', "content": "'
+
+
+def sse_event(payload):
+    """Format one server-sent event in the wire format script.js parses"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def replay_events(content, usage, include_content=True, model=None, extra=None):
+    """chunk and done events for a reply that is already complete, such as a cache hit
+
+    extra is a dict of further fields for the done event, as in StreamRelay.done_event().
+    """
+    events = b''
+    if content:
+        events = chunk_prefix(model) + json.dumps(content)[1:-1].encode('ascii') + CHUNK_SUFFIX
+
+    done = {'type': 'done'}
+    if model is not None:
+        done['model'] = model
+    if include_content:
+        done['content'] = content
+    done['usage'] = usage
+    done['cached'] = True
+    if extra:
+        done.update(extra)
+    return events + sse_event(done).encode('utf-8')
+
+
+def iter_response_bytes(response, buffer_size=READ_BUFFER_SIZE):
+    """Yield a streamed requests response body as it arrives, in reads of up to buffer_size
+
+    Streams are requested uncompressed, but a Content-Encoding upstream applies anyway is decoded
+    (read1 with decode_content needs urllib3 2.3, pinned in requirements.txt).
+    """
+    raw = response.raw
+    while True:
+        data = raw.read1(buffer_size, decode_content=True)
+        if not data:
+            return
+        yield data
+
+
+def publish_stream(events, broadcast=None, cancelled=None):
+    """Yield downstream event blocks, publishing each to a Broadcast
+
+    Stops early once the cancelled event is set. If our own client goes away or cancels while
+    others follow the broadcast, the rest of the stream is still read and published for them.
+    """
+    for block in events:
+        if broadcast is not None:
+            broadcast.publish(block)
+        if cancelled is not None and cancelled.is_set():
+            drain_stream(events, broadcast)
+            return
+        try:
+            yield block
+        except GeneratorExit:
+            drain_stream(events, broadcast)
+            raise
+
+
+def drain_stream(events, broadcast):
+    """Read the rest of a stream for a broadcast's followers, if it has any"""
+    if broadcast is None or not broadcast.followers:
+        return
+    for block in events:
+        broadcast.publish(block)
+
+
+class StreamRelay:
+    """Turns upstream OpenRouter SSE bytes into the chunk/done events the UI expects
+
+    Delta content is spliced into the downstream event as the raw JSON string upstream sent,
+    so the common case never decodes or re-encodes JSON. The reply is kept as a list of those
+    raw pieces and only joined (and decoded, if someone asks for .content) once.
+
+    Usage comes from upstream's usage chunk when it sends one; otherwise estimate(content)
+    supplies a local estimate. With a model, every event is tagged with it (see /api/chat/compare).
+    """
+
+    def __init__(self, include_content=True, estimate=None, model=None):
+        self.include_content = include_content
+        self.estimate = estimate
+        self.model = model
+        self._chunk_prefix = chunk_prefix(model)
+        self._done_prefix = b'data: {"type": "done", '
+        if model is not None:
+            self._done_prefix += b'"model": ' + json.dumps(model).encode('utf-8') + b', '
+
+        self.reported_usage = None
+        self.chunks = 0
+        self.done = False
+        self._pending = b''
+        self._parts = []
+        self._content = None
+
+    def feed_bytes(self, data):
+        """Consume a block of upstream bytes and return the downstream events it completes"""
+        if self._pending:
+            data = self._pending + data
+        lines = data.split(b'\n')
+        self._pending = lines.pop()
+
+        events = [event for event in map(self._line_event, lines) if event]
+        return b''.join(events)
+
+    def feed(self, line):
+        """Consume one complete upstream line (without its newline)"""
+        return self._line_event(line)
+
+    def finish(self):
+        """Flush a final line that arrived without a trailing newline"""
+        pending, self._pending = self._pending, b''
+        return self._line_event(pending) if pending else b''
+
+    def _line_event(self, line):
+        if not line.startswith(b'data:'):
+            return b''
+
+        payload = line[5:].strip()
+        if payload == b'[DONE]':
+            # The caller sends done_event() once the upstream body is fully read
+            self.done = True
+            return b''
+
+        raw = self._extract_content(payload)
+        if raw is None:
+            return b''
+
+        self._parts.append(raw)
+        self.chunks += 1
+        return self._chunk_prefix + raw + CHUNK_SUFFIX
+
+    def _extract_content(self, payload):
+        """Raw JSON string body of the delta content, or None if the chunk carries no content"""
+        # Fast path: a single-choice chunk has exactly one unescaped "content" key and no usage
+        if payload.count(b'"content"') == 1 and b'"delta"' in payload and b'"usage"' not in payload:
+            m = CONTENT_RE.search(payload)
+            if m is not None:
+                return m.group(1)
+
+        try:
+            chunk_data = json.loads(payload)
+        except ValueError:
+            return None
+
+        if not isinstance(chunk_data, dict):
+            return None
+
+        # The usage chunk normally arrives last, with an empty choices list
+        if isinstance(chunk_data.get('usage'), dict):
+            self.reported_usage = normalize_usage(chunk_data['usage'])
+
+        choices = chunk_data.get('choices')
+        if not choices:
+            return None
+
+        content = choices[0].get('delta', {}).get('content')
+        if not isinstance(content, str):
+            return None
+        return json.dumps(content)[1:-1].encode('ascii')
+
+    def usage(self):
+        """Real upstream usage if it was reported, else a local estimate"""
+        if self.reported_usage is not None:
+            return self.reported_usage
+        if self.estimate is not None:
+            return self.estimate(self.content)
+        return {'completion_tokens': self.chunks, 'total_tokens': self.chunks, 'estimated': True}
+
+    def done_event(self, include_content=None, extra=None):
+        """The final event, with the complete reply unless the client opted out
+
+        extra is a dict of further fields to add, such as per-model stats.
+        """
+        if include_content is None:
+            include_content = self.include_content
+        tail = b'"usage": ' + json.dumps(self.usage()).encode('utf-8')
+        if extra:
+            tail += b', ' + json.dumps(extra)[1:-1].encode('utf-8')
+        if not include_content:
+            return self._done_prefix + tail + b'}\n\n'
+        return self._done_prefix + b'"content": "' + b''.join(self._parts) + b'", ' + tail + b'}\n\n'
+
+    @property
+    def content(self):
+        """The complete reply text received so far"""
+        if self._content is None or self._content[0] != len(self._parts):
+            text = json.loads(b'"' + b''.join(self._parts) + b'"')
+            self._content = (len(self._parts), text)
+        return self._content[1]
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL = 3600
+
+# Request fields that decide what upstream replies; anything else (stream, stream_options) does not
+KEY_FIELDS = ('model', 'messages', 'max_tokens', 'temperature', 'top_p', 'top_k', 'seed', 'stop',
+              'frequency_penalty', 'presence_penalty', 'repetition_penalty')
+
+# Expired files are swept from the disk tier once every this many stores
+DISK_PRUNE_INTERVAL = 256
+
+
+def request_key(payload):
+    """Canonical hash of the parts of a chat completion request that determine its reply"""
+    canonical = {field: payload[field] for field in KEY_FIELDS if field in payload}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Exact-match cache of completed chat replies
+
+    Memory is an LRU bounded by bytes; entries older than ttl seconds are treated as missing.
+    With a directory, replies are also written there (one JSON file per key) so they survive
+    restarts and are shared by every worker on the host.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, directory=None, enabled=True):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bypassed': 0}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, payload, use_cache=True):
+        """Cache key for a chat completion request, or None when it should bypass the cache"""
+        if not (self.enabled and use_cache):
+            return None
+        return request_key(payload)
+
+    def get(self, key):
+        """The cached {content, usage} for a key, or None"""
+        if key is None:
+            self._count('bypassed')
+            return None
+
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                entry, size = item
+                if now - entry['created'] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return entry
+                del self._entries[key]
+                self._bytes -= size
+
+        entry = self._read_disk(key, now)
+        if entry is None:
+            self._count('misses')
+            return None
+
+        self._count('disk_hits')
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, content, usage):
+        """Cache a completed reply; a None key (caching disabled for the request) is ignored"""
+        if key is None or not content:
+            return
+
+        entry = {'content': content, 'usage': usage, 'created': time.time()}
+        self._remember(key, entry)
+        if self.directory:
+            self._write_disk(key, entry)
+
+        with self._lock:
+            self._counters['stores'] += 1
+            prune = self.directory and self._counters['stores'] % DISK_PRUNE_INTERVAL == 0
+        if prune:
+            self._prune_disk()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _remember(self, key, entry):
+        size = len(entry['content'].encode('utf-8')) + 256
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (entry, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._counters['evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _read_disk(self, key, now):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get('created', 0) >= self.ttl:
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        """Write atomically, so a concurrent reader in another worker never sees a partial file"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing response cache entry: {e}")
+
+    def _prune_disk(self):
+        cutoff = time.time() - self.ttl
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        """Return hit/miss counters and memory usage"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'disk': bool(self.directory)
+            })
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['disk_hits']) / lookups, 3) if lookups else None
+        return stats
+
+
+def response_cache_from_env():
+    """Build a ResponseCache configured from environment variables (RESPONSE_CACHE=0 disables it)"""
+    return ResponseCache(
+        max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        ttl=float(os.environ.get('RESPONSE_CACHE_TTL', DEFAULT_TTL)),
+        directory=os.environ.get('RESPONSE_CACHE_DIR') or None,
+        enabled=os.environ.get('RESPONSE_CACHE', '1') != '0'
+    )
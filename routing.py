@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+
+from relay import iter_response_bytes, sse_event
+
+# Recent requests kept per model for latency percentiles and error rates
+HEALTH_WINDOW = 50
+
+# Until a model has this many first-token samples its hedge deadline is the default delay
+MIN_SAMPLES = 5
+DEFAULT_HEDGE_DELAY = 5.0
+MIN_HEDGE_DELAY = 1.0
+
+# Models failing more often than this are not used as alternatives
+MAX_ALTERNATIVE_ERROR_RATE = 0.5
+
+# Categories an alternative must share, since a request may depend on them
+CAPABILITY_CATEGORIES = frozenset(('vision', 'multimodal', 'tools', 'reasoning'))
+
+MAX_DECISIONS = 50
+
+# A winning stream that delivers nothing for this long is abandoned
+STREAM_IDLE_TIMEOUT = 120
+
+
+class ModelHealth:
+    """Rolling time-to-first-token samples and outcomes for one model"""
+
+    def __init__(self, window=HEALTH_WINDOW):
+        self.ttfts = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, ttft=None, error=False):
+        self.outcomes.append(not error)
+        if ttft is not None:
+            self.ttfts.append(ttft)
+
+    def percentile(self, p):
+        if not self.ttfts:
+            return None
+        ordered = sorted(self.ttfts)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+def equivalent_models(index, model_id):
+    """Models that can stand in for model_id, most similar first
+
+    Candidates are in the same price class, have at least the same context window and every
+    capability category (vision, tools, ...) of the original; they are ranked by how many of
+    its other categories they share, then by catalog order.
+    """
+    model = index.get(model_id)
+    if model is None:
+        return []
+
+    categories = set(model.get('categories', []))
+    required = categories & CAPABILITY_CATEGORIES
+    context_length = model.get('context_length') or 0
+    price = 'free' if model_id in index.by_price['free'] else 'paid'
+
+    scored = []
+    for candidate_id in index.by_price[price]:
+        if candidate_id == model_id:
+            continue
+        candidate = index.get(candidate_id)
+        candidate_categories = set(candidate.get('categories', []))
+        if (candidate.get('context_length') or 0) < context_length or not required <= candidate_categories:
+            continue
+        union = categories | candidate_categories
+        similarity = len(categories & candidate_categories) / len(union) if union else 1.0
+        scored.append((-similarity, index.positions[candidate_id], candidate_id))
+
+    scored.sort()
+    return [candidate_id for _, _, candidate_id in scored]
+
+
+class Router:
+    """Latency-aware routing: hedges slow streams and falls back from failing models
+
+    Every streamed request reports its time to first token, so deadlines are learned even
+    while routing is off. With routing on, a stream whose first token is later than its
+    model's deadline (a high percentile of recent first-token times, times a multiplier) is
+    raced against the same request on an equivalent model, and a model that fails before its
+    first token falls back to one. Decisions are kept for /api/routing.
+    """
+
+    def __init__(self, enabled=False, percentile=95, multiplier=1.5, default_delay=DEFAULT_HEDGE_DELAY,
+                 max_delay=30):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.default_delay = default_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._health = {}
+        self._decisions = deque(maxlen=MAX_DECISIONS)
+        self._counters = {'routed': 0, 'hedged': 0, 'hedge_wins': 0, 'fallbacks': 0, 'no_alternative': 0}
+        # Similarity rankings depend only on the catalog, so they are kept until it changes
+        self._ranked_index = None
+        self._ranked = {}
+
+    def active(self, requested=None):
+        """Whether a request is routed; requested is the request's own "routing" flag, if any"""
+        return self.enabled if requested is None else bool(requested)
+
+    def observe(self, model_id, ttft=None, error=False):
+        """Record one request's outcome and, if it produced a token, its time to first token"""
+        with self._lock:
+            health = self._health.get(model_id)
+            if health is None:
+                health = self._health[model_id] = ModelHealth()
+            health.record(ttft, error)
+
+    def hedge_delay(self, model_id):
+        """Seconds to wait for a model's first token before hedging"""
+        with self._lock:
+            health = self._health.get(model_id)
+            if health is None or len(health.ttfts) < MIN_SAMPLES:
+                return self.default_delay
+            deadline = health.percentile(self.percentile) * self.multiplier
+        return min(max(deadline, MIN_HEDGE_DELAY), self.max_delay)
+
+    def alternatives(self, index, model_id):
+        """Equivalent models for model_id that are not currently failing"""
+        with self._lock:
+            if index is not self._ranked_index:
+                self._ranked_index = index
+                self._ranked = {}
+            ranked = self._ranked.get(model_id)
+        if ranked is None:
+            ranked = equivalent_models(index, model_id)
+            with self._lock:
+                if index is self._ranked_index:
+                    self._ranked[model_id] = ranked
+
+        with self._lock:
+            return [
+                candidate_id for candidate_id in ranked
+                if candidate_id not in self._health or self._health[candidate_id].error_rate() <= MAX_ALTERNATIVE_ERROR_RATE
+            ]
+
+    def stream(self, model_id, index, open_stream, make_relay, admit, ticket=None):
+        """A HedgedStream for model_id; see HedgedStream for the callbacks"""
+        return HedgedStream(self, model_id, self.alternatives(index, model_id), open_stream, make_relay,
+                            admit, ticket)
+
+    def decide(self, decision):
+        """Record how a routed request was served"""
+        with self._lock:
+            self._decisions.append(decision)
+            self._counters['routed'] += 1
+            if decision['hedged']:
+                self._counters['hedged'] += 1
+            if decision['reason'] == 'error':
+                self._counters['fallbacks'] += 1
+            if decision['reason'] and not decision['hedged']:
+                self._counters['no_alternative'] += 1
+            if decision['served_by'] not in (None, decision['model']):
+                self._counters['hedge_wins'] += 1
+
+    def stats(self, decisions=False):
+        """Counters and per-model latency and error rates; decisions=True adds the recent decisions"""
+        with self._lock:
+            models = {}
+            for model_id, health in self._health.items():
+                p50 = health.percentile(50)
+                p95 = health.percentile(95)
+                models[model_id] = {
+                    'requests': len(health.outcomes),
+                    'error_rate': round(health.error_rate(), 3),
+                    'ttft_p50': round(p50, 3) if p50 is not None else None,
+                    'ttft_p95': round(p95, 3) if p95 is not None else None
+                }
+            stats = {'enabled': self.enabled, **self._counters, 'models': models}
+            if decisions:
+                stats['decisions'] = list(self._decisions)
+        return stats
+
+
+def abort_response(response):
+    """Close a streamed response that another thread may be blocked reading
+
+    close() alone waits for the pending read to return, which for a stalled model can take until
+    the read timeout; shutting the socket down first makes that read fail at once.
+    """
+    connection = getattr(response.raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+class Contender:
+    """One upstream stream in a race"""
+
+    def __init__(self, model_id, relay, ticket):
+        self.model_id = model_id
+        self.relay = relay
+        self.ticket = ticket
+        self.response = None
+        self.cancelled = False
+        self.failed = False
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self._lock = threading.Lock()
+
+    def attach(self, response):
+        """Keep the opened response; False (and the response is closed) if already cancelled"""
+        with self._lock:
+            if not self.cancelled:
+                self.response = response
+                return True
+        response.close()
+        return False
+
+    def hold(self, ticket):
+        """Keep a scheduler ticket admitted after the contender started; False (and it is closed) if cancelled"""
+        with self._lock:
+            if not self.cancelled:
+                self.ticket = ticket
+                return True
+        ticket.close()
+        return False
+
+    def cancel(self):
+        """Stop reading, drop the upstream connection and give back the scheduler slot"""
+        with self._lock:
+            self.cancelled = True
+            response, self.response = self.response, None
+            ticket = self.ticket
+        if response is not None:
+            abort_response(response)
+        if ticket is not None:
+            ticket.close()
+
+
+class HedgedStream:
+    """A chat stream that may be raced against, or replaced by, the same request on one other model
+
+    open_stream(model_id) returns a streamed upstream response or an error dict, make_relay(model_id)
+    a StreamRelay for it, and admit(model_id) an admitted scheduler ticket or None if the model has
+    no capacity right now. Each contender is read on its own thread; the first to produce a token
+    wins and the others are cancelled. After events() is exhausted, model_id and relay describe
+    the winner and ttft is the time from starting the request to the winner's first token.
+    """
+
+    def __init__(self, router, model_id, alternatives, open_stream, make_relay, admit, ticket=None):
+        self.router = router
+        self.requested = model_id
+        self.model_id = model_id
+        self.relay = None
+        self.ttft = None
+        self._alternatives = list(alternatives)
+        self._open_stream = open_stream
+        self._make_relay = make_relay
+        self._admit = admit
+        self._ticket = ticket
+        self._events = queue.Queue()
+        self._contenders = []
+        self._winner = None
+
+    def _start(self, model_id, ticket):
+        contender = Contender(model_id, self._make_relay(model_id), ticket)
+        self._contenders.append(contender)
+        threading.Thread(target=self._read, args=(contender,), name=f'hedge-{model_id}', daemon=True).start()
+        return contender
+
+    def _read(self, contender):
+        """Reader thread: put (contender, kind, payload) on the shared queue"""
+        try:
+            response = self._open_stream(contender.model_id)
+            if isinstance(response, dict):
+                self._events.put((contender, 'error', response['error']))
+                return
+            if not contender.attach(response):
+                return
+            for block in iter_response_bytes(response):
+                if contender.cancelled:
+                    return
+                self._events.put((contender, 'data', block))
+            self._events.put((contender, 'end', None))
+        except Exception as e:
+            self._events.put((contender, 'error', str(e)))
+
+    def _hedge(self):
+        """Start the best alternative that has capacity now; False if there is none"""
+        while self._alternatives:
+            model_id = self._alternatives.pop(0)
+            ticket = self._admit(model_id)
+            if ticket is not None:
+                self._start(model_id, ticket)
+                return True
+        return False
+
+    def _win(self, contender):
+        self._winner = contender
+        self.model_id = contender.model_id
+        self.relay = contender.relay
+        contender.first_token_at = time.monotonic()
+        self.ttft = contender.first_token_at - self._contenders[0].started
+        self.router.observe(contender.model_id, ttft=contender.first_token_at - contender.started)
+
+        for other in self._contenders:
+            if other is not contender and not other.failed:
+                # A cancelled contender took at least this long, which its latency window should know
+                self.router.observe(other.model_id, ttft=contender.first_token_at - other.started)
+                other.cancel()
+
+    def events(self):
+        """Yield the winning stream's downstream events; raises RuntimeError if every contender fails"""
+        primary = self._start(self.requested, self._ticket)
+        deadline = primary.started + self.router.hedge_delay(self.requested)
+        # At most one hedge per request, started at the deadline or when the primary fails first,
+        # so a request never holds more than two scheduler slots or walks the whole alternative list
+        hedge_tried = False
+        reason = None
+        error = None
+
+        try:
+            while True:
+                if self._winner is None and not hedge_tried:
+                    timeout = max(deadline - time.monotonic(), 0)
+                else:
+                    timeout = STREAM_IDLE_TIMEOUT
+                try:
+                    contender, kind, payload = self._events.get(timeout=timeout)
+                except queue.Empty:
+                    if self._winner is None and not hedge_tried:
+                        hedge_tried = True
+                        reason = 'slow'
+                        self._hedge()
+                        continue
+                    raise TimeoutError('Upstream stream stalled')
+
+                if contender is None:
+                    # cancel() was called
+                    return
+                if contender.cancelled or (self._winner is not None and contender is not self._winner):
+                    continue
+
+                if kind == 'data':
+                    events = contender.relay.feed_bytes(payload)
+                    if self._winner is None:
+                        if not events:
+                            continue
+                        self._win(contender)
+                        if contender is not primary:
+                            yield sse_event({'type': 'routed', 'model': contender.model_id, 'requested': self.requested,
+                                             'reason': reason}).encode('utf-8')
+                    yield events
+                    continue
+
+                if kind == 'end' and (self._winner is contender or contender.relay.done):
+                    # A reply that finished without a single token (empty content) is still a reply
+                    if self._winner is None:
+                        self._win(contender)
+                    events = contender.relay.finish()
+                    if events:
+                        yield events
+                    return
+
+                # Failed (or ended without a reply) before its first token
+                error = payload or 'Upstream stream ended unexpectedly'
+                if self._winner is contender:
+                    raise RuntimeError(error)
+                contender.failed = True
+                self.router.observe(contender.model_id, error=True)
+                if contender.ticket is not None:
+                    contender.ticket.close()
+
+                if not hedge_tried:
+                    hedge_tried = True
+                    reason = 'error'
+                    self._hedge()
+                # The one hedge is spent (or found no capacity), so nothing else will start
+                if all(c.failed for c in self._contenders):
+                    raise RuntimeError(error)
+        finally:
+            self.router.decide({
+                'at': time.time(),
+                'model': self.requested,
+                'served_by': self._winner.model_id if self._winner else None,
+                'hedged': len(self._contenders) > 1,
+                'reason': reason,
+                'deadline': round(deadline - primary.started, 3),
+                'ttft': round(self._winner.first_token_at - self._winner.started, 3) if self._winner else None,
+                'error': error if self._winner is None else None
+            })
+
+    def close(self):
+        """Cancel every contender, closing their upstream responses"""
+        for contender in self._contenders:
+            contender.cancel()
+
+    def cancel(self):
+        """Abandon the request from another thread: cancel every contender and end events()"""
+        self.close()
+        self._events.put((None, 'cancelled', None))
+
+
+class DirectStream:
+    """A single upstream stream behind the HedgedStream interface, reporting its latency to the router"""
+
+    def __init__(self, router, model_id, response, relay, started=None):
+        self.router = router
+        self.model_id = model_id
+        self.response = response
+        self.relay = relay
+        self.ttft = None
+        self.cancelled = False
+        # When the request was sent (time.monotonic()), so first-token time includes connecting
+        self.started = time.monotonic() if started is None else started
+
+    def events(self):
+        """Yield the relay's downstream events as upstream blocks arrive"""
+        for block in iter_response_bytes(self.response):
+            events = self.relay.feed_bytes(block)
+            if events:
+                if self.ttft is None:
+                    self.ttft = time.monotonic() - self.started
+                    self.router.observe(self.model_id, ttft=self.ttft)
+                yield events
+
+        events = self.relay.finish()
+        if events:
+            yield events
+        # A cancelled request says nothing about the model's health
+        if self.ttft is None and not self.cancelled:
+            self.router.observe(self.model_id, error=not self.relay.done)
+
+    def close(self):
+        self.response.close()
+
+    def cancel(self):
+        """Abandon the request from another thread, failing the read events() is blocked in"""
+        self.cancelled = True
+        abort_response(self.response)
+
+
+def router_from_env():
+    """Build a Router configured from environment variables (CHAT_ROUTING=1 turns routing on)"""
+    return Router(
+        enabled=os.environ.get('CHAT_ROUTING', '0') == '1',
+        percentile=float(os.environ.get('ROUTING_HEDGE_PERCENTILE', 95)),
+        multiplier=float(os.environ.get('ROUTING_HEDGE_MULTIPLIER', 1.5)),
+        default_delay=float(os.environ.get('ROUTING_HEDGE_DELAY', DEFAULT_HEDGE_DELAY)),
+        max_delay=float(os.environ.get('ROUTING_MAX_HEDGE_DELAY', 30))
+    )
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# OpenRouter's documented limit for :free models, used until upstream headers say otherwise
+DEFAULT_FREE_RPM = 20
+
+# Assumed window of X-RateLimit-Limit when upstream does not say
+RATE_LIMIT_WINDOW = 60
+
+# Backoff after a 429 without Retry-After, doubling up to the cap
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Queued waiters re-check time-based limits (token refill, Retry-After) at least this often
+POLL_INTERVAL = 0.25
+
+# Models with limits kept at once; past this, idle ones at their defaults are forgotten, oldest first
+MAX_TRACKED_MODELS = 1024
+
+
+class QueueFull(Exception):
+    """Raised when the wait queue is at capacity"""
+
+
+class ModelLimits:
+    """Concurrency and learned rate limit for one upstream model"""
+
+    def __init__(self, concurrency, rate=None, capacity=None):
+        self.concurrency = concurrency
+        self.in_flight = 0
+        # Token bucket; rate is tokens per second, None while the model has no known limit
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff = MIN_BACKOFF
+        self.rate_limited = 0
+
+    def refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready(self, now):
+        """True if a request could start now, ignoring the global cap"""
+        if self.in_flight >= self.concurrency or now < self.blocked_until:
+            return False
+        self.refill(now)
+        return self.rate is None or self.tokens >= 1
+
+    def idle(self, now):
+        """True if forgetting these limits loses nothing but a learned rate: nothing running, blocked or spent"""
+        if self.in_flight or now < self.blocked_until:
+            return False
+        self.refill(now)
+        return self.rate is None or self.tokens >= self.capacity
+
+    def take(self):
+        self.in_flight += 1
+        if self.rate is not None:
+            self.tokens -= 1
+
+
+class Ticket:
+    """One request's place in the admission queue; close() it when the upstream call ends"""
+
+    def __init__(self, scheduler, model_id, client_id, seq):
+        self.scheduler = scheduler
+        self.model_id = model_id
+        self.client_id = client_id
+        self.seq = seq
+        self.admitted = False
+        self.closed = False
+        self.enqueued_at = time.monotonic()
+        self.waited = 0.0
+        self.on_admit = None
+
+    def wait(self, timeout):
+        """Block up to timeout seconds for admission; True once admitted"""
+        return self.scheduler._wait(self, timeout)
+
+    def poll(self):
+        """Non-blocking admission check for event-loop callers"""
+        return self.scheduler._poll(self)
+
+    def notify(self, callback):
+        """Call callback() once on admission (at once if admitted already); it may run under the scheduler lock"""
+        self.scheduler._notify(self, callback)
+
+    def ready_in(self):
+        """Seconds until the model's rate limit lets this ticket start, or None if waiting on a running request"""
+        return self.scheduler._ready_in(self)
+
+    def position(self):
+        """1-based place among all queued requests, or 0 once admitted"""
+        return self.scheduler._position(self)
+
+    def close(self):
+        """Free the slot taken on admission, or leave the queue if still waiting"""
+        self.scheduler._close(self)
+
+
+class AdmissionScheduler:
+    """Admission control in front of upstream chat calls
+
+    Requests start immediately while their model and the process are under their concurrency
+    caps and the model's token bucket has a token. Otherwise they wait in a bounded queue that
+    is served round-robin across clients, so one busy client cannot starve the others. Token
+    buckets start from configured defaults and are corrected from upstream rate-limit headers.
+    Limits are kept for at most max_models models (any string a client sends names one), the
+    least recently used idle ones giving way first.
+
+    Every worker process has its own scheduler, while upstream rate limits apply to the account,
+    so each of the processes sharing it gets free_rpm / processes and that share of any learned limit.
+    """
+
+    def __init__(self, global_concurrency=32, model_concurrency=8, free_rpm=DEFAULT_FREE_RPM,
+                 max_queue=256, queue_timeout=30, max_models=MAX_TRACKED_MODELS, processes=1):
+        self.global_concurrency = global_concurrency
+        self.model_concurrency = model_concurrency
+        self.free_rpm = free_rpm
+        self.processes = max(processes, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_models = max_models
+
+        self._cond = threading.Condition()
+        # model id -> ModelLimits, least recently used first
+        self._models = OrderedDict()
+        self._in_flight = 0
+        # client id -> deque of waiting tickets, in round-robin order
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._seq = itertools.count()
+
+        self._admitted = 0
+        self._queued_total = 0
+        self._rejected = 0
+        self._abandoned = 0
+        self._forgotten = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _limits(self, model_id):
+        limits = self._models.get(model_id)
+        if limits is not None:
+            self._models.move_to_end(model_id)
+            return limits
+
+        if model_id.endswith(':free') and self.free_rpm:
+            rpm = self._share(self.free_rpm)
+            limits = ModelLimits(self.model_concurrency, rpm / RATE_LIMIT_WINDOW, rpm)
+        else:
+            limits = ModelLimits(self.model_concurrency)
+        self._models[model_id] = limits
+        if len(self._models) > self.max_models:
+            self._forget_idle(time.monotonic(), keep=model_id)
+        return limits
+
+    def _share(self, limit):
+        """This process's part of an account-wide per-minute limit, never below one request"""
+        return max(limit / self.processes, 1)
+
+    def _forget_idle(self, now, keep):
+        """Drop idle models' limits, oldest first, until back under max_models (lock held)"""
+        # Queued tickets look their model up again on dispatch, so their limits stay
+        queued = {ticket.model_id for queue in self._queues.values() for ticket in queue}
+        queued.add(keep)
+        for model_id in list(self._models):
+            if len(self._models) <= self.max_models:
+                return
+            limits = self._models[model_id]
+            if model_id not in queued and limits.idle(now):
+                del self._models[model_id]
+                self._forgotten += 1
+
+    def enter(self, model_id, client_id):
+        """Admit a request at once or queue it; returns a Ticket (check ticket.admitted)
+
+        Raises QueueFull when the queue is at capacity.
+        """
+        with self._cond:
+            ticket = Ticket(self, model_id, client_id, next(self._seq))
+            limits = self._limits(model_id)
+            now = time.monotonic()
+
+            # Fast path: nobody is waiting, so starting now cannot jump the queue
+            if not self._queued and self._in_flight < self.global_concurrency and limits.ready(now):
+                self._admit(ticket, limits, now)
+                return ticket
+
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise QueueFull('Server is busy, please try again shortly.')
+
+            self._queues.setdefault(client_id, deque()).append(ticket)
+            self._queued += 1
+            self._queued_total += 1
+            self._dispatch(now)
+            return ticket
+
+    def try_enter(self, model_id, client_id):
+        """Admit a request only if it can start right now without queueing; returns a Ticket or None"""
+        with self._cond:
+            limits = self._limits(model_id)
+            now = time.monotonic()
+            if self._queued or self._in_flight >= self.global_concurrency or not limits.ready(now):
+                return None
+            ticket = Ticket(self, model_id, client_id, next(self._seq))
+            self._admit(ticket, limits, now)
+            return ticket
+
+    def _admit(self, ticket, limits, now):
+        limits.take()
+        self._in_flight += 1
+        self._admitted += 1
+        ticket.admitted = True
+        ticket.waited = now - ticket.enqueued_at
+        self._wait_total += ticket.waited
+        self._wait_max = max(self._wait_max, ticket.waited)
+        if ticket.on_admit is not None:
+            callback, ticket.on_admit = ticket.on_admit, None
+            callback()
+
+    def _dispatch(self, now):
+        """Admit queued tickets round-robin across clients while capacity allows (lock held)"""
+        admitted_any = False
+        progress = True
+        while progress and self._queued and self._in_flight < self.global_concurrency:
+            progress = False
+            for client_id in list(self._queues):
+                queue = self._queues[client_id]
+                # A client's oldest request that can start now; others for busy models keep waiting
+                for ticket in queue:
+                    limits = self._limits(ticket.model_id)
+                    if limits.ready(now):
+                        queue.remove(ticket)
+                        self._queued -= 1
+                        self._admit(ticket, limits, now)
+                        # Served clients go to the back of the rotation
+                        self._queues.move_to_end(client_id)
+                        progress = admitted_any = True
+                        break
+                if not queue:
+                    del self._queues[client_id]
+                if self._in_flight >= self.global_concurrency:
+                    break
+
+        if admitted_any:
+            self._cond.notify_all()
+
+    def _wait(self, ticket, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not ticket.admitted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, POLL_INTERVAL))
+                if not ticket.admitted:
+                    self._dispatch(time.monotonic())
+            return True
+
+    def _poll(self, ticket):
+        with self._cond:
+            if not ticket.admitted:
+                self._dispatch(time.monotonic())
+            return ticket.admitted
+
+    def _notify(self, ticket, callback):
+        with self._cond:
+            if not ticket.admitted:
+                ticket.on_admit = callback
+                return
+        callback()
+
+    def _ready_in(self, ticket):
+        with self._cond:
+            limits = self._models.get(ticket.model_id)
+            if ticket.admitted or limits is None:
+                return None
+            now = time.monotonic()
+            limits.refill(now)
+            delay = max(limits.blocked_until - now, 0.0)
+            if limits.rate is not None and limits.tokens < 1:
+                delay = max(delay, (1 - limits.tokens) / limits.rate)
+            return delay or None
+
+    def _position(self, ticket):
+        with self._cond:
+            if ticket.admitted:
+                return 0
+            ahead = sum(1 for queue in self._queues.values() for other in queue if other.seq < ticket.seq)
+            return ahead + 1
+
+    def _close(self, ticket):
+        with self._cond:
+            if ticket.closed:
+                return
+            ticket.closed = True
+            ticket.on_admit = None
+
+            if ticket.admitted:
+                self._models[ticket.model_id].in_flight -= 1
+                self._in_flight -= 1
+                self._dispatch(time.monotonic())
+                return
+
+            queue = self._queues.get(ticket.client_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                self._abandoned += 1
+                if not queue:
+                    del self._queues[ticket.client_id]
+
+    def acquire(self, model_id, client_id, timeout=None):
+        """Blocking admission; returns an admitted Ticket or raises QueueFull / TimeoutError"""
+        ticket = self.enter(model_id, client_id)
+        if not ticket.admitted and not ticket.wait(self.queue_timeout if timeout is None else timeout):
+            ticket.close()
+            raise TimeoutError('Timed out waiting for model capacity. Please try again.')
+        return ticket
+
+    def observe(self, model_id, status, headers):
+        """Learn a model's rate limit from an upstream response's status and headers"""
+        limit = _int_header(headers, 'X-RateLimit-Limit')
+        remaining = _int_header(headers, 'X-RateLimit-Remaining')
+        reset = _reset_delay(headers.get('X-RateLimit-Reset'))
+        retry_after = _int_header(headers, 'Retry-After')
+
+        with self._cond:
+            limits = self._limits(model_id)
+            now = time.monotonic()
+            limits.refill(now)
+
+            if limit:
+                limit = self._share(limit)
+                limits.capacity = limit
+                limits.rate = limit / RATE_LIMIT_WINDOW
+                if limits.tokens is None:
+                    limits.tokens = limit
+            if remaining is not None and limits.rate is not None:
+                limits.tokens = min(limits.tokens, remaining)
+                if remaining == 0 and reset:
+                    limits.blocked_until = max(limits.blocked_until, now + reset)
+
+            if status == 429:
+                limits.rate_limited += 1
+                delay = retry_after if retry_after is not None else reset or limits.backoff
+                limits.blocked_until = max(limits.blocked_until, now + delay)
+                limits.backoff = min(limits.backoff * 2, MAX_BACKOFF)
+                if limits.rate is not None:
+                    limits.tokens = 0
+            elif status < 400:
+                limits.backoff = MIN_BACKOFF
+
+    def stats(self):
+        """Return queue depth, wait times and per-model limits"""
+        with self._cond:
+            now = time.monotonic()
+            models = {}
+            for model_id, limits in self._models.items():
+                if not (limits.in_flight or limits.rate is not None or limits.rate_limited):
+                    continue
+                limits.refill(now)
+                models[model_id] = {
+                    'in_flight': limits.in_flight,
+                    'tokens': round(limits.tokens, 2) if limits.tokens is not None else None,
+                    'requests_per_minute': round(limits.rate * 60, 1) if limits.rate is not None else None,
+                    'blocked_for': round(max(limits.blocked_until - now, 0), 1),
+                    'rate_limited': limits.rate_limited
+                }
+
+            oldest = min((queue[0].enqueued_at for queue in self._queues.values()), default=None)
+            return {
+                'in_flight': self._in_flight,
+                'global_concurrency': self.global_concurrency,
+                'model_concurrency': self.model_concurrency,
+                'processes': self.processes,
+                'queue_depth': self._queued,
+                'max_queue': self.max_queue,
+                'oldest_wait': round(now - oldest, 2) if oldest is not None else 0.0,
+                'admitted': self._admitted,
+                'queued_total': self._queued_total,
+                'rejected': self._rejected,
+                'abandoned': self._abandoned,
+                'tracked_models': len(self._models),
+                'forgotten_models': self._forgotten,
+                'average_wait': round(self._wait_total / self._admitted, 3) if self._admitted else 0.0,
+                'max_wait': round(self._wait_max, 3),
+                'models': models
+            }
+
+
+def _int_header(headers, name):
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _reset_delay(value):
+    """Seconds until an X-RateLimit-Reset value, which may be epoch ms, epoch seconds or a delay"""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1e12:
+        reset = reset / 1000 - time.time()
+    elif reset > 1e9:
+        reset = reset - time.time()
+    return max(reset, 0.0)
+
+
+def scheduler_from_env():
+    """Build an AdmissionScheduler configured from environment variables
+
+    WEB_CONCURRENCY is the number of worker processes splitting the upstream rate limits
+    (gunicorn.conf.py sets it to its worker count).
+    """
+    return AdmissionScheduler(
+        global_concurrency=int(os.environ.get('SCHEDULER_GLOBAL_CONCURRENCY', os.environ.get('UPSTREAM_POOL_SIZE', 32))),
+        model_concurrency=int(os.environ.get('SCHEDULER_MODEL_CONCURRENCY', 8)),
+        free_rpm=int(os.environ.get('SCHEDULER_FREE_RPM', DEFAULT_FREE_RPM)),
+        max_queue=int(os.environ.get('SCHEDULER_MAX_QUEUE', 256)),
+        queue_timeout=float(os.environ.get('SCHEDULER_QUEUE_TIMEOUT', 30)),
+        processes=int(os.environ.get('WEB_CONCURRENCY', 1))
+    )
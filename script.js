@@ -4,11 +4,17 @@ class ChatApp {
         this.currentModel = '';
         this.isTyping = false;
         this.allModels = [];
+        this.modelDetails = {};
+        this.conversationId = null;
         this.categories = [];
         this.currentPriceFilter = 'all';
         this.currentCategoryFilter = 'all';
         this.useStreaming = true;
         this.currentStreamingMessage = null;
+        // The stream in progress, for the stop button
+        this.streamId = null;
+        this.streamReader = null;
+        this.stopRequested = false;
         this.activeTab = 'chat';
         
         this.initializeElements();
@@ -21,6 +27,7 @@ class ChatApp {
         this.chatMessages = document.getElementById('chat-messages');
         this.chatInput = document.getElementById('chat-input');
         this.sendBtn = document.getElementById('send-btn');
+        this.stopBtn = document.getElementById('stop-btn');
         this.modelSelect = document.getElementById('model-select');
         this.clearBtn = document.getElementById('clear-chat');
         this.tokenCount = document.getElementById('token-count');
@@ -55,6 +62,9 @@ class ChatApp {
             }
         });
         
+        // Stop the reply being streamed
+        this.stopBtn.addEventListener('click', () => this.stopStreaming());
+        
         // Enter to send, Shift+Enter for new line
         this.chatInput.addEventListener('keydown', (e) => {
             if (e.key === 'Enter' && !e.shiftKey && !this.isTyping) {
@@ -155,9 +165,9 @@ class ChatApp {
         try {
             this.updateStatus('🧬 Awakening creatures...', 'thinking');
             
-            // Load models and categories in parallel
+            // Load models and categories in parallel; full details are fetched per model on selection
             const [modelsResponse, categoriesResponse] = await Promise.all([
-                fetch('/api/models?price=all&category=all'),
+                fetch('/api/models?fields=id,name,pricing,categories'),
                 fetch('/api/categories')
             ]);
             
@@ -275,11 +285,29 @@ class ChatApp {
         });
     }
 
-    updateModelInfo() {
+    async loadModelDetails(modelId) {
+        if (!this.modelDetails[modelId]) {
+            const response = await fetch(`/api/models/${modelId}`);
+            const data = await response.json();
+            if (!data.success) {
+                throw new Error(data.error || 'Failed to load creature details');
+            }
+            this.modelDetails[modelId] = data.model;
+        }
+        return this.modelDetails[modelId];
+    }
+
+    async updateModelInfo() {
         if (this.currentModel) {
-            const selectedModel = this.allModels.find(m => m.id === this.currentModel);
-            if (selectedModel) {
-                this.modelInfo.innerHTML = this.generateModelInfoCard(selectedModel);
+            const modelId = this.currentModel;
+            try {
+                const selectedModel = await this.loadModelDetails(modelId);
+                // Ignore late responses for a model that is no longer selected
+                if (selectedModel && this.currentModel === modelId) {
+                    this.modelInfo.innerHTML = this.generateModelInfoCard(selectedModel);
+                }
+            } catch (error) {
+                console.error('Error loading model details:', error);
             }
         } else {
             this.modelInfo.innerHTML = '<p>🧬 Choose from hundreds of AI creatures with unique personalities and abilities. Each creature has different traits, intelligence levels, and behaviors. Start creating your own mini monster interactions!</p>';
@@ -490,31 +518,30 @@ class ChatApp {
             this.messages.push(this.currentStreamingMessage);
             this.renderStreamingMessage(this.currentStreamingMessage);
             
-            const response = await fetch('/api/chat/stream', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    model: this.currentModel,
-                    message: message,
-                    history: this.messages.slice(-11, -1) // Exclude the current streaming message
-                })
-            });
+            const response = await this.postChat('/api/chat/stream', {
+                model: this.currentModel,
+                message: message,
+                include_content: false // We build the reply from chunks, no need to resend it
+            }, 2); // Exclude the new message and the streaming placeholder
 
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
             }
 
             const reader = response.body.getReader();
+            this.streamReader = reader;
             const decoder = new TextDecoder();
+            let buffer = '';
+            let queued = false;
 
             while (true) {
                 const { value, done } = await reader.read();
                 if (done) break;
 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
+                // Events can span reads; keep the trailing partial line for the next one
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {
@@ -526,12 +553,31 @@ class ChatApp {
                                 return;
                             }
                             
-                            if (data.type === 'chunk') {
+                            if (data.type === 'stream') {
+                                // The id to cancel this stream with
+                                this.streamId = data.id;
+                                this.stopBtn.disabled = false;
+                                this.stopBtn.hidden = false;
+                            } else if (data.type === 'queued') {
+                                // The server is holding the request until the model has capacity
+                                queued = true;
+                                this.updateStatus(`⏳ Waiting in line for the creature (#${data.position})...`, 'thinking');
+                            } else if (data.type === 'routed') {
+                                // The server raced a slow or failing model against a stand-in, which won
+                                this.updateStatus(`🔀 ${data.model} stepped in for ${data.requested}...`, 'thinking');
+                            } else if (data.type === 'chunk') {
+                                if (queued) {
+                                    queued = false;
+                                    this.updateStatus('🧬 Your creature is evolving thoughts...', 'thinking');
+                                }
                                 this.updateStreamingMessage(data.content);
                             } else if (data.type === 'done') {
                                 this.finalizeStreamingMessage(data.usage);
                                 this.updateStatus('🎉 Creature awakened!', 'ready');
                                 return;
+                            } else if (data.type === 'cancelled') {
+                                this.handleStreamStopped();
+                                return;
                             }
                         } catch (e) {
                             // Skip invalid JSON
@@ -540,28 +586,73 @@ class ChatApp {
                     }
                 }
             }
+            
+            if (this.stopRequested) {
+                // Stopped by dropping the connection rather than by the server
+                this.handleStreamStopped();
+            }
         } catch (error) {
-            this.handleStreamingError(`🌐 Connection to monster lab lost: ${error.message}`);
+            if (this.stopRequested) {
+                this.handleStreamStopped();
+            } else {
+                this.handleStreamingError(`🌐 Connection to monster lab lost: ${error.message}`);
+            }
         } finally {
             this.isTyping = false;
             this.updateSendButton();
             this.currentStreamingMessage = null;
+            this.streamId = null;
+            this.streamReader = null;
+            this.stopRequested = false;
+            this.stopBtn.hidden = true;
+        }
+    }
+
+    async stopStreaming() {
+        if (!this.streamReader || this.stopRequested) return;
+        this.stopRequested = true;
+        this.stopBtn.disabled = true;
+        this.updateStatus('✋ Calling the creature back...', 'thinking');
+        
+        if (this.streamId) {
+            try {
+                const response = await fetch(`/api/chat/stream/${encodeURIComponent(this.streamId)}/cancel`, {
+                    method: 'POST'
+                });
+                // The server ends the stream itself with a "cancelled" event
+                if (response.ok) return;
+            } catch (e) {
+                // Fall through and drop the connection instead
+            }
+        }
+        
+        // Another worker may own the stream (or it has not started yet); closing the
+        // connection makes the owning worker cancel it when it notices the disconnect
+        if (this.streamReader) {
+            this.streamReader.cancel();
         }
     }
 
+    handleStreamStopped() {
+        const messageDiv = document.getElementById('streaming-message');
+        if (this.currentStreamingMessage && !this.currentStreamingMessage.content) {
+            // Nothing arrived before the stop, so there is no reply to keep
+            this.messages.splice(this.messages.indexOf(this.currentStreamingMessage), 1);
+            if (messageDiv) {
+                messageDiv.remove();
+            }
+        } else {
+            this.finalizeStreamingMessage(null);
+        }
+        this.updateStatus('✋ Creature stopped', 'ready');
+    }
+
     async sendRegularMessage(message) {
         try {
-            const response = await fetch('/api/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    model: this.currentModel,
-                    message: message,
-                    history: this.messages.slice(-10) // Send last 10 messages for context
-                })
-            });
+            const response = await this.postChat('/api/chat', {
+                model: this.currentModel,
+                message: message
+            }, 1); // Exclude the new message
 
             const data = await response.json();
             
@@ -681,6 +772,57 @@ class ChatApp {
         this.scrollToBottom();
     }
 
+    historyForRequest(skip) {
+        return this.messages.slice(0, this.messages.length - skip)
+            .map(({ role, content }) => ({ role, content }));
+    }
+
+    async startConversation(skip) {
+        // Seed a server-side conversation with everything said so far
+        const response = await fetch('/api/conversations', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ messages: this.historyForRequest(skip) })
+        });
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+        this.conversationId = data.conversation_id;
+    }
+
+    async postChat(url, body, skip) {
+        // The server keeps the history, so each turn only sends the new message
+        const send = (extra) => fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ ...body, ...extra })
+        });
+
+        if (!this.conversationId) {
+            try {
+                await this.startConversation(skip);
+            } catch (error) {
+                console.warn('Could not start a server-side conversation:', error);
+            }
+        }
+
+        if (this.conversationId) {
+            const response = await send({ conversation_id: this.conversationId });
+            if (response.status !== 404) {
+                return response;
+            }
+            // The server lost the conversation (restart or eviction); send this turn with the
+            // full history, and the next one starts a new conversation
+            this.conversationId = null;
+        }
+        return send({ history: this.historyForRequest(skip) });
+    }
+
     addMessage(role, content, usage = null, isError = false) {
         const message = {
             role,
@@ -818,6 +960,7 @@ class ChatApp {
     clearChat() {
         if (confirm('Are you sure you want to clear all messages?')) {
             this.messages = [];
+            this.conversationId = null;
             this.chatMessages.innerHTML = `
                 <div class="welcome-message">
                     <div class="welcome-icon">
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+import atexit
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+try:
+    import numpy
+except ImportError:  # In requirements.txt; without it lookups still work, scoring entries in pure Python (~25x slower)
+    numpy = None
+
+DEFAULT_DIM = 1024
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_TTL = 3600
+
+# Layout version of the saved cache file; files in any other format are ignored
+SAVE_FORMAT = 1
+# A changed cache is written to disk at most this often (and once more at shutdown)
+SAVE_INTERVAL = 30.0
+# Lookups kept for the latency percentiles in stats()
+LATENCY_WINDOW = 1000
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Contractions and filler that paraphrases add or drop without changing the question
+EXPANSIONS = {"what's": 'what is', 'whats': 'what is', "who's": 'who is', "how's": 'how is', "where's": 'where is',
+              "it's": 'it is', "that's": 'that is', "can't": 'cannot', "don't": 'do not', "won't": 'will not', "i'm": 'i am'}
+FILLER = {'please', 'kindly', 'hey', 'hi', 'hello', 'thanks', 'thank', 'you', 'me', 'tell', 'a', 'an', 'the'}
+# Words that shape a question without saying what it is about; they count for little
+FUNCTION_WORDS = {
+    'what', 'which', 'who', 'whom', 'how', 'why', 'when', 'where', 'is', 'are', 'was', 'were', 'be', 'am',
+    'do', 'does', 'did', 'i', 'we', 'my', 'can', 'could', 'would', 'should', 'will', 'to', 'of', 'in', 'on',
+    'for', 'with', 'about', 'at', 'by', 'from', 'and', 'or', 'it', 'this', 'that', 'some', 'any', 'way',
+    'give', 'explain', 'describe', 'show', 'need', 'want', 'know', 'simple', 'simply', 'terms', 'briefly'
+}
+# Words that change which question is asked ("when" vs "why", "does" vs "does not") however
+# alike the rest of the prompt is; prompts only match others with the same ones (see prompt_intent)
+INTERROGATIVES = {'what', 'which', 'who', 'whom', 'whose', 'how', 'why', 'when', 'where'}
+NEGATIONS = {'not', 'no', 'never', 'cannot', 'nor', 'none', 'nothing', 'neither'}
+
+
+def normalize_prompt(text):
+    """Lowercased words of a prompt with contractions expanded and filler dropped"""
+    words = []
+    for word in WORD_RE.findall(text.lower().replace('\u2019', "'")):
+        expanded = EXPANSIONS.get(word) or (word[:-3] + ' not' if word.endswith("n't") else word)
+        for part in expanded.split():
+            if part not in FILLER:
+                words.append(part)
+    return words
+
+
+def prompt_intent(words):
+    """The interrogatives and whether there is a negation, in normalized words; prompts must agree on it to match"""
+    negated = any(word in NEGATIONS for word in words)
+    return ' '.join(sorted({word for word in words if word in INTERROGATIVES})) + ('|not' if negated else '')
+
+
+class HashedVectorizer:
+    """Embeds text as a unit vector of hashed word and character n-gram counts
+
+    Content words carry most of the weight, so prompts that differ in one ("France" vs
+    "Spain") stay apart while rewordings of the same question ("how do I" vs "how to") meet;
+    their character trigrams absorb typos and inflections. Hashing uses crc32, which is stable
+    across processes, so saved vectors and fresh ones agree.
+    """
+
+    def __init__(self, dim=DEFAULT_DIM, word_weight=1.0, function_weight=0.1, bigram_weight=0.3, char_weight=0.2):
+        self.dim = dim
+        self.word_weight = word_weight
+        self.function_weight = function_weight
+        self.bigram_weight = bigram_weight
+        self.char_weight = char_weight
+
+    def features(self, words):
+        content = []
+        for word in words:
+            if word in FUNCTION_WORDS:
+                yield 'w:' + word, self.function_weight
+                continue
+            content.append(word)
+            yield 'w:' + word, self.word_weight
+            padded = f' {word} '
+            for i in range(len(padded) - 2):
+                yield 'c:' + padded[i:i + 3], self.char_weight
+        for first, second in zip(content, content[1:]):
+            yield f'b:{first} {second}', self.bigram_weight
+
+    def vector(self, text):
+        """{dimension: weight} for text, scaled to unit length; empty for a prompt with no words"""
+        return self.embed(normalize_prompt(text))
+
+    def embed(self, words):
+        """{dimension: weight} for normalized words, scaled to unit length"""
+        vector = {}
+        for feature, weight in self.features(words):
+            h = zlib.crc32(feature.encode('utf-8'))
+            index = h % self.dim
+            # The hash's top bit picks a sign, so colliding features tend to cancel rather than add up
+            vector[index] = vector.get(index, 0.0) + (weight if h & 0x80000000 else -weight)
+
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        if not norm:
+            return {}
+        return {index: value / norm for index, value in vector.items() if value}
+
+
+class ModelVectors:
+    """The stored prompt vectors of one model, searchable by cosine similarity
+
+    With NumPy they are rows of a float32 matrix that grows by doubling, and a lookup is one
+    matrix-vector product; freed rows are zeroed and reused. Without it, each row is the sparse
+    dict and a lookup scores them one by one.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.ids = []
+        self._free = []
+        self._rows = numpy.zeros((16, dim), dtype=numpy.float32) if numpy is not None else []
+
+    def __len__(self):
+        return len(self.ids) - len(self._free)
+
+    def add(self, entry_id, vector):
+        """Store a vector; returns its slot"""
+        if self._free:
+            slot = self._free.pop()
+            self.ids[slot] = entry_id
+        else:
+            slot = len(self.ids)
+            self.ids.append(entry_id)
+
+        if numpy is None:
+            if slot == len(self._rows):
+                self._rows.append(vector)
+            else:
+                self._rows[slot] = vector
+            return slot
+
+        if slot == len(self._rows):
+            grown = numpy.zeros((len(self._rows) * 2, self.dim), dtype=numpy.float32)
+            grown[:slot] = self._rows
+            self._rows = grown
+        self._rows[slot] = 0
+        self._rows[slot, list(vector)] = list(vector.values())
+        return slot
+
+    def remove(self, slot):
+        self.ids[slot] = None
+        self._free.append(slot)
+        if numpy is None:
+            self._rows[slot] = {}
+        else:
+            self._rows[slot] = 0
+
+    def nearest(self, vector):
+        """(entry id, similarity) of the closest stored vector, or (None, 0.0)"""
+        if not vector or not len(self):
+            return None, 0.0
+
+        if numpy is None:
+            best_slot, best = None, 0.0
+            for slot, row in enumerate(self._rows):
+                if not row:
+                    continue
+                if len(row) < len(vector):
+                    score = sum(value * vector.get(index, 0.0) for index, value in row.items())
+                else:
+                    score = sum(value * row.get(index, 0.0) for index, value in vector.items())
+                if score > best:
+                    best_slot, best = slot, score
+            return (self.ids[best_slot], best) if best_slot is not None else (None, 0.0)
+
+        query = numpy.zeros(self.dim, dtype=numpy.float32)
+        query[list(vector)] = list(vector.values())
+        scores = self._rows[:len(self.ids)] @ query
+        slot = int(scores.argmax())
+        return self.ids[slot], float(scores[slot])
+
+
+class SemanticCache:
+    """Replies to earlier prompts, found again by meaning rather than exact text
+
+    Prompts are embedded with a HashedVectorizer and searched among the same model's earlier
+    prompts with the same intent (question words and negation, which the vectors weigh too
+    lightly to tell "when did" from "why did"); a neighbour at least threshold similar
+    (cosine, 0..1) answers for upstream. Only
+    the newest max_entries replies are kept across all models (LRU), each for ttl seconds.
+    With a path, the cache is loaded from it at startup and saved there (atomically, at most
+    every SAVE_INTERVAL seconds and at exit); every process that shares the file starts from
+    its last save, and each save holds the saving process's entries.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL,
+                 dim=DEFAULT_DIM, path=None, enabled=True):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.vectorizer = HashedVectorizer(dim)
+        self._lock = threading.Lock()
+        # entry id -> entry dict, oldest use first
+        self._entries = OrderedDict()
+        # (model id, prompt intent) -> ModelVectors of those entries
+        self._groups = {}
+        self._next_id = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._dirty = False
+        self._saved = time.monotonic()
+
+        if enabled and path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, model_id, prompt):
+        """The stored {content, usage, similarity} closest to prompt for model_id, or None
+
+        A None prompt (a request that must not be answered from the cache) is always a miss.
+        """
+        if not self.enabled or prompt is None:
+            return None
+
+        started = time.perf_counter()
+        words = normalize_prompt(prompt)
+        vector = self.vectorizer.embed(words)
+        with self._lock:
+            entry = None
+            vectors = self._groups.get((model_id, prompt_intent(words)))
+            if vectors is not None:
+                entry_id, similarity = vectors.nearest(vector)
+                if entry_id is not None and similarity >= self.threshold:
+                    entry = self._entries[entry_id]
+                    if time.time() - entry['created'] >= self.ttl:
+                        self._remove(entry_id)
+                        entry = None
+                    else:
+                        self._entries.move_to_end(entry_id)
+
+            self._counters['hits' if entry else 'misses'] += 1
+            self._latencies.append(time.perf_counter() - started)
+            if entry is None:
+                return None
+            return {'content': entry['content'], 'usage': entry['usage'], 'similarity': round(similarity, 4)}
+
+    def put(self, model_id, prompt, content, usage):
+        """Remember a completed reply to prompt; a None prompt or empty reply is ignored"""
+        if not self.enabled or prompt is None or not content:
+            return
+        self._add(model_id, prompt, content, usage, time.time())
+
+        with self._lock:
+            self._counters['stores'] += 1
+            save = self.path and time.monotonic() - self._saved >= SAVE_INTERVAL
+        if save:
+            self.save()
+
+    def _add(self, model_id, prompt, content, usage, created):
+        words = normalize_prompt(prompt)
+        vector = self.vectorizer.embed(words)
+        if not vector:
+            return
+        group = (model_id, prompt_intent(words))
+        with self._lock:
+            vectors = self._groups.get(group)
+            if vectors is not None:
+                # A near-identical prompt is replaced rather than stored twice
+                entry_id, similarity = vectors.nearest(vector)
+                if entry_id is not None and similarity >= 0.999:
+                    self._remove(entry_id)
+            # Looked up again: removing a group's last entry drops the group
+            vectors = self._groups.get(group)
+            if vectors is None:
+                vectors = self._groups[group] = ModelVectors(self.vectorizer.dim)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'model': model_id,
+                'group': group,
+                'prompt': prompt,
+                'content': content,
+                'usage': usage,
+                'created': created,
+                'slot': vectors.add(entry_id, vector)
+            }
+            self._dirty = True
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        vectors = self._groups[entry['group']]
+        vectors.remove(entry['slot'])
+        if not len(vectors):
+            del self._groups[entry['group']]
+        self._dirty = True
+
+    def load(self):
+        """Restore entries saved by save(); expired ones are skipped"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error reading semantic cache: {e}")
+            return
+        if saved.get('format') != SAVE_FORMAT:
+            return
+
+        cutoff = time.time() - self.ttl
+        for entry in saved.get('entries', []):
+            if entry.get('created', 0) > cutoff:
+                self._add(entry['model'], entry['prompt'], entry['content'], entry['usage'], entry['created'])
+        with self._lock:
+            self._dirty = False
+
+    def save(self):
+        """Write the entries to path atomically, if anything changed since the last save"""
+        with self._lock:
+            self._saved = time.monotonic()
+            if not self._dirty:
+                return
+            self._dirty = False
+            entries = [{key: entry[key] for key in ('model', 'prompt', 'content', 'usage', 'created')}
+                       for entry in self._entries.values()]
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'format': SAVE_FORMAT, 'entries': entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Error writing semantic cache: {e}")
+
+    def stats(self):
+        """Hit rate, size and lookup latency"""
+        with self._lock:
+            stats = dict(self._counters)
+            latencies = sorted(self._latencies)
+            stats.update({
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'models': len({model_id for model_id, _ in self._groups}),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'backend': 'numpy' if numpy is not None else 'python',
+                'persisted': bool(self.path)
+            })
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        for name, q in (('lookup_p50_ms', 0.5), ('lookup_p95_ms', 0.95)):
+            stats[name] = round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3) if latencies else None
+        return stats
+
+
+def semantic_cache_from_env():
+    """Build a SemanticCache configured from environment variables (off unless SEMANTIC_CACHE=1)"""
+    return SemanticCache(
+        threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', DEFAULT_THRESHOLD)),
+        max_entries=int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        ttl=float(os.environ.get('SEMANTIC_CACHE_TTL', DEFAULT_TTL)),
+        path=os.environ.get('SEMANTIC_CACHE_FILE') or None,
+        enabled=os.environ.get('SEMANTIC_CACHE', '0') == '1'
+    )
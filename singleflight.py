@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import threading
+
+# A follower gives up if the stream it joined produces nothing for this long
+FOLLOW_TIMEOUT = 120
+
+
+class Call:
+    """One in-flight call whose outcome every caller with the same key receives"""
+
+    def __init__(self):
+        self.followers = 0
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def resolve(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._event.set()
+
+    def wait(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+class Broadcast:
+    """One in-flight stream that late joiners replay from the start and then follow live
+
+    The leader publish()es each block of downstream events and finish()es with its result;
+    followers iterate follow() to get every block published so far plus the live tail.
+    """
+
+    def __init__(self):
+        self.followers = 0
+        self.blocks = []
+        self.finished = False
+        self.result = None
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, block):
+        with self._cond:
+            self.blocks.append(block)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.finished = True
+            self.result = result
+            self.error = error
+            self._cond.notify_all()
+
+    def interrupt(self):
+        """Wake every follower so it can notice that it was cancelled"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def follow(self, timeout=FOLLOW_TIMEOUT, cancelled=None):
+        """Yield published blocks in order until the leader finishes, or until cancelled is set"""
+        position = 0
+        while True:
+            with self._cond:
+                while position == len(self.blocks) and not self.finished:
+                    if cancelled is not None and cancelled.is_set():
+                        return
+                    if not self._cond.wait(timeout):
+                        raise TimeoutError('Timed out waiting for the shared upstream stream')
+                blocks = self.blocks[position:]
+                position += len(blocks)
+                finished = self.finished and position == len(self.blocks)
+
+            yield from blocks
+            if finished:
+                return
+
+
+class SingleFlight:
+    """Coalesces concurrent identical upstream calls onto a single call
+
+    Keys are tuples whose first element names the kind of call ('models', 'chat', 'stream');
+    fan-out is counted per kind.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {}
+
+    def do(self, key, fn):
+        """Run fn() once for all concurrent callers with this key; all of them get its result or exception"""
+        call, leader = self.join(key, Call)
+        if not leader:
+            return call.wait()
+
+        try:
+            value = fn()
+        except BaseException as e:
+            call.resolve(error=e)
+            raise
+        else:
+            call.resolve(value)
+            return value
+        finally:
+            self.leave(key, call)
+
+    def join(self, key, factory=Broadcast):
+        """Return (flight, is_leader); a new flight is created with factory() if none is in progress
+
+        The leader must leave() once the flight is finished so later calls start afresh.
+        """
+        with self._lock:
+            stats = self._stats.get(key[0])
+            if stats is None:
+                stats = self._stats[key[0]] = {'calls': 0, 'coalesced': 0, 'in_flight': 0, 'max_fanout': 1}
+
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = factory()
+                stats['calls'] += 1
+                stats['in_flight'] += 1
+                return flight, True
+
+            flight.followers += 1
+            stats['coalesced'] += 1
+            stats['max_fanout'] = max(stats['max_fanout'], flight.followers + 1)
+            return flight, False
+
+    def in_flight(self, key):
+        """True while a call with this key is running"""
+        with self._lock:
+            return key in self._flights
+
+    def leave(self, key, flight):
+        """Retire a finished flight"""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+                self._stats[key[0]]['in_flight'] -= 1
+
+    def stats(self):
+        """Per kind: upstream calls made, requests that joined one instead, and the widest fan-out"""
+        with self._lock:
+            return {kind: dict(stats) for kind, stats in self._stats.items()}
@@ -15,6 +15,7 @@ def find_free_port():
 def main():
     """Start the Flask app on an available port"""
     port = find_free_port()
+    production = '--production' in sys.argv[1:]
     
     print("🤖 OpenRouter Chat UI")
     print("=" * 50)
@@ -24,6 +25,11 @@ def main():
     print("🛑 Press Ctrl+C to stop the server")
     print("=" * 50)
     
+    if production:
+        # Run the production launcher (multi-process gunicorn) on the free port
+        os.environ['PORT'] = str(port)
+        os.execvp(sys.executable, [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'])
+    
     # Import and start the Flask app
     from app import app
     app.run(debug=False, host='0.0.0.0', port=port)
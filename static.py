@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import re
+import threading
+
+from catalog import EncodedBody
+
+# The only files served besides the API; everything else in the project root stays private
+ASSETS = ('style.css', 'script.js')
+INDEX = 'index.html'
+
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8'
+}
+
+# Fingerprinted names never change content, so browsers and proxies may keep them for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# index.html and unhashed names are revalidated on every load (a cheap 304)
+REVALIDATE = 'no-cache'
+
+
+class StaticFile:
+    """One served file: its pre-compressed body, content type and caching policy"""
+
+    def __init__(self, body, content_type, cache_control):
+        self.encoded = EncodedBody(body, hashlib.sha256(body).hexdigest()[:16])
+        self.content_type = content_type
+        self.cache_control = cache_control
+
+
+class StaticBundle:
+    """The chat UI's static files, fingerprinted and compressed once at startup
+
+    Each asset is also served as name.<hash>.ext with an immutable Cache-Control, and
+    index.html is rewritten to reference those names, so a browser fetches an asset once per
+    release and never asks again. Only index.html and the allowlisted assets are served.
+    With reload on (development), files are re-read whenever one of them changes on disk.
+    """
+
+    def __init__(self, root, assets=ASSETS, index=INDEX, reload=False):
+        self.root = root
+        self.asset_names = tuple(assets)
+        self.index_name = index
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._mtimes = None
+        self.files = {}
+        self.hashed = {}
+        self.build()
+
+    def _paths(self):
+        return [os.path.join(self.root, name) for name in (self.index_name,) + self.asset_names]
+
+    def _read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    def build(self):
+        """Read, fingerprint and compress every file, then swap them in at once"""
+        mtimes = [os.path.getmtime(path) for path in self._paths()]
+        files = {}
+        hashed = {}
+        for name in self.asset_names:
+            body = self._read(name)
+            stem, ext = os.path.splitext(name)
+            hashed[name] = f'{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}'
+            content_type = CONTENT_TYPES.get(ext, 'application/octet-stream')
+            files[hashed[name]] = StaticFile(body, content_type, IMMUTABLE)
+            # Old pages and hand-written links still work, just without the long cache
+            files[name] = StaticFile(body, content_type, REVALIDATE)
+
+        index = self._read(self.index_name).decode('utf-8')
+        for name, hashed_name in hashed.items():
+            index = re.sub(rf'''(\b(?:src|href)=["']){re.escape(name)}(["'])''', rf'\g<1>{hashed_name}\g<2>', index)
+        files[self.index_name] = StaticFile(index.encode('utf-8'), CONTENT_TYPES['.html'], REVALIDATE)
+
+        with self._lock:
+            self.files = files
+            self.hashed = hashed
+            self._mtimes = mtimes
+
+    def get(self, name):
+        """The StaticFile served under name, or None if it is not part of the bundle"""
+        if self.reload:
+            try:
+                changed = [os.path.getmtime(path) for path in self._paths()] != self._mtimes
+            except OSError:
+                changed = False
+            if changed:
+                self.build()
+        return self.files.get(name)
+
+    def respond(self, name, if_none_match, accept_encodings):
+        """(status, headers, body) for a GET of name, or None if it is not served
+
+        accept_encodings maps a content-coding to a truthy value when the client accepts it.
+        """
+        static_file = self.get(name)
+        if static_file is None:
+            return None
+
+        encoded = static_file.encoded
+        headers = {
+            'Content-Type': static_file.content_type,
+            'Cache-Control': static_file.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if encoded.matches(if_none_match):
+            _, _, headers['ETag'] = encoded.negotiate(accept_encodings)
+            return 304, headers, b''
+
+        body, content_encoding, headers['ETag'] = encoded.negotiate(accept_encodings)
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        return 200, headers, body
+
+    def stats(self):
+        """Served names and their sizes per encoding"""
+        with self._lock:
+            files = dict(self.files)
+        return {
+            'assets': dict(self.hashed),
+            'bytes': {
+                name: {'identity': len(f.encoded.body), 'gzip': len(f.encoded.gzip_body),
+                       'br': len(f.encoded.br_body) if f.encoded.br_body is not None else None}
+                for name, f in files.items() if name not in self.hashed
+            }
+        }
+
+
+def accepted_encodings(header):
+    """Parse an Accept-Encoding header into {coding: True} for every coding not refused with q=0"""
+    accepted = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = params.strip()
+        accepted[coding] = not (quality.startswith('q=') and quality[2:].strip() in ('0', '0.0', '0.00', '0.000'))
+    return {'br': accepted.get('br', False), 'gzip': accepted.get('gzip', False)}
+
+
+def static_from_env(root):
+    """Build the StaticBundle for root; FLASK_DEBUG=1 (or STATIC_RELOAD=1) re-reads edited files"""
+    reload = os.environ.get('STATIC_RELOAD', os.environ.get('FLASK_DEBUG', '0')) == '1'
+    return StaticBundle(root, reload=reload)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import os
+import secrets
+import socket
+import threading
+import time
+
+# How often the watcher checks open client connections for a disconnect
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Peeking without blocking needs MSG_DONTWAIT; without it (Windows) disconnects are only seen on write
+PEEK_FLAGS = socket.MSG_PEEK | getattr(socket, 'MSG_DONTWAIT', 0)
+CAN_WATCH = hasattr(socket, 'MSG_DONTWAIT')
+
+
+class ActiveStream:
+    """One streamed response in progress, which another thread may cancel
+
+    The streaming code names how to stop whatever it is currently waiting on with on_cancel();
+    cancel() sets the cancelled event and calls that, so a blocked read or wait ends at once.
+    """
+
+    def __init__(self, stream_id, model_id, client_id):
+        self.id = stream_id
+        self.model_id = model_id
+        self.client_id = client_id
+        self.started = time.time()
+        self.reason = None
+        self.cancelled = threading.Event()
+        self._stop = None
+        self._lock = threading.Lock()
+
+    def on_cancel(self, stop):
+        """Make stop() the way to interrupt the current stage; called at once if already cancelled"""
+        with self._lock:
+            self._stop = stop
+            if not self.cancelled.is_set():
+                return
+        if stop is not None:
+            stop()
+
+    def cancel(self, reason='cancelled'):
+        """Cancel the stream; False if it already was"""
+        with self._lock:
+            if self.cancelled.is_set():
+                return False
+            self.reason = reason
+            self.cancelled.set()
+            stop = self._stop
+        if stop is not None:
+            try:
+                stop()
+            except Exception as e:
+                print(f"Error cancelling stream {self.id}: {e}")
+        return True
+
+
+class StreamRegistry:
+    """Streams in progress in this process, by id, for cancelling and disconnect detection
+
+    A stream opened with its client's socket is watched by one background thread, which peeks
+    at every watched socket each poll interval: a socket that reads as closed means the client
+    went away, and its stream is cancelled straight away instead of on the next failed write.
+    Stream ids are unguessable, so knowing one is what entitles a caller to cancel it.
+    """
+
+    def __init__(self, poll_interval=DISCONNECT_POLL_INTERVAL, watch=True):
+        self.poll_interval = poll_interval
+        self.watch = watch
+        self._lock = threading.Lock()
+        self._streams = {}
+        # stream id -> duplicate of the client socket, closed when the stream ends
+        self._sockets = {}
+        self._watcher = None
+        self._counters = {'opened': 0, 'cancelled': 0, 'disconnected': 0}
+
+    def open(self, model_id, client_id, client_socket=None):
+        """Register a new stream; returns its ActiveStream"""
+        active = ActiveStream(secrets.token_urlsafe(16), model_id, client_id)
+        watched = None
+        if self.watch and CAN_WATCH and client_socket is not None:
+            watched = self._duplicate(client_socket)
+        with self._lock:
+            self._streams[active.id] = active
+            self._counters['opened'] += 1
+            if watched is not None:
+                self._sockets[active.id] = watched
+                if self._watcher is None:
+                    self._watcher = threading.Thread(target=self._watch, name='disconnect-watcher', daemon=True)
+                    self._watcher.start()
+        return active
+
+    def close(self, active):
+        """Forget a finished stream and stop watching its client"""
+        with self._lock:
+            self._streams.pop(active.id, None)
+            watched = self._sockets.pop(active.id, None)
+            if active.cancelled.is_set():
+                self._counters['disconnected' if active.reason == 'disconnected' else 'cancelled'] += 1
+        if watched is not None:
+            watched.close()
+
+    def cancel(self, stream_id, reason='cancelled'):
+        """Cancel a stream by id; False if no such stream is in progress"""
+        with self._lock:
+            active = self._streams.get(stream_id)
+        if active is None:
+            return False
+        active.cancel(reason)
+        return True
+
+    def _duplicate(self, client_socket):
+        """A private handle on the client connection, so peeking never touches the server's socket object"""
+        try:
+            return client_socket.dup()
+        except (AttributeError, OSError):
+            return None
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = list(self._sockets.items())
+
+            for stream_id, sock in watched:
+                try:
+                    data = sock.recv(1, PEEK_FLAGS)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b''
+                except ValueError:
+                    # An SSL socket refuses recv flags; leave it to write failures
+                    data = None
+
+                if data == b'':
+                    self.cancel(stream_id, 'disconnected')
+                # Readable with data (a pipelined request) or unpeekable: nothing more to learn from it
+                with self._lock:
+                    if self._sockets.get(stream_id) is sock:
+                        del self._sockets[stream_id]
+                sock.close()
+
+    def stats(self):
+        """Streams in progress and how many ended early"""
+        with self._lock:
+            return {'active': len(self._streams), 'watched': len(self._sockets), **self._counters}
+
+
+def client_socket(environ):
+    """The client connection of a WSGI request, where the server exposes it (gunicorn, werkzeug, async_app's bridge)"""
+    return environ.get('gunicorn.socket') or environ.get('werkzeug.socket') or environ.get('aiohttp.socket')
+
+
+def registry_from_env():
+    """Build a StreamRegistry configured from environment variables"""
+    return StreamRegistry(
+        poll_interval=float(os.environ.get('DISCONNECT_POLL_INTERVAL', DISCONNECT_POLL_INTERVAL)),
+        watch=os.environ.get('DISCONNECT_WATCH', '1') == '1'
+    )
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openrouter import start_fake_server
+
+
+@pytest.fixture
+def fake_server():
+    """Start a fake OpenRouter on a free port; call it with FakeOpenRouterServer options"""
+    servers = []
+
+    def start(**options):
+        server = start_fake_server(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
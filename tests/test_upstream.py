@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from upstream import AsyncUpstreamClient, PoolTimeout, UpstreamClient
+
+CHAT = {'model': 'test/model:free', 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+
+def test_pool_timeout_when_every_connection_is_busy(fake_server):
+    server = fake_server()
+    client = UpstreamClient(server.base_url, pool_size=1, pool_timeout=0.2)
+    held = client.post('/chat/completions', json={**CHAT, 'stream': True}, stream=True)
+    try:
+        started = time.monotonic()
+        with pytest.raises(PoolTimeout):
+            client.post('/chat/completions', json=CHAT)
+        assert time.monotonic() - started < 2
+        assert client.stats()['pool_timeouts'] == 1
+    finally:
+        held.close()
+
+    # The connection is back in the pool once the stream is closed
+    assert client.post('/chat/completions', json=CHAT).status_code == 200
+    assert client.stats()['in_flight'] == 0
+    client.close()
+
+
+def test_retry_after_is_capped_at_max_backoff(fake_server):
+    server = fake_server(fail_first=1, fail_status=429, retry_after=30)
+    client = UpstreamClient(server.base_url, max_backoff=0.2)
+
+    started = time.monotonic()
+    response = client.post('/chat/completions', json=CHAT)
+
+    assert response.status_code == 200
+    assert time.monotonic() - started < 5
+    assert client.stats()['retries'] == 1
+    client.close()
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_post_is_retried_on_rate_limits_and_server_errors(fake_server, status):
+    server = fake_server(fail_first=2, fail_status=status, retry_after=0)
+    client = UpstreamClient(server.base_url, max_retries=2, backoff=0.01)
+
+    response = client.post('/chat/completions', json=CHAT)
+
+    assert response.status_code == 200
+    assert server.stats['chat_requests'] == 3
+    assert client.stats()['retries'] == 2
+    client.close()
+
+
+def test_post_gives_up_after_max_retries(fake_server):
+    server = fake_server(fail_first=5, fail_status=503)
+    client = UpstreamClient(server.base_url, max_retries=2, backoff=0.01)
+
+    assert client.post('/chat/completions', json=CHAT).status_code == 503
+    assert server.stats['chat_requests'] == 3
+    client.close()
+
+
+def test_rate_limits_are_returned_when_the_scheduler_handles_them(fake_server):
+    server = fake_server(fail_first=1, fail_status=429, retry_after=30)
+    client = UpstreamClient(server.base_url, backoff=0.01, retry_rate_limits=False)
+
+    response = client.post('/chat/completions', json=CHAT)
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+    assert server.stats['chat_requests'] == 1
+    client.close()
+
+
+def test_async_client_returns_rate_limits_when_the_scheduler_handles_them(fake_server):
+    server = fake_server(fail_first=2, fail_status=429, retry_after=0)
+
+    async def post(client):
+        try:
+            response = await client.request('POST', '/chat/completions', json=CHAT)
+            client.release(response)
+            return response.status
+        finally:
+            await client.close()
+
+    assert asyncio.run(post(AsyncUpstreamClient(server.base_url, retry_rate_limits=False))) == 429
+    assert asyncio.run(post(AsyncUpstreamClient(server.base_url, backoff=0.01))) == 200
+    assert server.stats['chat_requests'] == 3
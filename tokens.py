@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import math
+import threading
+import time
+
+try:
+    import tiktoken
+except ImportError:  # Optional: exact counts for GPT-family models
+    tiktoken = None
+
+# Average characters per token for Latin-script text, by catalog architecture.tokenizer
+CHARS_PER_TOKEN = {
+    'GPT': 4.0,
+    'Claude': 3.5,
+    'Gemini': 4.0,
+    'Llama3': 4.2,
+    'Llama4': 4.2,
+    'Llama2': 3.6,
+    'Mistral': 3.7,
+    'Qwen': 3.9,
+    'Qwen3': 3.9,
+    'DeepSeek': 3.9,
+    'Cohere': 4.0,
+    'Grok': 4.0,
+    'Nova': 4.0,
+    'Yi': 3.6,
+    'Router': 4.0,
+    'Other': 3.8
+}
+DEFAULT_CHARS_PER_TOKEN = 3.8
+
+# Chat templates wrap every message in a few role/separator tokens
+TOKENS_PER_MESSAGE = 4
+
+_encodings = {}
+
+
+def _tiktoken_encoding(tokenizer):
+    """A tiktoken encoding for GPT-family tokenizers, or None"""
+    if tiktoken is None or tokenizer != 'GPT':
+        return None
+    if 'o200k_base' not in _encodings:
+        try:
+            _encodings['o200k_base'] = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _encodings['o200k_base'] = None
+    return _encodings['o200k_base']
+
+
+def estimate_tokens(text, tokenizer=None):
+    """Estimate how many tokens text is for a model with the given catalog tokenizer"""
+    if not text:
+        return 0
+
+    encoding = _tiktoken_encoding(tokenizer)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    # Non-ASCII text (CJK, emoji, accents) packs far fewer characters into a token
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    other_chars = len(text) - ascii_chars
+    chars_per_token = CHARS_PER_TOKEN.get(tokenizer, DEFAULT_CHARS_PER_TOKEN)
+    return max(1, math.ceil(ascii_chars / chars_per_token + other_chars * 0.8))
+
+
+def estimate_message_tokens(message, tokenizer=None):
+    """Estimate the prompt tokens one chat message costs"""
+    return estimate_tokens(message.get('content') or '', tokenizer) + TOKENS_PER_MESSAGE
+
+
+def estimate_usage(messages, completion, tokenizer=None):
+    """Estimated usage block for a completion when upstream did not report one"""
+    prompt_tokens = sum(estimate_message_tokens(m, tokenizer) for m in messages)
+    completion_tokens = estimate_tokens(completion, tokenizer)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+        'estimated': True
+    }
+
+
+def normalize_usage(usage):
+    """Keep the counts we report from an upstream usage block"""
+    prompt_tokens = int(usage.get('prompt_tokens') or 0)
+    completion_tokens = int(usage.get('completion_tokens') or 0)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': int(usage.get('total_tokens') or prompt_tokens + completion_tokens),
+        'estimated': False
+    }
+
+
+class UsageStats:
+    """Per-model token totals and generation throughput for capacity planning"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self.started_at = time.time()
+
+    def record(self, model_id, usage, duration=None):
+        """Add one completed request's usage (and generation time in seconds, if known)"""
+        with self._lock:
+            stats = self._models.get(model_id)
+            if stats is None:
+                stats = self._models[model_id] = {
+                    'requests': 0,
+                    'estimated_requests': 0,
+                    'prompt_tokens': 0,
+                    'completion_tokens': 0,
+                    'total_tokens': 0,
+                    'generation_seconds': 0.0
+                }
+            stats['requests'] += 1
+            if usage.get('estimated'):
+                stats['estimated_requests'] += 1
+            stats['prompt_tokens'] += usage.get('prompt_tokens', 0)
+            stats['completion_tokens'] += usage.get('completion_tokens', 0)
+            stats['total_tokens'] += usage.get('total_tokens', 0)
+            if duration:
+                stats['generation_seconds'] += duration
+
+    def snapshot(self):
+        """Per-model and aggregate totals with derived throughput"""
+        with self._lock:
+            models = {model_id: dict(stats) for model_id, stats in self._models.items()}
+
+        totals = {'requests': 0, 'estimated_requests': 0, 'prompt_tokens': 0,
+                  'completion_tokens': 0, 'total_tokens': 0, 'generation_seconds': 0.0}
+        for stats in models.values():
+            for key in totals:
+                totals[key] += stats[key]
+            stats['completion_tokens_per_second'] = _rate(stats['completion_tokens'], stats['generation_seconds'])
+
+        uptime = time.time() - self.started_at
+        totals['completion_tokens_per_second'] = _rate(totals['completion_tokens'], totals['generation_seconds'])
+        totals['tokens_per_minute'] = round(totals['total_tokens'] / uptime * 60, 1) if uptime > 0 else 0.0
+        totals['uptime_seconds'] = round(uptime, 1)
+
+        return {'models': models, 'totals': totals}
+
+
+def _rate(tokens, seconds):
+    return round(tokens / seconds, 1) if seconds > 0 else None
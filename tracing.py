@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import contextvars
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Finished traces kept for /api/debug/slow
+TRACE_HISTORY = 500
+# Profiled requests at least this slow get their profile written out
+SLOW_REQUEST_SECONDS = 2.0
+# Seconds between stack samples of a profiled request
+PROFILE_INTERVAL = 0.005
+MAX_PROFILE_DEPTH = 64
+
+# A client's X-Request-ID is passed on only if it looks like an id; anything else gets a fresh one
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """The timed stages (spans) of one request
+
+    Span times are on the time.monotonic() clock, so durations measured elsewhere (a stream's
+    time to first token) can be added after the fact with add().
+    """
+
+    def __init__(self, request_id, name):
+        self.request_id = request_id
+        self.name = name
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.ended = None
+        self.status = None
+        self.attrs = {}
+        self.spans = []
+        # Folded stack -> samples, while the request is being profiled
+        self.profile = None
+        self.profile_path = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block; the yielded dict takes attributes learned inside it"""
+        start = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs.setdefault('error', type(e).__name__)
+            raise
+        finally:
+            self.add(name, start, time.monotonic(), **attrs)
+
+    def add(self, name, start, end=None, **attrs):
+        """Record a span that has already happened"""
+        with self._lock:
+            self.spans.append((name, start, time.monotonic() if end is None else end, attrs))
+
+    def annotate(self, **attrs):
+        """Attach request-level attributes, such as the model asked for"""
+        self.attrs.update(attrs)
+
+    @property
+    def duration(self):
+        return (self.ended or time.monotonic()) - self.started
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span[1])
+        return {
+            'request_id': self.request_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 1),
+            'status': self.status,
+            'attrs': dict(self.attrs),
+            'spans': [
+                {'name': name, 'start_ms': round((start - self.started) * 1000, 1),
+                 'duration_ms': round((end - start) * 1000, 1), **attrs}
+                for name, start, end, attrs in spans
+            ],
+            'profile': self.profile_path
+        }
+
+
+class Tracer:
+    """Starts and keeps request traces, and profiles a sample of requests
+
+    A sampled request's thread is stack-sampled every profile_interval seconds by one
+    background thread for as long as the request runs; if it turns out slower than
+    slow_threshold, the samples are written to profile_dir as folded stacks (one
+    "frame;frame;frame count" line per stack, the input flamegraph.pl and speedscope read).
+    """
+
+    def __init__(self, history=TRACE_HISTORY, slow_threshold=SLOW_REQUEST_SECONDS, profile_dir=None,
+                 profile_rate=0.0, profile_interval=PROFILE_INTERVAL):
+        self.slow_threshold = slow_threshold
+        self.profile_dir = profile_dir
+        self.profile_rate = profile_rate if profile_dir else 0.0
+        self.profile_interval = profile_interval
+        self._finished = deque(maxlen=history)
+        self._lock = threading.Lock()
+        # thread ident -> the Trace whose request that thread is serving
+        self._profiled = {}
+        self._wake = threading.Event()
+        self._sampler = None
+        self._counters = {'finished': 0, 'slow': 0, 'profiled': 0, 'profiles_written': 0}
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def start(self, name, request_id=None, profile_thread=True):
+        """Begin tracing a request and make it current; profile_thread=False where the thread is shared (asyncio)"""
+        if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        trace = Trace(request_id, name)
+        _current.set(trace)
+
+        if profile_thread and self.profile_rate and random.random() < self.profile_rate:
+            trace.profile = Counter()
+            with self._lock:
+                self._profiled[threading.get_ident()] = trace
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample, name='trace-profiler', daemon=True)
+                    self._sampler.start()
+            self._wake.set()
+        return trace
+
+    def finish(self, trace, status=None):
+        """End a trace, keep it for slowest(), and write its profile if it was slow"""
+        if trace.ended is not None:
+            return
+        trace.ended = time.monotonic()
+        trace.status = status
+
+        profiled = False
+        with self._lock:
+            for ident, profiled_trace in list(self._profiled.items()):
+                if profiled_trace is trace:
+                    del self._profiled[ident]
+                    profiled = True
+            self._finished.append(trace)
+            self._counters['finished'] += 1
+            slow = trace.duration >= self.slow_threshold
+            if slow:
+                self._counters['slow'] += 1
+            if profiled:
+                self._counters['profiled'] += 1
+
+        if profiled and slow and trace.profile:
+            self._write_profile(trace)
+
+    def slowest(self, limit=20, name=None):
+        """The slowest recent finished traces, slowest first, optionally only those named name"""
+        with self._lock:
+            traces = [trace for trace in self._finished if name is None or trace.name == name]
+        traces.sort(key=lambda trace: trace.duration, reverse=True)
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def _sample(self):
+        while True:
+            with self._lock:
+                profiled = list(self._profiled.items())
+            if not profiled:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            frames = sys._current_frames()
+            for ident, trace in profiled:
+                frame = frames.get(ident)
+                if frame is not None:
+                    trace.profile[fold_stack(frame)] += 1
+            del frames
+            time.sleep(self.profile_interval)
+
+    def _write_profile(self, trace):
+        path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.request_id}.folded")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in trace.profile.most_common():
+                    f.write(f'{stack} {count}\n')
+        except OSError as e:
+            print(f"Error writing request profile: {e}")
+            return
+        trace.profile_path = path
+        with self._lock:
+            self._counters['profiles_written'] += 1
+
+    def stats(self):
+        """Trace and profile counters"""
+        with self._lock:
+            return {
+                'kept': len(self._finished),
+                'slow_threshold_seconds': self.slow_threshold,
+                'profile_rate': self.profile_rate,
+                'profiling': len(self._profiled),
+                **self._counters
+            }
+
+
+def fold_stack(frame):
+    """One sampled stack in folded form, outermost frame first"""
+    names = []
+    while frame is not None and len(names) < MAX_PROFILE_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def current_trace():
+    """The trace of the request being served in this context, or None"""
+    return _current.get()
+
+
+def activate_trace(trace):
+    """Make trace current, e.g. in a response generator or worker thread serving its request"""
+    _current.set(trace)
+
+
+@contextmanager
+def trace_span(name, **attrs):
+    """Time a block as a span of the current trace; does nothing outside a traced request"""
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+
+def tracer_from_env():
+    """Build a Tracer configured from environment variables (PROFILE_DIR enables sampled profiling)"""
+    return Tracer(
+        history=int(os.environ.get('TRACE_HISTORY', TRACE_HISTORY)),
+        slow_threshold=float(os.environ.get('SLOW_REQUEST_SECONDS', SLOW_REQUEST_SECONDS)),
+        profile_dir=os.environ.get('PROFILE_DIR') or None,
+        profile_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0.1))
+    )
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util.retry import Retry
+
+from metrics import Histogram
+
+try:
+    import aiohttp
+except ImportError:  # Only needed for the async serving mode
+    aiohttp = None
+
+OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+
+# Upstream statuses worth retrying before any response bytes reach the client
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Seconds a caller waits for a free pooled connection before giving up with PoolTimeout
+POOL_TIMEOUT = 10
+
+CONNECT_SECONDS = Histogram(
+    'upstream_connect_seconds', 'Time to open a new upstream connection, including TLS',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+RESPONSE_SECONDS = Histogram(
+    'upstream_response_seconds', 'Time from sending an upstream request to its response headers, including retries',
+    ('path',)
+)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        CONNECT_SECONDS.observe(time.perf_counter() - started)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        CONNECT_SECONDS.observe(time.perf_counter() - started)
+
+
+class PoolTimeout(requests.exceptions.Timeout):
+    """Raised when every pooled upstream connection stays busy for longer than the pool timeout"""
+
+
+class BoundedWaitPool:
+    """Connection pool mixin: a blocking pool waits at most pool_timeout for a free connection"""
+
+    pool_timeout = None
+
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout=self.pool_timeout if timeout is None else timeout)
+
+
+class TimedHTTPConnectionPool(BoundedWaitPool, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(BoundedWaitPool, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools record how long each new connection takes to open and bound the wait for one"""
+
+    def __init__(self, pool_timeout=None, **kwargs):
+        # Set first: HTTPAdapter.__init__ builds the pool manager
+        self.pool_timeout = pool_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # The pool manager constructs pools itself, so the timeout travels on per-adapter subclasses
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(cls.__name__, (cls,), {'pool_timeout': self.pool_timeout})
+            for scheme, cls in (('http', TimedHTTPConnectionPool), ('https', TimedHTTPSConnectionPool))
+        }
+
+
+class BoundedRetry(Retry):
+    """urllib3 Retry that never sleeps longer than backoff_max, even for long Retry-After values
+
+    Only statuses in status_forcelist are retried; plain Retry also retries any 413/429/503 that
+    carries a Retry-After header.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if self.status_forcelist is not None and status_code not in self.status_forcelist:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.backoff_max)
+
+
+def retry_statuses(retry_rate_limits):
+    """Statuses to retry; without 429 when the caller's admission scheduler handles rate limits
+
+    A retried 429 sleeps out Retry-After inside the call, holding the caller's scheduler slot the
+    whole time. Handed back instead, the scheduler learns the limit and keeps the model's requests
+    queued, without a slot, until it lifts.
+    """
+    return RETRY_STATUSES if retry_rate_limits else tuple(status for status in RETRY_STATUSES if status != 429)
+
+
+class UpstreamClient:
+    """Shared keep-alive HTTP client for all OpenRouter calls"""
+
+    def __init__(self, base_url=OPENROUTER_BASE_URL, pool_size=32, max_retries=2, backoff=0.5, max_backoff=4,
+                 pool_timeout=POOL_TIMEOUT, retry_rate_limits=True):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.retry_statuses = retry_statuses(retry_rate_limits)
+
+        retry = BoundedRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=self.retry_statuses,
+            allowed_methods=None,  # Chat completions are POSTs; retrying them is safe before streaming starts
+            backoff_factor=backoff,
+            backoff_max=max_backoff,
+            raise_on_status=False
+        )
+
+        # pool_block bounds the number of sockets per worker; extra callers wait up to pool_timeout
+        # for a free connection, so calls outside the scheduler (catalog fetches) cannot hang on it
+        adapter = TimedHTTPAdapter(pool_timeout=pool_timeout, pool_connections=4, pool_maxsize=pool_size,
+                                   pool_block=True, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self._adapter = adapter
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._retries = 0
+        self._errors = 0
+        self._pool_timeouts = 0
+
+    def url(self, path):
+        """Absolute upstream URL for an API path like /chat/completions"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, stream=False, **kwargs):
+        """Send a request through the pool; streamed responses hold their connection until closed
+
+        Raises PoolTimeout (a requests Timeout) if no connection frees up within pool_timeout.
+        """
+        self._acquire()
+        try:
+            response = self.session.request(method, self.url(path), stream=stream, **kwargs)
+        except EmptyPoolError:
+            self._release(error=True)
+            with self._lock:
+                self._pool_timeouts += 1
+            raise PoolTimeout(f"No upstream connection came free within {self.pool_timeout}s "
+                              f"(all {self.pool_size} in use)") from None
+        except Exception:
+            self._release(error=True)
+            raise
+
+        RESPONSE_SECONDS.labels(path).observe(response.elapsed.total_seconds())
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            with self._lock:
+                self._retries += len(retries.history)
+
+        if not stream:
+            self._release()
+            return response
+
+        # Track the connection as busy until the caller closes the streamed response
+        original_close = response.close
+        released = []
+
+        def close():
+            if not released:
+                released.append(True)
+                self._release()
+            original_close()
+
+        response.close = close
+        return response
+
+    def get(self, path, **kwargs):
+        """GET an upstream API path"""
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        """POST to an upstream API path"""
+        return self.request('POST', path, **kwargs)
+
+    def _acquire(self):
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _release(self, error=False):
+        with self._lock:
+            self._in_flight -= 1
+            if error:
+                self._errors += 1
+
+    def stats(self):
+        """Return pool utilization counters"""
+        connections_opened = 0
+        idle_connections = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            # Evicted between keys() and get(), or already closed
+            if pool is None or pool.pool is None:
+                continue
+            connections_opened += pool.num_connections
+            idle_connections += sum(1 for conn in list(getattr(pool.pool, 'queue', ())) if conn is not None)
+
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'utilization': round(self._in_flight / self.pool_size, 3),
+                'idle_connections': idle_connections,
+                'connections_opened': connections_opened,
+                'requests': self._requests,
+                'retries': self._retries,
+                'errors': self._errors,
+                'pool_timeouts': self._pool_timeouts
+            }
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+
+class AsyncUpstreamClient:
+    """asyncio counterpart of UpstreamClient, used by the async serving mode"""
+
+    def __init__(self, base_url=OPENROUTER_BASE_URL, pool_size=1000, max_retries=2, backoff=0.5, max_backoff=4,
+                 retry_rate_limits=True):
+        if aiohttp is None:
+            raise RuntimeError("The async serving mode requires aiohttp (pip install aiohttp)")
+
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.retry_statuses = retry_statuses(retry_rate_limits)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        # Created lazily so the session binds to the serving event loop
+        self._session = None
+
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._requests = 0
+        self._retries = 0
+        self._errors = 0
+
+    def url(self, path):
+        """Absolute upstream URL for an API path like /chat/completions"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def session(self):
+        """The pooled keep-alive session for this event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_start.append(_connect_started)
+            trace.on_connection_create_end.append(_connect_finished)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={'Content-Type': 'application/json'},
+                trace_configs=[trace]
+            )
+        return self._session
+
+    def _retry_delay(self, attempt, response=None):
+        """Exponential backoff, or the upstream Retry-After when given, capped at max_backoff"""
+        delay = self.backoff * (2 ** attempt)
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = float(retry_after)
+        return min(delay, self.max_backoff)
+
+    async def request(self, method, path, timeout=30, **kwargs):
+        """Send a request, retrying connect errors and retry_statuses; the caller must release() the response"""
+        self._requests += 1
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                response = await self.session().request(method, self.url(path), timeout=client_timeout, **kwargs)
+            except (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError):
+                if attempt >= self.max_retries:
+                    self._errors += 1
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt))
+                attempt += 1
+                self._retries += 1
+                continue
+
+            if response.status in self.retry_statuses and attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                response.release()
+                await asyncio.sleep(delay)
+                attempt += 1
+                self._retries += 1
+                continue
+
+            RESPONSE_SECONDS.labels(path).observe(time.perf_counter() - started)
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            return response
+
+    def release(self, response):
+        """Return a response's connection to the pool"""
+        self._in_flight -= 1
+        response.release()
+
+    def stats(self):
+        """Return pool utilization counters"""
+        return {
+            'pool_size': self.pool_size,
+            'in_flight': self._in_flight,
+            'peak_in_flight': self._peak_in_flight,
+            'utilization': round(self._in_flight / self.pool_size, 3),
+            'requests': self._requests,
+            'retries': self._retries,
+            'errors': self._errors
+        }
+
+    async def close(self):
+        """Close all pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+
+
+async def _connect_started(session, context, params):
+    context.connect_started = time.perf_counter()
+
+
+async def _connect_finished(session, context, params):
+    CONNECT_SECONDS.observe(time.perf_counter() - context.connect_started)
+
+
+def client_from_env(retry_rate_limits=True):
+    """Build an UpstreamClient configured from environment variables"""
+    return UpstreamClient(
+        base_url=os.environ.get('OPENROUTER_BASE_URL', OPENROUTER_BASE_URL),
+        pool_size=int(os.environ.get('UPSTREAM_POOL_SIZE', 32)),
+        pool_timeout=float(os.environ.get('UPSTREAM_POOL_TIMEOUT', POOL_TIMEOUT)),
+        max_retries=int(os.environ.get('UPSTREAM_MAX_RETRIES', 2)),
+        backoff=float(os.environ.get('UPSTREAM_RETRY_BACKOFF', 0.5)),
+        max_backoff=float(os.environ.get('UPSTREAM_RETRY_MAX_BACKOFF', 4)),
+        retry_rate_limits=retry_rate_limits
+    )
+
+
+def async_client_from_env(retry_rate_limits=True):
+    """Build an AsyncUpstreamClient configured from environment variables"""
+    return AsyncUpstreamClient(
+        base_url=os.environ.get('OPENROUTER_BASE_URL', OPENROUTER_BASE_URL),
+        pool_size=int(os.environ.get('ASYNC_UPSTREAM_POOL_SIZE', 1000)),
+        max_retries=int(os.environ.get('UPSTREAM_MAX_RETRIES', 2)),
+        backoff=float(os.environ.get('UPSTREAM_RETRY_BACKOFF', 0.5)),
+        max_backoff=float(os.environ.get('UPSTREAM_RETRY_MAX_BACKOFF', 4)),
+        retry_rate_limits=retry_rate_limits
+    )